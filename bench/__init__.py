@@ -0,0 +1,8 @@
+"""
+Benchmarks of the proxy's own overhead, run against a local stand-in for cloudcode-pa.
+
+    python -m bench.run_bench --concurrency 16 --requests 500
+    python -m bench.run_bench --compare bench/results/<earlier run>.json
+
+See mock_upstream.py for the upstream stand-in and run_bench.py for the load driver.
+"""
@@ -0,0 +1,132 @@
+"""
+Mock Upstream - A local stand-in for the cloudcode-pa endpoints the proxy calls.
+
+Serves v1internal:generateContent / streamGenerateContent, loadCodeAssist,
+retrieveUserQuota / fetchAvailableModels and the OAuth token endpoint, with configurable
+latency, stream shape and error/429 injection:
+
+    python -m bench.mock_upstream --port 9100 --latency 0.05 --chunks 20 --chunk-interval 0.01
+"""
+import argparse
+import asyncio
+import json
+import random
+
+import uvicorn
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
+
+
+class MockSettings:
+    """Behaviour of the stand-in; every request reads it, so it can be changed between runs."""
+
+    def __init__(self, latency=0.05, chunks=20, chunk_size=64, chunk_interval=0.01,
+                 error_rate=0.0, rate_limit_rate=0.0, seed=None):
+        self.latency = latency                  # seconds before the response headers
+        self.chunks = chunks                    # stream events per response
+        self.chunk_size = chunk_size            # characters of text per event
+        self.chunk_interval = chunk_interval    # seconds between stream events
+        self.error_rate = error_rate            # fraction of generation calls answered 500
+        self.rate_limit_rate = rate_limit_rate  # fraction of generation calls answered 429
+        self.random = random.Random(seed)
+
+
+def _candidate_response(text: str, output_tokens: int) -> dict:
+    return {
+        "candidates": [{"content": {"role": "model", "parts": [{"text": text}]}, "finishReason": "STOP", "index": 0}],
+        "usageMetadata": {"promptTokenCount": 16, "candidatesTokenCount": output_tokens, "totalTokenCount": 16 + output_tokens},
+    }
+
+
+def create_app(settings: MockSettings) -> FastAPI:
+    app = FastAPI()
+    app.state.settings = settings
+    text_chunk = ("lorem ipsum " * (settings.chunk_size // 12 + 1))[:settings.chunk_size]
+
+    def injected_error():
+        roll = settings.random.random()
+        if roll < settings.rate_limit_rate:
+            return JSONResponse({"error": {"code": 429, "message": "Resource has been exhausted", "details": [
+                {"@type": "type.googleapis.com/google.rpc.RetryInfo", "retryDelay": "1s"}
+            ]}}, status_code=429)
+        if roll < settings.rate_limit_rate + settings.error_rate:
+            return JSONResponse({"error": {"code": 500, "message": "Injected upstream error"}}, status_code=500)
+        return None
+
+    @app.post("/v1internal:generateContent")
+    async def generate_content(request: Request):
+        await request.body()
+        await asyncio.sleep(settings.latency)
+        error = injected_error()
+        if error is not None:
+            return error
+        body = {"response": _candidate_response(text_chunk * settings.chunks, settings.chunks), "traceId": "bench"}
+        return Response(json.dumps(body), media_type="application/json")
+
+    @app.post("/v1internal:streamGenerateContent")
+    async def stream_generate_content(request: Request):
+        await request.body()
+        await asyncio.sleep(settings.latency)
+        error = injected_error()
+        if error is not None:
+            return error
+
+        async def events():
+            for i in range(settings.chunks):
+                if i:
+                    await asyncio.sleep(settings.chunk_interval)
+                event = {"response": _candidate_response(text_chunk, i + 1), "traceId": "bench"}
+                yield f"data: {json.dumps(event)}\r\n\r\n".encode()
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @app.post("/v1internal:loadCodeAssist")
+    async def load_code_assist():
+        return {"currentTier": {"id": "standard-tier"}, "cloudaicompanionProject": "bench-project"}
+
+    @app.post("/v1internal:onboardUser")
+    async def onboard_user():
+        return {"done": True, "response": {"cloudaicompanionProject": {"id": "bench-project"}}}
+
+    @app.post("/v1internal:retrieveUserQuota")
+    async def retrieve_user_quota():
+        return {"buckets": []}
+
+    @app.post("/v1internal:fetchAvailableModels")
+    async def fetch_available_models():
+        return {"models": {}}
+
+    @app.post("/token")
+    async def token():
+        return {"access_token": "bench-token", "expires_in": 3600, "token_type": "Bearer"}
+
+    @app.get("/")
+    async def root():
+        return {"status": "ok"}
+
+    return app
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds before upstream answers")
+    parser.add_argument("--chunks", type=int, default=20, help="Stream events per response")
+    parser.add_argument("--chunk-size", type=int, default=64, help="Characters of text per event")
+    parser.add_argument("--chunk-interval", type=float, default=0.01, help="Seconds between stream events")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of calls answered 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Fraction of calls answered 429")
+
+
+def settings_from_args(args) -> MockSettings:
+    return MockSettings(
+        latency=args.latency, chunks=args.chunks, chunk_size=args.chunk_size, chunk_interval=args.chunk_interval,
+        error_rate=args.error_rate, rate_limit_rate=args.rate_limit_rate,
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in for cloudcode-pa")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    add_arguments(parser)
+    args = parser.parse_args()
+    uvicorn.run(create_app(settings_from_args(args)), host=args.host, port=args.port, log_level="warning")
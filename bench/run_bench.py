@@ -0,0 +1,341 @@
+"""
+Benchmark Driver - Measures the overhead the proxy adds on top of its upstream.
+
+Starts the mock upstream and a proxy pointed at it, then drives the OpenAI and native
+Gemini routes (non-streaming and streaming) at a fixed concurrency. Every scenario is
+also run directly against the mock, so the proxy's added latency and time-to-first-token
+overhead can be separated from the simulated upstream time. Results are saved as JSON
+and can be compared with an earlier run:
+
+    python -m bench.run_bench --concurrency 16 --requests 500
+    python -m bench.run_bench --compare bench/results/20260101-120000-abc1234.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+import httpx
+
+from .mock_upstream import add_arguments as add_mock_arguments
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(REPO_DIR, "bench", "results")
+PASSWORD = "bench"
+MODEL = "gemini-2.5-flash"
+SCENARIOS = ("openai", "openai-stream", "native", "native-stream")
+
+# ~1 KB prompt, so request transformation is exercised on a realistic body
+PROMPT = "Summarize the following text in one sentence. " + "The quick brown fox jumps over the lazy dog. " * 22
+
+
+def _scenario_requests(name: str, proxy_url: str, upstream_url: str):
+    """(proxy request, equivalent direct upstream request) as (url, json body) pairs."""
+    contents = [{"role": "user", "parts": [{"text": PROMPT}]}]
+    stream = name.endswith("-stream")
+    action = "streamGenerateContent?alt=sse" if stream else "generateContent"
+    upstream = (
+        f"{upstream_url}/v1internal:{action}",
+        {"model": MODEL, "project": "bench-project", "request": {"contents": contents}},
+    )
+    if name.startswith("openai"):
+        proxy = (
+            f"{proxy_url}/v1/chat/completions",
+            {"model": MODEL, "stream": stream, "messages": [{"role": "user", "content": PROMPT}]},
+        )
+    else:
+        proxy = (f"{proxy_url}/v1beta/models/{MODEL}:{action}", {"contents": contents})
+    return proxy, upstream
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait_until_up(url: str, proc: subprocess.Popen, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"{url} exited with code {proc.returncode} before becoming ready")
+        try:
+            if httpx.get(url, timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url} did not become ready within {timeout}s")
+
+
+def _process_usage(pid: int):
+    """(CPU seconds, RSS bytes) of a process, or (None, None) where it cannot be read."""
+    try:
+        import psutil
+        proc = psutil.Process(pid)
+        times = proc.cpu_times()
+        return times.user + times.system, proc.memory_info().rss
+    except ImportError:
+        pass
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        cpu = (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+        with open(f"/proc/{pid}/status") as f:
+            rss = next(int(line.split()[1]) * 1024 for line in f if line.startswith("VmRSS:"))
+        return cpu, rss
+    except (OSError, StopIteration, IndexError, ValueError):
+        return None, None
+
+
+async def _one_request(client: httpx.AsyncClient, url: str, body: dict, headers: dict, stream: bool) -> dict:
+    start = time.perf_counter()
+    first_byte = None
+    try:
+        async with client.stream("POST", url, json=body, headers=headers) as resp:
+            async for chunk in resp.aiter_raw():
+                if first_byte is None and chunk:
+                    first_byte = time.perf_counter()
+            status = resp.status_code
+    except httpx.HTTPError:
+        status = 0
+    end = time.perf_counter()
+    return {
+        "status": status,
+        "latency": end - start,
+        "ttft": (first_byte - start) if stream and first_byte is not None else None,
+    }
+
+
+async def _drive(url: str, body: dict, headers: dict, stream: bool, concurrency: int, total: int):
+    """Send `total` requests with at most `concurrency` in flight; returns (samples, wall seconds)."""
+    samples: List[dict] = []
+    remaining = total
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=120) as client:
+        async def worker():
+            nonlocal remaining
+            while remaining > 0:
+                remaining -= 1
+                samples.append(await _one_request(client, url, body, headers, stream))
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return samples, time.perf_counter() - start
+
+
+def _percentile(values: List[float], pct: float) -> Optional[float]:
+    if not values:
+        return None
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method="inclusive")[int(pct) - 1]
+
+
+def _summarize(samples: List[dict], wall: float) -> dict:
+    ok = [s for s in samples if s["status"] == 200]
+    latencies = [s["latency"] for s in ok]
+    ttfts = [s["ttft"] for s in ok if s["ttft"] is not None]
+    return {
+        "requests": len(samples),
+        "errors": len(samples) - len(ok),
+        "throughput_rps": round(len(ok) / wall, 2) if wall else None,
+        "latency_p50_ms": _ms(_percentile(latencies, 50)),
+        "latency_p99_ms": _ms(_percentile(latencies, 99)),
+        "ttft_p50_ms": _ms(_percentile(ttfts, 50)),
+        "ttft_p99_ms": _ms(_percentile(ttfts, 99)),
+    }
+
+
+def _ms(seconds: Optional[float]) -> Optional[float]:
+    return round(seconds * 1000, 2) if seconds is not None else None
+
+
+def _diff(a: Optional[float], b: Optional[float]) -> Optional[float]:
+    return round(a - b, 2) if a is not None and b is not None else None
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _start_processes(args, workdir: str):
+    """Start the mock upstream and a proxy pointed at it; returns (mock, proxy, proxy_url, upstream_url)."""
+    mock_port, proxy_port = _free_port(), _free_port()
+    upstream_url = f"http://127.0.0.1:{mock_port}"
+    proxy_url = f"http://127.0.0.1:{proxy_port}"
+
+    mock_cmd = [
+        sys.executable, "-m", "bench.mock_upstream", "--port", str(mock_port),
+        "--latency", str(args.latency), "--chunks", str(args.chunks), "--chunk-size", str(args.chunk_size),
+        "--chunk-interval", str(args.chunk_interval), "--error-rate", str(args.error_rate),
+        "--rate-limit-rate", str(args.rate_limit_rate),
+    ]
+    mock = subprocess.Popen(mock_cmd, cwd=REPO_DIR)
+    _wait_until_up(upstream_url + "/", mock)
+
+    credentials_file = os.path.join(workdir, "credentials.json")
+    expiry = (datetime.now(timezone.utc) + timedelta(hours=1)).strftime("%Y-%m-%dT%H:%M:%SZ")
+    with open(credentials_file, "w") as f:
+        json.dump({
+            "token": "bench-token", "refresh_token": "bench-refresh", "client_id": "bench", "client_secret": "bench",
+            "token_uri": f"{upstream_url}/token", "expiry": expiry,
+        }, f)
+
+    env = dict(os.environ)
+    env.update({
+        "GOOGLE_APPLICATION_CREDENTIALS": credentials_file,
+        "GOOGLE_CLOUD_PROJECT": "bench-project",
+        "GEMINI_AUTH_PASSWORD": PASSWORD,
+        "CLI_ENDPOINT": upstream_url,
+        "ANTI_ENDPOINT": upstream_url,
+        "ONBOARDING_CACHE_FILE": os.path.join(workdir, "onboarding_cache.json"),
+        "PROXY_WARMUP": "true",
+        "QUOTA_POLL_INTERVAL": "0",
+        "MODEL_CATALOG_TTL": "0",
+    })
+    env.pop("ACCOUNT_POOL", None)
+    log = open(os.path.join(workdir, "proxy.log"), "w")
+    proxy = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "src.main:app", "--host", "127.0.0.1", "--port", str(proxy_port),
+         "--log-level", "warning"],
+        cwd=REPO_DIR, env=env, stdout=log, stderr=subprocess.STDOUT,
+    )
+    _wait_until_up(proxy_url + "/ready", proxy)
+    return mock, proxy, proxy_url, upstream_url
+
+
+async def _run_scenarios(args, proxy_pid: int, proxy_url: str, upstream_url: str) -> Dict[str, dict]:
+    headers = {"Authorization": f"Bearer {PASSWORD}"}
+    results = {}
+    for name in args.scenarios:
+        stream = name.endswith("-stream")
+        (proxy_target, proxy_body), (upstream_target, upstream_body) = _scenario_requests(name, proxy_url, upstream_url)
+
+        # Warm connections and code paths before measuring
+        await _drive(proxy_target, proxy_body, headers, stream, args.concurrency, args.concurrency * 2)
+        baseline, baseline_wall = await _drive(upstream_target, upstream_body, {}, stream, args.concurrency, args.requests)
+
+        cpu_before, _ = _process_usage(proxy_pid)
+        samples, wall = await _drive(proxy_target, proxy_body, headers, stream, args.concurrency, args.requests)
+        cpu_after, rss = _process_usage(proxy_pid)
+
+        proxied = _summarize(samples, wall)
+        direct = _summarize(baseline, baseline_wall)
+        results[name] = {
+            **proxied,
+            "added_latency_p50_ms": _diff(proxied["latency_p50_ms"], direct["latency_p50_ms"]),
+            "added_latency_p99_ms": _diff(proxied["latency_p99_ms"], direct["latency_p99_ms"]),
+            "ttft_overhead_p50_ms": _diff(proxied["ttft_p50_ms"], direct["ttft_p50_ms"]),
+            "cpu_ms_per_request": (
+                round((cpu_after - cpu_before) * 1000 / len(samples), 3)
+                if cpu_before is not None and cpu_after is not None and samples else None
+            ),
+            "proxy_rss_mb": round(rss / (1024 * 1024), 1) if rss is not None else None,
+            "upstream_baseline": direct,
+        }
+        _print_scenario(name, results[name])
+    return results
+
+
+def _print_scenario(name: str, result: dict):
+    print(
+        f"{name:14s} {result['throughput_rps'] or 0:9.1f} req/s  "
+        f"added p50 {result['added_latency_p50_ms']} ms  p99 {result['added_latency_p99_ms']} ms  "
+        f"ttft overhead {result['ttft_overhead_p50_ms']} ms  cpu {result['cpu_ms_per_request']} ms/req  "
+        f"rss {result['proxy_rss_mb']} MB  errors {result['errors']}"
+    )
+
+
+_COMPARED = (
+    "throughput_rps", "added_latency_p50_ms", "added_latency_p99_ms", "ttft_overhead_p50_ms",
+    "cpu_ms_per_request", "proxy_rss_mb",
+)
+
+
+def compare(current: dict, previous: dict):
+    """Print each compared metric of two runs side by side with its change."""
+    print(f"\nCompared with {previous.get('commit')} ({previous.get('timestamp')}):")
+    if previous.get("settings") != current["settings"]:
+        print("  (note: the runs used different settings, see the result files)")
+    for name, result in current["scenarios"].items():
+        before = previous.get("scenarios", {}).get(name)
+        if not before:
+            continue
+        print(f"  {name}")
+        for metric in _COMPARED:
+            new, old = result.get(metric), before.get(metric)
+            if new is None or old is None:
+                continue
+            change = f"{(new - old) / old * 100:+.1f}%" if old else "n/a"
+            print(f"    {metric:22s} {old:>10} -> {new:>10}  ({change})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the proxy's overhead against a local mock upstream")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=500, help="Measured requests per scenario")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help=f"Comma-separated subset of {SCENARIOS}")
+    parser.add_argument("--output", default=RESULTS_DIR, help="Directory the result JSON is written to")
+    parser.add_argument("--compare", help="Earlier result JSON to compare against")
+    add_mock_arguments(parser)
+    args = parser.parse_args()
+    args.scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+
+    with tempfile.TemporaryDirectory(prefix="proxy-bench-") as workdir:
+        mock, proxy, proxy_url, upstream_url = _start_processes(args, workdir)
+        try:
+            scenarios = asyncio.run(_run_scenarios(args, proxy.pid, proxy_url, upstream_url))
+        finally:
+            for proc in (proxy, mock):
+                proc.terminate()
+                try:
+                    proc.wait(10)
+                except subprocess.TimeoutExpired:
+                    proc.kill()
+
+    commit = _git_commit()
+    timestamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+    result = {
+        "commit": commit,
+        "timestamp": timestamp,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "settings": {
+            key: getattr(args, key) for key in (
+                "concurrency", "requests", "latency", "chunks", "chunk_size", "chunk_interval",
+                "error_rate", "rate_limit_rate",
+            )
+        },
+        "scenarios": scenarios,
+    }
+    os.makedirs(args.output, exist_ok=True)
+    path = os.path.join(args.output, f"{timestamp}-{commit or 'unknown'}.json")
+    with open(path, "w") as f:
+        json.dump(result, f, indent=2)
+    print(f"\nResults written to {path}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(result, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
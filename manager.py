@@ -1,4 +1,8 @@
-import os, json, time, sys, subprocess, requests, uvicorn, asyncio, uuid, socket
+import os, json, time, sys, requests, httpx, uvicorn, asyncio, uuid, socket, threading, base64
+from array import array
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
 from pathlib import Path
 from typing import List, Dict, Optional
 from fastapi import FastAPI, Request, HTTPException
@@ -15,6 +19,7 @@ try:
     from src.config import CLIENT_ID, CLIENT_SECRET, ANTI_CLIENT_ID, ANTI_CLIENT_SECRET
 except ImportError:
     CLIENT_ID = CLIENT_SECRET = ANTI_CLIENT_ID = ANTI_CLIENT_SECRET = "YOUR_CONFIG"
+from src.utils import write_json_atomic
 
 # --- 1. 全局配置与补丁 ---
 import oauthlib.oauth2.rfc6749.parameters
@@ -23,6 +28,21 @@ oauthlib.oauth2.rfc6749.parameters.validate_token_parameters = lambda params: No
 MANAGEMENT_PORT = 3000
 CONFIG_FILE = "servers_config.json"
 REDIRECT_URI = f"http://localhost:{MANAGEMENT_PORT}/api/auth/callback"
+PROXY_READY_TIMEOUT = 60  # 启动代理后等待其 /ready 就绪的最长秒数
+PROXY_STOP_TIMEOUT = 3    # 停止代理时等待其自行退出的秒数，超时后强制结束
+PROXY_LOG_LINES = 1000    # 每个代理保留的最近日志行数
+PROXY_HEALTH_INTERVAL = 5 # 代理就绪后检查 /ready 的间隔秒数
+PROXY_RESTART_BACKOFF = 1        # 代理崩溃后首次重启前等待的秒数，连续崩溃时逐次翻倍
+PROXY_RESTART_MAX_BACKOFF = 60   # 重启等待时间的上限
+PROXY_STABLE_AFTER = 60          # 代理连续运行超过该秒数后，再崩溃时等待时间从头计算
+CONFIG_SAVE_DELAY = 1.0   # 配置修改后延迟写盘的秒数，期间的多次修改合并为一次写入
+QUOTA_CACHE_TTL = 300     # 额度查询结果的缓存秒数，过期后再次请求时重新查询
+QUOTA_POLL_INTERVAL = 300 # 后台刷新所有账号额度的间隔秒数，0 表示关闭
+QUOTA_CONCURRENCY = 16    # 同时查询额度的账号数上限
+QUOTA_HISTORY_FILE = "quota_history.json"
+QUOTA_HISTORY_POINTS = 2016         # 每个服务保留的额度采样点数（每 5 分钟一次约为一周）
+QUOTA_HISTORY_SAVE_INTERVAL = 3600  # 额度历史写盘间隔秒数（退出时也会写盘）
+QUOTA_PROJECTION_WINDOW = 6 * 3600  # 预测耗尽时间所用的最近时间窗口秒数
 
 # 类型配置映射表
 TYPE_CONFIG = {
@@ -67,40 +87,169 @@ class ServerConfig(BaseModel):
     is_pro: bool = False
     status: str = "stopped"
     quota_info: Optional[dict] = None
+    validation: Optional[dict] = None  # 保存后的后台校验结果：{"status": "pending" | "ok" | "error", ...}
 
 app = FastAPI()
 app.mount("/static", StaticFiles(directory="static"), name="static")
 templates = Jinja2Templates(directory="templates")
-running_processes: Dict[str, subprocess.Popen] = {}
+proxies: Dict[str, "ProxyProcess"] = {}  # 服务 id -> 代理进程的监管者
 
 # --- 3. 工具函数 ---
 
-def load_config() -> List[dict]:
-    if not os.path.exists(CONFIG_FILE): return []
-    try:
-        with open(CONFIG_FILE, 'r', encoding='utf-8') as f: return json.load(f)
-    except: return []
-
-def save_config(configs: List[dict]):
-    with open(CONFIG_FILE, 'w', encoding='utf-8') as f:
-        json.dump(configs, f, indent=2)
-
-def get_google_session(filename: str, t_type: str):
-    """统一获取已授权的 Session 和 Credentials"""
+class ConfigStore:
+    """
+    servers_config.json 的内存副本：启动时读取一次，之后所有读写都在内存中完成（加锁）。
+    修改后延迟 CONFIG_SAVE_DELAY 秒写盘，期间的多次修改只写一次；写入先落到临时文件再原子替换，
+    代理进程读取该文件时不会读到写了一半的内容。
+    """
+
+    def __init__(self, path: str, save_delay: float = CONFIG_SAVE_DELAY):
+        self.path = path
+        self.save_delay = save_delay
+        self._lock = threading.RLock()
+        self._configs: List[dict] = self._load()
+        self._dirty = False
+        self._save_handle: Optional[asyncio.TimerHandle] = None
+        self._save_loop: Optional[asyncio.AbstractEventLoop] = None
+        self._save_task: Optional[asyncio.Future] = None
+        self._write_lock = threading.Lock()  # 写盘顺序；不占用 _lock，写盘期间仍可读写内存中的配置
+
+    def _load(self) -> List[dict]:
+        if not os.path.exists(self.path): return []
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f: return json.load(f)
+        except: return []
+
+    def all(self) -> List[dict]:
+        """所有服务配置的副本"""
+        with self._lock: return [dict(c) for c in self._configs]
+
+    def get(self, server_id: str) -> Optional[dict]:
+        with self._lock:
+            cfg = next((c for c in self._configs if c['id'] == server_id), None)
+            return dict(cfg) if cfg else None
+
+    def put(self, data: dict):
+        """新增或整体替换一个服务配置（按 id）"""
+        with self._lock:
+            for i, cfg in enumerate(self._configs):
+                if cfg['id'] == data['id']:
+                    self._configs[i] = dict(data)
+                    break
+            else:
+                self._configs.append(dict(data))
+            self._schedule_save()
+
+    def update(self, server_id: str, **fields) -> bool:
+        """修改服务配置的部分字段；值没有变化时不写盘。返回服务是否存在"""
+        with self._lock:
+            cfg = next((c for c in self._configs if c['id'] == server_id), None)
+            if cfg is None: return False
+            if any(cfg.get(k) != v for k, v in fields.items()):
+                cfg.update(fields)
+                self._schedule_save()
+            return True
+
+    def delete(self, server_id: str):
+        with self._lock:
+            self._configs = [c for c in self._configs if c['id'] != server_id]
+            self._schedule_save()
+
+    def _schedule_save(self):
+        self._dirty = True
+        if self._save_handle is not None: return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:  # 不在事件循环中（如脚本调用），直接写盘
+            self.flush()
+            return
+        self._save_loop = loop
+        self._save_handle = loop.call_later(self.save_delay, self._save_in_background)
+
+    def _save_in_background(self):
+        # 写盘（含 fsync）放到线程里，不阻塞事件循环上的其他请求
+        self._save_handle = None
+        self._save_task = asyncio.ensure_future(asyncio.to_thread(self.flush))
+        self._save_task.add_done_callback(self._report_save_error)
+
+    def _report_save_error(self, task: asyncio.Future):
+        if not task.cancelled() and task.exception() is not None:
+            print(f"Could not save {self.path}: {task.exception()}")
+
+    def _cancel_scheduled_save(self):
+        """取消尚未触发的延迟写盘；TimerHandle 不是线程安全的，在工作线程中要交给事件循环去取消"""
+        handle, self._save_handle = self._save_handle, None
+        if handle is None or self._save_loop.is_closed(): return
+        try:
+            on_loop = asyncio.get_running_loop() is self._save_loop
+        except RuntimeError:
+            on_loop = False
+        if on_loop: handle.cancel()
+        else: self._save_loop.call_soon_threadsafe(handle.cancel)
+
+    def flush(self):
+        """立即把尚未落盘的修改原子写入文件"""
+        with self._write_lock:
+            with self._lock:
+                self._cancel_scheduled_save()
+                if not self._dirty: return
+                data = json.dumps(self._configs, indent=2)
+                self._dirty = False
+            tmp_path = f"{self.path}.tmp"
+            try:
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    f.write(data)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, self.path)
+            except Exception:
+                with self._lock: self._dirty = True  # 下次修改或退出时重试
+                raise
+
+config_store = ConfigStore(CONFIG_FILE)
+
+class AccountSession:
+    """
+    一个账号复用的 requests.Session 与 Credentials：连接保持复用，token 只在过期时刷新。
+    token 文件被替换（重新授权）后会重建。lock 保证同一账号同一时刻只有一个线程在用它。
+    """
+
+    def __init__(self, path: Path, t_type: str):
+        conf = TYPE_CONFIG.get(t_type, TYPE_CONFIG["cli"])
+        self.path = path
+        self.mtime = path.stat().st_mtime
+        with open(path, 'r') as f: token_data = json.load(f)
+        self.creds = Credentials.from_authorized_user_info(token_data, conf["scopes"])
+        self.session = requests.Session()
+        self.session.headers.update({"Authorization": f"Bearer {self.creds.token}", "User-Agent": conf["ua"], "Content-Type": "application/json"})
+        self.user: Optional[dict] = None  # userinfo 不会变，查询一次即可
+        self.lock = threading.Lock()
+
+    def ensure_token(self):
+        if self.creds.expired and self.creds.refresh_token:
+            self.creds.refresh(GoogleRequest())
+            with open(self.path, 'w') as f: f.write(self.creds.to_json())
+            self.mtime = self.path.stat().st_mtime
+            self.session.headers["Authorization"] = f"Bearer {self.creds.token}"
+
+_account_sessions: Dict[tuple, AccountSession] = {}
+_account_sessions_lock = threading.Lock()
+
+def get_account_session(filename: str, t_type: str) -> AccountSession:
     conf = TYPE_CONFIG.get(t_type, TYPE_CONFIG["cli"])
     path = conf["dir"] / filename
     if not path.exists(): raise FileNotFoundError("Token file missing")
+    with _account_sessions_lock:
+        acc = _account_sessions.get((t_type, filename))
+        if acc is None or acc.mtime != path.stat().st_mtime:
+            acc = _account_sessions[(t_type, filename)] = AccountSession(path, t_type)
+        return acc
 
-    with open(path, 'r') as f: token_data = json.load(f)
-    creds = Credentials.from_authorized_user_info(token_data, conf["scopes"])
-    
-    if creds.expired and creds.refresh_token:
-        creds.refresh(GoogleRequest())
-        with open(path, 'w') as f: f.write(creds.to_json())
-    
-    s = requests.Session()
-    s.headers.update({"Authorization": f"Bearer {creds.token}", "User-Agent": conf["ua"], "Content-Type": "application/json"})
-    return s, creds
+def get_google_session(filename: str, t_type: str):
+    """统一获取已授权的 Session 和 Credentials"""
+    acc = get_account_session(filename, t_type)
+    with acc.lock: acc.ensure_token()
+    return acc.session, acc.creds
 
 def check_pro_status(session, base_url, t_type):
     """检测账号是否为 Pro (Standard Tier)"""
@@ -122,28 +271,400 @@ def fetch_account_data_sync(filename, project_id, t_type="cli"):
     """聚合获取用户信息、额度、Pro状态"""
     try:
         conf = TYPE_CONFIG[t_type]
-        s, creds = get_google_session(filename, t_type)
-        user = s.get("https://www.googleapis.com/oauth2/v2/userinfo", timeout=8).json()
-        
-        quotas = []
-        if t_type == "antigravity":
-            q_res = s.post(f"{conf['base_url']}/v1internal:fetchAvailableModels", json={}, timeout=8).json()
-            for mid, mdata in q_res.get('models', {}).items():
-                if 'quotaInfo' in mdata:
-                    quotas.append({**mdata['quotaInfo'], "modelId": mid, "is_antigravity": True})
-        else:
-            q_res = s.post(f"{conf['base_url']}/v1internal:retrieveUserQuota", json={"project": project_id}, timeout=8).json()
-            quotas = q_res.get("buckets", [])
-
-        return {
-            "status": "success", "filename": filename, "user": user, "quotas": quotas, 
-            "is_pro": check_pro_status(s, conf['base_url'], t_type), "type": t_type
-        }
+        acc = get_account_session(filename, t_type)
+        with acc.lock:
+            acc.ensure_token()
+            s = acc.session
+            if acc.user is None:
+                user = s.get("https://www.googleapis.com/oauth2/v2/userinfo", timeout=8).json()
+                if "email" in user: acc.user = user
+            else:
+                user = acc.user
+            
+            quotas = []
+            if t_type == "antigravity":
+                q_res = s.post(f"{conf['base_url']}/v1internal:fetchAvailableModels", json={}, timeout=8).json()
+                for mid, mdata in q_res.get('models', {}).items():
+                    if 'quotaInfo' in mdata:
+                        quotas.append({**mdata['quotaInfo'], "modelId": mid, "is_antigravity": True})
+            else:
+                q_res = s.post(f"{conf['base_url']}/v1internal:retrieveUserQuota", json={"project": project_id}, timeout=8).json()
+                quotas = q_res.get("buckets", [])
+            if "error" in q_res: # 例如项目不存在或账号无权访问该项目
+                raise RuntimeError(q_res["error"].get("message", str(q_res["error"])))
+
+            return {
+                "status": "success", "filename": filename, "user": user, "quotas": quotas, 
+                "is_pro": check_pro_status(s, conf['base_url'], t_type), "type": t_type
+            }
     except Exception as e:
         return {"status": "error", "message": str(e), "filename": filename}
 
+class QuotaHistory:
+    """
+    各服务额度的历史采样，每个服务一个固定容量的环形缓冲：一列采样时间（uint32 秒），
+    每个模型一列剩余比例（uint16 定点数）。内存只与服务数、模型数和容量有关，与运行时长无关。
+    """
+    MISSING = 0xFFFF  # 该次采样中没有这个模型
+    SCALE = 0xFFFE
+
+    def __init__(self, capacity: int = QUOTA_HISTORY_POINTS):
+        self.capacity = capacity
+        self._servers: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    def record(self, server_id: str, quotas: List[dict], ts: float):
+        """追加一次采样；缓冲已满时覆盖最旧的一次"""
+        with self._lock:
+            h = self._servers.get(server_id)
+            if h is None:
+                h = self._servers[server_id] = {"times": array('I', bytes(4 * self.capacity)), "values": {}, "resets": {}, "next": 0, "count": 0}
+            i = h["next"]
+            h["times"][i] = int(ts)
+            seen = set()
+            for q in quotas:
+                model, fraction = q.get("modelId"), q.get("remainingFraction")
+                if not model or fraction is None: continue
+                col = h["values"].get(model)
+                if col is None:
+                    col = h["values"][model] = array('H', [self.MISSING]) * self.capacity
+                col[i] = round(min(max(float(fraction), 0.0), 1.0) * self.SCALE)
+                if q.get("resetTime"): h["resets"][model] = q["resetTime"]
+                seen.add(model)
+            for model, col in h["values"].items():
+                if model not in seen: col[i] = self.MISSING
+            h["next"] = (i + 1) % self.capacity
+            h["count"] = min(h["count"] + 1, self.capacity)
+
+    def forget(self, server_id: str):
+        with self._lock: self._servers.pop(server_id, None)
+
+    def _points(self, h: dict, col: array, since: float):
+        """按时间顺序返回 since 之后该模型的 (时间, 剩余比例)"""
+        start = (h["next"] - h["count"]) % self.capacity
+        points = []
+        for k in range(h["count"]):
+            j = (start + k) % self.capacity
+            if h["times"][j] >= since and col[j] != self.MISSING:
+                points.append((h["times"][j], col[j] / self.SCALE))
+        return points
+
+    def summary(self, server_id: str, hours: float, max_points: int) -> Dict[str, dict]:
+        """
+        一个服务各模型最近 hours 小时的额度曲线（按时间均分成至多 max_points 段取平均）与耗尽预测。
+
+        Returns:
+            {model: {"series": [[时间戳, 剩余比例], ...], "remaining", "burn_rate_per_hour",
+                     "exhausts_at", "reset_time", "exhausts_before_reset"}}
+        """
+        with self._lock:
+            h = self._servers.get(server_id)
+            if h is None: return {}
+            now = time.time()
+            since = now - max(hours * 3600, QUOTA_PROJECTION_WINDOW)
+            columns = {m: self._points(h, col, since) for m, col in h["values"].items()}
+            resets = dict(h["resets"])
+        result = {}
+        for model, points in columns.items():
+            if not points: continue
+            shown = [p for p in points if p[0] >= now - hours * 3600]
+            result[model] = {"series": _downsample(shown, max_points), **_project(points, resets.get(model), now)}
+        return result
+
+    def save(self, path: str):
+        with self._lock:
+            data = {"capacity": self.capacity, "servers": {
+                sid: {"times": base64.b64encode(h["times"].tobytes()).decode(),
+                      "values": {m: base64.b64encode(col.tobytes()).decode() for m, col in h["values"].items()},
+                      "resets": h["resets"], "next": h["next"], "count": h["count"]}
+                for sid, h in self._servers.items()}}
+        # 每次写入独立的临时文件并 fsync，周期保存与退出时的保存重叠也不会互相覆盖
+        write_json_atomic(path, data, indent=None)
+
+    def load(self, path: str):
+        """读取上次保存的历史；容量改变后旧历史作废"""
+        if not os.path.exists(path): return
+        try:
+            with open(path, 'r', encoding='utf-8') as f: data = json.load(f)
+            if data.get("capacity") != self.capacity: return
+            servers = {}
+            for sid, h in data["servers"].items():
+                times = array('I'); times.frombytes(base64.b64decode(h["times"]))
+                values = {}
+                for model, encoded in h["values"].items():
+                    values[model] = array('H'); values[model].frombytes(base64.b64decode(encoded))
+                servers[sid] = {"times": times, "values": values, "resets": h["resets"], "next": h["next"], "count": h["count"]}
+            with self._lock: self._servers = servers
+        except Exception as e:
+            print(f"Could not load quota history: {e}")
+
+def _downsample(points: list, max_points: int) -> list:
+    """把采样按时间均分为至多 max_points 段，每段取平均"""
+    if len(points) <= max_points: return [[t, round(v, 4)] for t, v in points]
+    start, width = points[0][0], (points[-1][0] - points[0][0]) / max_points or 1
+    buckets: Dict[int, list] = {}
+    for t, v in points:
+        buckets.setdefault(min(int((t - start) / width), max_points - 1), []).append((t, v))
+    return [[round(sum(t for t, _ in b) / len(b)), round(sum(v for _, v in b) / len(b), 4)] for _, b in sorted(buckets.items())]
+
+def _project(points: list, reset_time: Optional[str], now: float) -> dict:
+    """用最近一次重置之后、QUOTA_PROJECTION_WINDOW 内的采样做线性回归，估算消耗速度和耗尽时间"""
+    segment = [p for p in points if p[0] >= now - QUOTA_PROJECTION_WINDOW]
+    for k in range(len(segment) - 1, 0, -1):
+        if segment[k][1] > segment[k - 1][1] + 0.001:  # 额度回升说明刚重置过
+            segment = segment[k:]
+            break
+    remaining = points[-1][1]
+    slope = 0.0
+    if len(segment) >= 2 and segment[-1][0] > segment[0][0]:
+        mean_t = sum(t for t, _ in segment) / len(segment)
+        mean_v = sum(v for _, v in segment) / len(segment)
+        var_t = sum((t - mean_t) ** 2 for t, _ in segment)
+        slope = sum((t - mean_t) * (v - mean_v) for t, v in segment) / var_t
+    exhausts_at = points[-1][0] + remaining / -slope if slope < 0 else None
+    reset_ts = None
+    if reset_time:
+        try: reset_ts = datetime.fromisoformat(reset_time.replace("Z", "+00:00")).timestamp()
+        except ValueError: pass
+    return {
+        "remaining": round(remaining, 4),
+        "burn_rate_per_hour": round(-slope * 3600, 4) if slope < 0 else 0.0,
+        "exhausts_at": datetime.fromtimestamp(exhausts_at, timezone.utc).isoformat() if exhausts_at else None,
+        "reset_time": reset_time,
+        "exhausts_before_reset": exhausts_at < reset_ts if exhausts_at and reset_ts else None,
+    }
+
+quota_history = QuotaHistory()
+quota_history.load(QUOTA_HISTORY_FILE)
+
+class QuotaCache:
+    """
+    各服务最近一次的额度查询结果。查询在独立线程池中进行，最多 QUOTA_CONCURRENCY 个账号同时查询；
+    同一服务的并发刷新（后台轮询与页面请求同时到达）只查询一次。
+    """
+
+    def __init__(self, ttl: float = QUOTA_CACHE_TTL, concurrency: int = QUOTA_CONCURRENCY):
+        self.ttl = ttl
+        self._results: Dict[str, dict] = {}
+        self._refreshing: Dict[tuple, asyncio.Future] = {}
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="quota")
+
+    async def get(self, srv: dict, force: bool = False) -> dict:
+        """缓存未过期时直接返回，否则重新查询；查询失败的结果不复用"""
+        cached = self._results.get(srv['id'])
+        if cached and not force and cached.get("status") == "success" and time.time() - cached["updated_at"] < self.ttl:
+            return cached
+        return await self.refresh(srv)
+
+    async def get_all(self, servers: List[dict], force: bool = False) -> Dict[str, dict]:
+        results = await asyncio.gather(*(self.get(srv, force) for srv in servers))
+        return {srv['id']: res for srv, res in zip(servers, results)}
+
+    @staticmethod
+    def _account_key(srv: dict) -> tuple:
+        return srv['id'], srv['type'], srv['token_file'], srv['project_id']
+
+    async def refresh(self, srv: dict) -> dict:
+        key = self._account_key(srv)
+        flight = self._refreshing.get(key)
+        if flight is None:
+            flight = self._refreshing[key] = asyncio.ensure_future(self._fetch(srv))
+        # 发起查询的请求断开时，查询仍为其他等待者继续进行
+        return await asyncio.shield(flight)
+
+    async def _fetch(self, srv: dict) -> dict:
+        sid, key = srv['id'], self._account_key(srv)
+        try:
+            res = await asyncio.get_running_loop().run_in_executor(
+                self._executor, fetch_account_data_sync, srv['token_file'], srv['project_id'], srv['type'])
+            res = {**res, "config_name": srv['name'], "updated_at": time.time()}
+            # 查询期间服务被删除或改了账号/项目时，结果已经过时
+            current = config_store.get(sid)
+            if current and self._account_key(current) == key:
+                self._results[sid] = res
+                if res.get("status") == "success":
+                    config_store.update(sid, is_pro=res.get("is_pro", False))
+                    quota_history.record(sid, res.get("quotas", []), res["updated_at"])
+            return res
+        finally:
+            self._refreshing.pop(key, None)
+
+    def forget(self, server_id: str):
+        """服务的账号或项目变化后丢弃旧结果"""
+        self._results.pop(server_id, None)
+
+quota_cache = QuotaCache()
+
+async def poll_quotas():
+    """后台定期刷新所有服务的额度，页面打开时直接读取缓存"""
+    saved_at = time.monotonic()
+    while True:
+        try:
+            await quota_cache.get_all(config_store.all(), force=True)
+            if time.monotonic() - saved_at >= QUOTA_HISTORY_SAVE_INTERVAL:
+                await asyncio.to_thread(quota_history.save, QUOTA_HISTORY_FILE)
+                saved_at = time.monotonic()
+        except Exception as e:
+            print(f"Quota poll failed: {e}")
+        await asyncio.sleep(QUOTA_POLL_INTERVAL)
+
+class ProxyProcess:
+    """
+    监管一个代理子进程：以 asyncio 子进程启动，输出写入最近 PROXY_LOG_LINES 行的环形缓冲，
+    就绪后意外退出会按退避时间自动重启。state 反映进程真实状态（通过代理的 /ready 接口）：
+    starting、ready、unready（进程在但 /ready 失败）、restarting、failed（就绪前就退出，不重启）、stopped。
+    """
+    _http: Optional[httpx.AsyncClient] = None
+
+    def __init__(self, server_id: str, port: int, env: dict):
+        self.server_id = server_id
+        self.port = port
+        self.env = {**env, "PYTHONUNBUFFERED": "1"}  # 日志实时写入管道
+        self.logs: deque = deque(maxlen=PROXY_LOG_LINES)
+        self.proc: Optional[asyncio.subprocess.Process] = None
+        self.state = "starting"
+        self.restarts = 0
+        self.ever_ready = False
+        self._started = asyncio.Event()  # 首次就绪或启动失败
+        self._stopping = False
+        self._task = asyncio.create_task(self._supervise())
+
+    @property
+    def active(self) -> bool:
+        """进程在运行或即将重启（占用端口）"""
+        return self.state not in ("failed", "stopped")
+
+    def log(self, message: str):
+        self.logs.append(f"[manager {time.strftime('%H:%M:%S')}] {message}")
+
+    async def _supervise(self):
+        backoff = PROXY_RESTART_BACKOFF
+        try:
+            while True:
+                started_at = time.monotonic()
+                self.state = "starting"
+                self.proc = await asyncio.create_subprocess_exec(
+                    sys.executable, "run_proxy.py", env=self.env,
+                    stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT)
+                self.log(f"代理进程已启动 (pid {self.proc.pid})")
+                health = asyncio.create_task(self._check_ready())
+                try:
+                    await self._read_logs(self.proc.stdout)
+                    code = await self.proc.wait()
+                finally:
+                    health.cancel()
+                if self._stopping: return
+                if not self.ever_ready:
+                    self.state = "failed"
+                    self.log(f"代理进程在就绪前退出 (exit code {code})，不再重启")
+                    return
+                if time.monotonic() - started_at >= PROXY_STABLE_AFTER: backoff = PROXY_RESTART_BACKOFF
+                self.state = "restarting"
+                self.log(f"代理进程意外退出 (exit code {code})，{backoff} 秒后重启")
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, PROXY_RESTART_MAX_BACKOFF)
+                self.restarts += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.state = "failed"
+            self.log(f"无法启动代理进程: {e}")
+        finally:
+            if self.proc and self.proc.returncode is None: self.proc.kill()
+            self._started.set()
+
+    async def _read_logs(self, stream: asyncio.StreamReader):
+        while True:
+            try:
+                line = await stream.readline()
+            except ValueError:  # 单行超过缓冲上限，已被丢弃
+                self.log("日志行过长，已丢弃")
+                continue
+            if not line: return
+            self.logs.append(line.decode('utf-8', "replace").rstrip())
+
+    async def _check_ready(self):
+        """轮询 /ready：就绪前每 0.5 秒一次，之后每 PROXY_HEALTH_INTERVAL 秒一次"""
+        if ProxyProcess._http is None: ProxyProcess._http = httpx.AsyncClient(timeout=2)
+        ready = False
+        while True:
+            try:
+                ok = (await ProxyProcess._http.get(f"http://127.0.0.1:{self.port}/ready")).status_code == 200
+            except httpx.HTTPError:
+                ok = False
+            if ok:
+                if not ready: self.log("代理已就绪")
+                ready = self.ever_ready = True
+                self.state = "ready"
+                self._started.set()
+            elif ready:
+                self.state = "unready"
+            await asyncio.sleep(PROXY_HEALTH_INTERVAL if ready else 0.5)
+
+    async def wait_started(self, timeout: float = PROXY_READY_TIMEOUT) -> bool:
+        """等待首次就绪；返回是否在 timeout 秒内就绪"""
+        try:
+            await asyncio.wait_for(self._started.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        return self.state == "ready"
+
+    async def stop(self):
+        """结束进程（超时后强制结束）并停止监管，不会触发重启"""
+        self._stopping = True
+        proc = self.proc
+        if proc and proc.returncode is None:
+            try:
+                proc.terminate()
+                await asyncio.wait_for(proc.wait(), PROXY_STOP_TIMEOUT)
+            except ProcessLookupError:
+                pass
+            except asyncio.TimeoutError:
+                self.log("代理进程未按时退出，强制结束")
+                proc.kill()
+                await proc.wait()
+        self._task.cancel()
+        try:
+            await self._task
+        except BaseException:
+            pass
+        self.state = "stopped"
+        self.log("代理进程已停止")
+
+_validation_tasks: Dict[str, asyncio.Task] = {}
+
+def schedule_validation(srv: dict):
+    """在后台校验服务配置；同一服务再次保存时取消上一次尚未完成的校验"""
+    old = _validation_tasks.pop(srv['id'], None)
+    if old: old.cancel()
+    _validation_tasks[srv['id']] = asyncio.create_task(validate_server(srv))
+
+async def validate_server(srv: dict):
+    """检测 Pro 状态并确认账号与项目可用（即查询一次额度），结果写回配置"""
+    try:
+        res = await quota_cache.refresh(srv)
+        if res.get("status") == "success":
+            validation = {"status": "ok", "checked_at": res["updated_at"]}
+        else:
+            validation = {"status": "error", "message": res.get("message"), "checked_at": res["updated_at"]}
+        current = config_store.get(srv['id'])
+        if current and QuotaCache._account_key(current) == QuotaCache._account_key(srv):
+            config_store.update(srv['id'], validation=validation)
+    finally:
+        if _validation_tasks.get(srv['id']) is asyncio.current_task():
+            del _validation_tasks[srv['id']]
+
 # --- 4. API 路由 ---
 
+@app.on_event("startup")
+async def start_background_tasks():
+    if QUOTA_POLL_INTERVAL > 0:
+        app.state.quota_poller = asyncio.create_task(poll_quotas())
+    # 上次退出时还没校验完的服务
+    for srv in config_store.all():
+        if (srv.get('validation') or {}).get('status') == 'pending':
+            schedule_validation(srv)
+
 @app.get("/")
 async def index(request: Request):
     return templates.TemplateResponse("dashboard.html", {"request": request})
@@ -189,103 +710,119 @@ async def get_google_projects(filename: str, type: str = "cli"):
 
 @app.get("/api/servers")
 async def get_servers():
-    configs = load_config()
+    configs = config_store.all()
     for cfg in configs:
-        sid = cfg['id']
-        is_alive = sid in running_processes and running_processes[sid].poll() is None
-        cfg['status'] = "running" if is_alive else "stopped"
-        if not is_alive and sid in running_processes: del running_processes[sid]
+        proxy = proxies.get(cfg['id'])
+        cfg['status'] = "running" if proxy and proxy.active else "stopped"
+        cfg['state'] = proxy.state if proxy else "stopped"
+        cfg['restarts'] = proxy.restarts if proxy else 0
     return configs
 
 @app.post("/api/servers")
 @app.put("/api/servers/{server_id}")
 async def save_server(config: ServerConfig, server_id: str = None):
-    configs = load_config()
     data = config.dict()
     
-    # 自动校验 Pro 状态
-    res = fetch_account_data_sync(data['token_file'], data['project_id'], data['type'])
-    data['is_pro'] = res.get("is_pro", False)
-    
     # 项目 ID 去重与补全
     existing_ids = [p['id'] for p in data.get('project_ids', [])]
     if data['project_id'] not in existing_ids:
         data['project_ids'].append({"id": data['project_id'], "type": "custom"})
 
     if server_id: # Update
-        for i, cfg in enumerate(configs):
-            if cfg['id'] == server_id:
-                data['id'] = server_id
-                configs[i] = data
-                break
+        existing = config_store.get(server_id)
+        if existing is None: return {"status": "success"}
+        data['id'] = server_id
+        data['is_pro'] = existing.get('is_pro', False)  # 校验完成前沿用原来的 Pro 状态
     else: # Create
         data['id'] = str(int(time.time() * 1000))
-        configs.append(data)
+        data['is_pro'] = False
     
-    save_config(configs)
-    return {"status": "success"}
+    # Pro 状态与项目可用性在后台校验，不阻塞保存请求
+    data['validation'] = {"status": "pending"}
+    config_store.put(data)
+    quota_cache.forget(data['id'])
+    schedule_validation(data)
+    return {"status": "success", "id": data['id'], "validation": "pending"}
 
 @app.delete("/api/servers/{server_id}")
 async def delete_server(server_id: str):
-    if server_id in running_processes:
-        running_processes[server_id].terminate()
-        del running_processes[server_id]
-    save_config([c for c in load_config() if c['id'] != server_id])
+    proxy = proxies.pop(server_id, None)
+    if proxy: await proxy.stop()
+    validation = _validation_tasks.pop(server_id, None)
+    if validation: validation.cancel()
+    config_store.delete(server_id)
+    quota_cache.forget(server_id)
+    quota_history.forget(server_id)
     return {"status": "success"}
 
 def is_port_in_use(port: int) -> bool:
     with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
         return s.connect_ex(('localhost', port)) == 0
-        
+
+
 @app.post("/api/servers/{server_id}/start")
 async def start_server(server_id: str):
-    configs = load_config()
-    srv = next((c for c in configs if c['id'] == server_id), None)
-    if not srv: return JSONResponse(404, {"message": "Not found"})
+    srv = config_store.get(server_id)
+    if not srv: return JSONResponse(status_code=404, content={"message": "Not found"})
 
     # 端口检测
-    if any(p.poll() is None and next((c['port'] for c in configs if c['id'] == sid), 0) == srv['port'] for sid, p in running_processes.items()):
-        return JSONResponse(400, {"message": f"端口 {srv['port']} 已被占用"})
+    if any(p.active and p.port == srv['port'] for p in proxies.values()):
+        return JSONResponse(status_code=400, content={"message": f"端口 {srv['port']} 已被占用"})
         
     if is_port_in_use(srv['port']):
-        return JSONResponse(400, {"message": f"端口 {srv['port']} 被系统占用，请稍后再试"})
+        return JSONResponse(status_code=400, content={"message": f"端口 {srv['port']} 被系统占用，请稍后再试"})
 
     env = {**os.environ, 
            "GOOGLE_APPLICATION_CREDENTIALS": str(TYPE_CONFIG[srv['type']]['dir'] / srv['token_file']),
            "GOOGLE_CLOUD_PROJECT": srv['project_id'], "PORT": str(srv['port']),
-           "GEMINI_AUTH_PASSWORD": srv['password'], "PROXY_TYPE": srv['type']}
+           "GEMINI_AUTH_PASSWORD": srv['password'], "PROXY_TYPE": srv['type'],
+           "PROXY_WARMUP": os.environ.get("PROXY_WARMUP", "true"),
+           "QUOTA_POLL_INTERVAL": "0"}  # 额度由管理后台的 QuotaCache 统一查询，代理自身不再轮询
     
-    running_processes[server_id] = subprocess.Popen([sys.executable, "run_proxy.py"], env=env)
-    return {"status": "started"}
+    proxy = proxies[server_id] = ProxyProcess(server_id, srv['port'], env)
+
+    # 等待代理完成预热（/ready 返回 200），而不是假定进程启动即可用
+    ready = await proxy.wait_started()
+    if proxy.state == "failed":
+        code = proxy.proc.returncode if proxy.proc else None
+        return JSONResponse(status_code=500, content={"message": f"代理进程启动失败 (exit code {code})", "logs": list(proxy.logs)[-20:]})
+    return {"status": "started", "ready": ready}
 
 @app.post("/api/servers/{server_id}/stop")
 async def stop_server(server_id: str):
-    if server_id in running_processes:
-        proc = running_processes[server_id]
-        try:
-            proc.terminate()
-            try:
-                proc.wait(timeout=3) 
-            except subprocess.TimeoutExpired:
-                print(f"强制结束进程 {server_id}")
-                proc.kill()
-                proc.wait()
-        except Exception as e:
-            print(f"Error stopping: {e}")
-        finally:
-            if server_id in running_processes:
-                del running_processes[server_id]
+    proxy = proxies.get(server_id)  # 停止后保留其日志，直到再次启动或删除服务
+    if proxy: await proxy.stop()
     return {"status": "stopped"}
 
+@app.get("/api/servers/{server_id}/logs")
+async def get_server_logs(server_id: str, lines: int = 200):
+    """代理进程最近的输出（以及监管日志：启动、崩溃、重启）"""
+    proxy = proxies.get(server_id)
+    if not proxy: return {"state": "stopped", "restarts": 0, "lines": []}
+    return {"state": proxy.state, "restarts": proxy.restarts, "pid": proxy.proc.pid if proxy.proc else None,
+            "lines": list(proxy.logs)[-lines:] if lines > 0 else []}
+
 @app.get("/api/servers/{server_id}/quota")
 async def get_server_quota(server_id: str):
-    configs = load_config()
-    srv = next((c for c in configs if c['id'] == server_id), None)
-    res = await asyncio.get_running_loop().run_in_executor(None, fetch_account_data_sync, srv['token_file'], srv['project_id'], srv['type'])
-    if res.get("status") == "success":
-        srv['is_pro'] = res.get("is_pro", False)
-        save_config(configs)
-    return {**res, "config_name": srv['name']}
+    srv = config_store.get(server_id)
+    if not srv: return JSONResponse(status_code=404, content={"message": "Not found"})
+    return await quota_cache.refresh(srv)
+
+@app.get("/api/quotas")
+async def get_all_quotas(force: bool = False):
+    """所有服务的额度，按服务 id 索引；未过期的结果直接取自缓存，其余并发查询"""
+    return await quota_cache.get_all(config_store.all(), force)
+
+@app.get("/api/quotas/history")
+async def get_quota_history(hours: float = 24, points: int = 120, server_id: Optional[str] = None):
+    """
+    各服务各模型的额度历史（降采样到至多 points 个点）以及按最近消耗速度预测的耗尽时间，
+    用于容量规划。server_id 为空时返回所有服务。
+    """
+    servers = [s for s in config_store.all() if server_id in (None, s['id'])]
+    def build():
+        return {s['id']: {"config_name": s['name'], "models": quota_history.summary(s['id'], hours, max(points, 1))} for s in servers}
+    return await asyncio.to_thread(build)
 
 @app.get("/api/auth/url")
 async def get_auth_url(type: str = "cli"):
@@ -320,5 +857,15 @@ async def auth_callback(code: str, state: str = "cli"):
     with open(conf['dir'] / f"{email}.json", 'w') as f: json.dump(token_data, f, indent=2)
     return templates.TemplateResponse("auth_success.html", {"request": {}, "email": f"[{state.upper()}] {email}"})
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """停止所有代理进程和后台额度轮询，写入尚未落盘的配置修改和额度历史"""
+    poller = getattr(app.state, "quota_poller", None)
+    if poller: poller.cancel()
+    await asyncio.gather(*(proxy.stop() for proxy in proxies.values()), return_exceptions=True)
+    if ProxyProcess._http: await ProxyProcess._http.aclose()
+    config_store.flush()
+    quota_history.save(QUOTA_HISTORY_FILE)
+
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=MANAGEMENT_PORT)
\ No newline at end of file
@@ -1,3 +1,4 @@
+import os
 import requests
 from requests.packages.urllib3.exceptions import InsecureRequestWarning
 
@@ -14,8 +15,10 @@ def new_request(*args, **kwargs):
 
 requests.Session.request = new_request
 
+# 上游 httpx 客户端同样跳过证书校验（与上面的 requests 补丁保持一致）
+os.environ.setdefault("UPSTREAM_SSL_VERIFY", "false")
+
 
-import os
 import uvicorn
 import sys
 
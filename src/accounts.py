@@ -0,0 +1,638 @@
+"""
+Account Pool - The upstream Google accounts a proxy process sends requests through.
+
+By default the pool holds a single account backed by the process-wide credentials
+in auth.py (GOOGLE_APPLICATION_CREDENTIALS / GEMINI_CREDENTIALS / GOOGLE_CLOUD_PROJECT),
+which is how the manager runs one proxy per account.
+With ACCOUNT_POOL enabled, every token under tokens/cli and tokens/antigravity is loaded
+into one pool behind a single port and each request is routed to a healthy account.
+"""
+import abc
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Callable, Dict, FrozenSet, Iterable, List, Optional, Set, Tuple
+
+import httpx
+from fastapi.concurrency import run_in_threadpool
+from google.oauth2.credentials import Credentials
+
+from . import auth
+from .auth import (
+    normalize_credentials_data,
+    refresh_credentials,
+    seconds_until_expiry,
+    discover_project_id,
+    ensure_onboarded,
+    get_cached_project_id,
+    get_cached_tier,
+    cache_onboarding,
+    write_credentials_file,
+)
+from .config import (
+    PROXY_TYPE,
+    PROXY_TYPES,
+    ACCOUNT_POOL,
+    TOKENS_DIR,
+    SERVERS_CONFIG_FILE,
+    ACCOUNT_FAILURE_COOLDOWN,
+    RATE_LIMIT_COOLDOWN,
+    QUOTA_POLL_INTERVAL,
+    MODEL_CATALOG_TTL,
+    ANTIGRAVITY_ONLY_MODEL_PREFIXES,
+    CLI_ONLY_MODEL_PREFIXES,
+    TOKEN_REFRESH_MARGIN,
+    TOKEN_REFRESH_CHECK_INTERVAL,
+)
+
+
+class AccountError(Exception):
+    """An account could not be prepared for an upstream call (auth, project or onboarding)."""
+
+
+class Account(abc.ABC):
+    """Identity, upstream settings and health of one Google account."""
+
+    def __init__(self, name: str, proxy_type: str):
+        conf = PROXY_TYPES[proxy_type]
+        self.name = name
+        self.proxy_type = proxy_type
+        self.is_antigravity = proxy_type == "antigravity"
+        self.endpoint = conf["endpoint"]
+        self.user_agent = conf["user_agent"]
+        self.project_id: Optional[str] = None
+        self.disabled_until = 0.0
+        self.last_error: Optional[str] = None
+        # Per-model rate-limit state: model -> monotonic time the cooldown ends
+        self.model_cooldowns: Dict[str, float] = {}
+        # Last known remaining quota per model (0.0 - 1.0), from the quota poller
+        self.quotas: Dict[str, float] = {}
+        self.quota_updated_at: Optional[float] = None
+        # Models upstream lists for this account (antigravity only), None until discovered
+        self.models: Optional[FrozenSet[str]] = None
+        self.models_updated_at = 0.0  # monotonic
+        self.current_weight = 0.0  # smooth weighted round-robin state, owned by the pool
+
+    @property
+    @abc.abstractmethod
+    def credentials(self) -> Optional[Credentials]:
+        ...
+
+    @abc.abstractmethod
+    def prepare(self) -> Tuple[Credentials, str]:
+        """
+        Make sure the account has a valid token, a project and is onboarded.
+        Blocking (file I/O and Google calls on first use); run it in the threadpool.
+
+        Returns:
+            (credentials, project_id) tuple
+        """
+
+    @abc.abstractmethod
+    def refresh(self, margin: float = 0):
+        """Refresh the access token if it expires within `margin` seconds."""
+
+    def warm_up(self) -> Tuple[Credentials, str]:
+        """prepare() for use at startup, where no interactive login may be started."""
+        return self.prepare()
+
+    def restore_onboarding(self) -> bool:
+        """
+        Mark the account as onboarded if the onboarding cache says it already is.
+        Never runs the loadCodeAssist/onboardUser handshake or an interactive login.
+
+        Returns:
+            True if the account's first request will skip the handshake
+        """
+        return False
+
+    def supports(self, model: str) -> bool:
+        """Whether this account can serve the given (base) model, per its model catalog or its type."""
+        if not model:
+            return True
+        if self.is_antigravity:
+            if MODEL_CATALOG_TTL > 0 and self.models is not None:
+                return model in self.models
+            return not model.startswith(CLI_ONLY_MODEL_PREFIXES)
+        return not model.startswith(ANTIGRAVITY_ONLY_MODEL_PREFIXES)
+
+    def catalog_expired(self, now: float) -> bool:
+        """Whether the model catalog should be (re)fetched."""
+        if not self.is_antigravity or MODEL_CATALOG_TTL <= 0:
+            return False
+        return self.models is None or now - self.models_updated_at >= MODEL_CATALOG_TTL
+
+    def can_poll(self) -> bool:
+        """Whether the account has what the quota/model calls need (a live token and, for cli, a project)."""
+        creds = self.credentials
+        if creds is None or not creds.token or creds.expired:
+            return False
+        return self.is_antigravity or bool(self.project_id)
+
+    def apply_catalog(self, models: Optional[FrozenSet[str]]):
+        """Record the models upstream lists for this account; an empty list is ignored."""
+        if not models:
+            return
+        if models != self.models:
+            logging.info(f"[{self.name}] Upstream lists {len(models)} model(s)")
+        self.models = models
+        self.models_updated_at = time.monotonic()
+
+    def available_at(self, model: Optional[str] = None) -> float:
+        """Monotonic time from which the account can take requests for `model` again."""
+        if not model:
+            return self.disabled_until
+        return max(self.disabled_until, self.model_cooldowns.get(model, 0.0))
+
+    def is_available(self, now: float, model: Optional[str] = None) -> bool:
+        return now >= self.available_at(model)
+
+    def weight(self, model: Optional[str]) -> float:
+        """Scheduling weight: the remaining quota fraction for the model, 1.0 when unknown."""
+        fraction = self.quotas.get(model) if model else None
+        if fraction is None:
+            return 1.0
+        return max(fraction, 0.01)
+
+    def apply_quota(self, quotas: Dict[str, Tuple[float, Optional[float]]]):
+        """
+        Record remaining quota reported by upstream.
+
+        Args:
+            quotas: model -> (remaining fraction, seconds until the quota resets or None)
+        """
+        now = time.monotonic()
+        for model, (fraction, reset_in) in quotas.items():
+            self.quotas[model] = fraction
+            # An exhausted model is not worth a round trip until its quota resets
+            if fraction <= 0 and reset_in:
+                self.model_cooldowns[model] = max(self.model_cooldowns.get(model, 0.0), now + reset_in)
+        self.quota_updated_at = time.time()
+
+    async def update_quota(self, client: httpx.AsyncClient):
+        """
+        Fetch the remaining quota of this account (the same calls the manager dashboard uses).
+        For antigravity accounts the fetchAvailableModels response also refreshes the model catalog.
+        """
+        creds = self.credentials
+        headers = {
+            "Authorization": f"Bearer {creds.token}",
+            "Content-Type": "application/json",
+            "User-Agent": self.user_agent,
+        }
+        if self.is_antigravity:
+            resp = await client.post(f"{self.endpoint}/v1internal:fetchAvailableModels", json={}, headers=headers)
+        else:
+            resp = await client.post(
+                f"{self.endpoint}/v1internal:retrieveUserQuota", json={"project": self.project_id}, headers=headers
+            )
+        resp.raise_for_status()
+        data = resp.json()
+        self.apply_quota(parse_quota_response(data))
+        if self.is_antigravity:
+            self.apply_catalog(parse_model_catalog(data))
+
+    def status(self) -> dict:
+        now = time.monotonic()
+        return {
+            "name": self.name,
+            "type": self.proxy_type,
+            "available": self.is_available(now),
+            "cooldown_seconds": max(0, round(self.disabled_until - now)),
+            "rate_limited": {
+                model: round(until - now) for model, until in self.model_cooldowns.items() if until > now
+            },
+            "quota": self.quotas,
+            "models": sorted(self.models) if self.models is not None else None,
+            "last_error": self.last_error,
+        }
+
+
+class DefaultAccount(Account):
+    """The single account configured through environment variables (legacy one-account-per-process mode)."""
+
+    def __init__(self):
+        super().__init__("default", PROXY_TYPE)
+
+    @property
+    def credentials(self):
+        return auth.credentials
+
+    def prepare(self):
+        creds = auth.get_credentials()
+        if not creds:
+            raise AccountError("Authentication failed. Please restart the proxy to log in.")
+
+        if creds.expired and creds.refresh_token:
+            try:
+                refresh_credentials(creds)
+            except Exception as e:
+                raise AccountError(f"Token refresh failed: {str(e)}. Please restart.")
+        elif not creds.token:
+            raise AccountError("No access token. Please restart the proxy to re-authenticate.")
+
+        proj_id = auth.get_user_project_id(creds)
+        if not proj_id:
+            raise AccountError("Failed to get user project ID.")
+
+        auth.onboard_user(creds, proj_id)
+        self.project_id = proj_id
+        return creds, proj_id
+
+    def refresh(self, margin=0):
+        if auth.credentials is not None:
+            refresh_credentials(auth.credentials, margin)
+
+    def warm_up(self):
+        if auth.get_credentials(allow_oauth_flow=False) is None:
+            raise AccountError("No credentials available. Log in through the manager first.")
+        return self.prepare()
+
+    def restore_onboarding(self):
+        if auth.onboarding_complete:
+            return True
+        creds = auth.get_credentials(allow_oauth_flow=False)
+        if not creds:
+            return False
+        project_id = os.getenv("GOOGLE_CLOUD_PROJECT") or auth.user_project_id or get_cached_project_id(creds)
+        if get_cached_tier(creds, project_id) is None:
+            return False
+        auth.onboarding_complete = True
+        return True
+
+
+class TokenFileAccount(Account):
+    """
+    An account loaded from a token file written by the manager (tokens/<type>/<email>.json).
+    Named "<type>/<email>", as the same Google account may have both a cli and an antigravity token.
+    """
+
+    def __init__(self, path: str, proxy_type: str, project_id: Optional[str] = None):
+        super().__init__(f"{proxy_type}/{os.path.splitext(os.path.basename(path))[0]}", proxy_type)
+        self.path = path
+        self.project_id = project_id
+        self.onboarded = False
+        self._credentials: Optional[Credentials] = None
+        self._token_data: dict = {}
+        self._lock = threading.Lock()          # guards loading, project discovery and onboarding
+        self._refresh_lock = threading.Lock()  # single-flight token refresh
+
+    @property
+    def credentials(self):
+        return self._credentials
+
+    def _load(self) -> Credentials:
+        with open(self.path, "r") as f:
+            self._token_data = json.load(f)
+        conf = PROXY_TYPES[self.proxy_type]
+        creds_data = normalize_credentials_data(dict(self._token_data))
+        creds_data.setdefault("client_id", conf["client_id"])
+        creds_data.setdefault("client_secret", conf["client_secret"])
+        if not self.project_id:
+            self.project_id = self._token_data.get("project_id")
+        return Credentials.from_authorized_user_info(creds_data, creds_data.get("scopes", conf["scopes"]))
+
+    def _persist(self, creds: Credentials):
+        """Write a refreshed token back into the token file, keeping its other fields."""
+        data = dict(self._token_data)
+        data["token"] = creds.token
+        if creds.expiry:
+            expiry = creds.expiry if creds.expiry.tzinfo else creds.expiry.replace(tzinfo=timezone.utc)
+            data["expiry"] = expiry.isoformat()
+        try:
+            write_credentials_file(data, self.path)
+            self._token_data = data
+        except Exception as e:
+            logging.warning(f"[{self.name}] Could not persist refreshed token: {e}")
+
+    def refresh(self, margin=0):
+        if self._credentials is not None:
+            refresh_credentials(
+                self._credentials, margin, lock=self._refresh_lock, persist=self._persist, account=self.name
+            )
+
+    def prepare(self):
+        creds = self._credentials
+        if creds is not None and self.onboarded and creds.token and not creds.expired:
+            return creds, self.project_id
+
+        with self._lock:
+            try:
+                if self._credentials is None:
+                    self._credentials = self._load()
+                creds = self._credentials
+
+                self.refresh()
+                if not creds.token:
+                    raise AccountError("No access token available")
+
+                if not self.project_id:
+                    self.project_id = get_cached_project_id(creds, self.proxy_type)
+                if not self.project_id:
+                    self.project_id = discover_project_id(creds, self.endpoint, self.user_agent, self.proxy_type)
+                    cache_onboarding(creds, self.project_id, proxy_type=self.proxy_type)
+
+                if not self.onboarded:
+                    ensure_onboarded(creds, self.project_id, self.endpoint, self.user_agent, self.proxy_type)
+                    self.onboarded = True
+                    logging.info(f"[{self.name}] Account ready (type={self.proxy_type}, project={self.project_id})")
+            except AccountError:
+                raise
+            except Exception as e:
+                raise AccountError(f"Account {self.name} is not usable: {str(e)}")
+        return creds, self.project_id
+
+
+    def restore_onboarding(self):
+        with self._lock:
+            if self.onboarded:
+                return True
+            try:
+                if self._credentials is None:
+                    self._credentials = self._load()
+            except Exception as e:
+                logging.warning(f"[{self.name}] Could not load token file: {e}")
+                return False
+            creds = self._credentials
+            project_id = self.project_id or get_cached_project_id(creds, self.proxy_type)
+            if get_cached_tier(creds, project_id, self.proxy_type) is None:
+                return False
+            self.project_id = project_id
+            self.onboarded = True
+            return True
+
+
+class AccountPool:
+    """
+    Schedules requests over the accounts that are healthy and can serve the requested model.
+    Accounts are picked by smooth weighted round-robin, weighted by their remaining quota
+    for the model, and skipped while cooling down after a failure or a 429.
+    """
+
+    def __init__(self, accounts: List[Account]):
+        self.accounts = accounts
+        self._catalog_fetches: Set[asyncio.Task] = set()
+
+    def acquire(self, model: str, exclude: Iterable[Account] = ()) -> Optional[Account]:
+        """
+        Pick the account for a request.
+
+        Args:
+            model: Base model name of the request
+            exclude: Accounts already tried for this request
+
+        Returns:
+            The chosen account. On a first attempt where every capable account is cooling
+            down, the one that recovers first is used rather than failing the request outright;
+            when retrying (exclude is non-empty), None is returned instead.
+        """
+        now = time.monotonic()
+        candidates = []
+        fallback = None
+        for account in self.accounts:
+            if account in exclude or not account.supports(model):
+                continue
+            if account.is_available(now, model):
+                candidates.append(account)
+            elif fallback is None or account.available_at(model) < fallback.available_at(model):
+                fallback = account
+
+        if not candidates:
+            return None if exclude else fallback
+
+        total = 0.0
+        chosen = None
+        for account in candidates:
+            weight = account.weight(model)
+            account.current_weight += weight
+            total += weight
+            if chosen is None or account.current_weight > chosen.current_weight:
+                chosen = account
+        chosen.current_weight -= total
+        return chosen
+
+    def serves(self, model: str) -> bool:
+        """Whether any account can serve the model at all, ignoring cooldowns."""
+        return any(account.supports(model) for account in self.accounts)
+
+    def report_failure(self, account: Account, error: Exception):
+        account.last_error = str(error)
+        account.disabled_until = time.monotonic() + ACCOUNT_FAILURE_COOLDOWN
+        logging.warning(f"Account {account.name} disabled for {ACCOUNT_FAILURE_COOLDOWN}s: {error}")
+
+    def report_rate_limited(self, account: Account, model: str, retry_after: Optional[float] = None):
+        """Put one model of an account on cooldown after upstream answered 429."""
+        delay = retry_after if retry_after is not None else RATE_LIMIT_COOLDOWN
+        until = time.monotonic() + delay
+        account.model_cooldowns[model] = max(account.model_cooldowns.get(model, 0.0), until)
+        account.quotas[model] = 0.0
+        logging.warning(f"Account {account.name} rate limited on {model}, cooling down for {delay:.0f}s")
+
+    def report_success(self, account: Account, model: Optional[str] = None):
+        account.last_error = None
+        # A model marked exhausted by a 429 is serving again; weight it as unknown until the next poll
+        if model and account.quotas.get(model) == 0.0:
+            del account.quotas[model]
+
+    def status(self) -> List[dict]:
+        return [account.status() for account in self.accounts]
+
+    def restore_onboarding(self) -> int:
+        """Restore cached onboarding state for every account; returns how many are ready."""
+        restored = 0
+        for account in self.accounts:
+            try:
+                if account.restore_onboarding():
+                    restored += 1
+            except Exception as e:
+                logging.warning(f"[{account.name}] Could not restore onboarding state: {e}")
+        return restored
+
+    async def warm_up(self) -> Dict[str, str]:
+        """
+        Prepare every account concurrently (token, project, onboarding).
+
+        Returns:
+            Error message by account name for the accounts that could not be prepared
+        """
+        results = await asyncio.gather(
+            *(run_in_threadpool(account.warm_up) for account in self.accounts), return_exceptions=True
+        )
+        errors = {}
+        for account, result in zip(self.accounts, results):
+            if isinstance(result, Exception):
+                errors[account.name] = str(result)
+                self.report_failure(account, result)
+        return errors
+
+    async def refresh_catalogs(self, client: httpx.AsyncClient):
+        """Fetch the model catalog (and quota) of every prepared antigravity account concurrently."""
+        accounts = [account for account in self.accounts if account.is_antigravity and account.can_poll()]
+        results = await asyncio.gather(
+            *(account.update_quota(client) for account in accounts), return_exceptions=True
+        )
+        for account, result in zip(accounts, results):
+            if isinstance(result, Exception):
+                logging.warning(f"[{account.name}] Could not fetch available models: {result}")
+
+    def ensure_catalog(self, account: Account, client: httpx.AsyncClient):
+        """
+        Fetch the account's model catalog in the background if it is missing or older than
+        MODEL_CATALOG_TTL. Called after an account is prepared on the request path, so
+        accounts that were not warmed up learn their models after their first request.
+        """
+        if not account.catalog_expired(time.monotonic()) or not account.can_poll():
+            return
+        if any(task.get_name() == account.name for task in self._catalog_fetches):
+            return
+
+        async def fetch():
+            try:
+                await account.update_quota(client)
+            except Exception as e:
+                logging.debug(f"[{account.name}] Model catalog fetch failed: {e}")
+
+        task = asyncio.create_task(fetch(), name=account.name)
+        self._catalog_fetches.add(task)
+        task.add_done_callback(self._catalog_fetches.discard)
+
+    async def run_token_refresher(self):
+        """
+        Background task that renews every loaded token TOKEN_REFRESH_MARGIN seconds
+        before it expires, so the request path only ever reads a ready token.
+        """
+        while True:
+            delay = TOKEN_REFRESH_CHECK_INTERVAL
+            for account in self.accounts:
+                creds = account.credentials
+                if creds is None or not creds.refresh_token:
+                    continue
+                remaining = seconds_until_expiry(creds)
+                if remaining is None or remaining <= TOKEN_REFRESH_MARGIN:
+                    try:
+                        await run_in_threadpool(account.refresh, TOKEN_REFRESH_MARGIN)
+                    except Exception as e:
+                        logging.warning(f"[{account.name}] Background token refresh failed, will retry: {e}")
+                        delay = min(delay, 30)
+                else:
+                    delay = min(delay, remaining - TOKEN_REFRESH_MARGIN)
+            await asyncio.sleep(max(delay, 1))
+
+    async def run_quota_poller(self, get_client: Callable[[], httpx.AsyncClient]):
+        """
+        Background task that refreshes the remaining quota of every account that has been
+        prepared, so scheduling weights follow actual usage, and the model catalog of
+        antigravity accounts once it is older than MODEL_CATALOG_TTL. Accounts are polled
+        one at a time to keep the extra upstream load negligible.
+        """
+        interval = min(i for i in (QUOTA_POLL_INTERVAL, MODEL_CATALOG_TTL) if i > 0)
+        while True:
+            now = time.monotonic()
+            for account in self.accounts:
+                if not account.can_poll():
+                    continue
+                if QUOTA_POLL_INTERVAL <= 0 and not account.catalog_expired(now):
+                    continue
+                try:
+                    await account.update_quota(get_client())
+                except Exception as e:
+                    logging.debug(f"[{account.name}] Quota poll failed: {e}")
+            await asyncio.sleep(interval)
+
+
+def _seconds_until(timestamp: Optional[str]) -> Optional[float]:
+    """Seconds from now until an RFC 3339 timestamp, or None if it cannot be parsed."""
+    if not timestamp:
+        return None
+    try:
+        reset = datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if reset.tzinfo is None:
+        reset = reset.replace(tzinfo=timezone.utc)
+    return max(0.0, (reset - datetime.now(timezone.utc)).total_seconds())
+
+
+def parse_quota_response(data: dict) -> Dict[str, Tuple[float, Optional[float]]]:
+    """
+    Extract per-model remaining quota from a retrieveUserQuota (cli, `buckets`) or
+    fetchAvailableModels (antigravity, `models.*.quotaInfo`) response.
+
+    Returns:
+        model -> (remaining fraction, seconds until reset or None); the lowest bucket wins
+    """
+    entries = []
+    for bucket in data.get("buckets", []):
+        entries.append((bucket.get("modelId"), bucket))
+    for model_id, model_data in (data.get("models") or {}).items():
+        if isinstance(model_data, dict) and "quotaInfo" in model_data:
+            entries.append((model_id, model_data["quotaInfo"]))
+
+    quotas: Dict[str, Tuple[float, Optional[float]]] = {}
+    for model_id, info in entries:
+        if not model_id:
+            continue
+        # A quotaInfo without remainingFraction means nothing is left
+        fraction = float(info.get("remainingFraction", 0.0))
+        if model_id not in quotas or fraction < quotas[model_id][0]:
+            quotas[model_id] = (fraction, _seconds_until(info.get("resetTime")))
+    return quotas
+
+
+def parse_model_catalog(data: dict) -> Optional[FrozenSet[str]]:
+    """Model IDs listed by a fetchAvailableModels response, or None if it lists none."""
+    models = data.get("models")
+    if not isinstance(models, dict) or not models:
+        return None
+    return frozenset(models)
+
+
+def _load_configured_projects() -> Dict[Tuple[str, str], str]:
+    """Map (type, token file name) to the project ID configured for it in the manager."""
+    projects = {}
+    if not os.path.exists(SERVERS_CONFIG_FILE):
+        return projects
+    try:
+        with open(SERVERS_CONFIG_FILE, "r", encoding="utf-8") as f:
+            servers = json.load(f)
+        for server in servers:
+            key = (server.get("type", "cli"), server.get("token_file"))
+            if server.get("project_id") and key not in projects:
+                projects[key] = server["project_id"]
+    except Exception as e:
+        logging.warning(f"Could not read project IDs from {SERVERS_CONFIG_FILE}: {e}")
+    return projects
+
+
+def build_account_pool() -> AccountPool:
+    if not ACCOUNT_POOL:
+        return AccountPool([DefaultAccount()])
+
+    projects = _load_configured_projects()
+    accounts: List[Account] = []
+    for proxy_type in PROXY_TYPES:
+        directory = os.path.join(TOKENS_DIR, proxy_type)
+        if not os.path.isdir(directory):
+            continue
+        for filename in sorted(os.listdir(directory)):
+            if filename.endswith(".json"):
+                path = os.path.join(directory, filename)
+                accounts.append(TokenFileAccount(path, proxy_type, projects.get((proxy_type, filename))))
+
+    logging.info(f"Account pool loaded {len(accounts)} accounts from {TOKENS_DIR}")
+    return AccountPool(accounts)
+
+
+_account_pool: Optional[AccountPool] = None
+
+
+def get_account_pool() -> AccountPool:
+    """Return the process-wide account pool, building it on first use."""
+    global _account_pool
+    if _account_pool is None:
+        _account_pool = build_account_pool()
+    return _account_pool
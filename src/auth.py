@@ -1,9 +1,11 @@
 import os
 import json
 import base64
+import hashlib
 import time
 import logging
-from datetime import datetime
+import threading
+from datetime import datetime, timedelta, timezone
 from fastapi import Request, HTTPException, Depends
 from fastapi.security import HTTPBasic
 from http.server import BaseHTTPRequestHandler, HTTPServer
@@ -13,10 +15,13 @@ from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import Flow
 from google.auth.transport.requests import Request as GoogleAuthRequest
 
-from .utils import get_user_agent, get_client_metadata
+from .utils import get_client_metadata, file_lock, write_json_atomic
+from .metrics import count_token_refresh
+from .request_timing import timed
 from .config import (
     CLIENT_ID, CLIENT_SECRET, SCOPES, CREDENTIAL_FILE,
-    CODE_ASSIST_ENDPOINT, GEMINI_AUTH_PASSWORD
+    CODE_ASSIST_ENDPOINT, GEMINI_AUTH_PASSWORD, USER_AGENT, PROXY_TYPE,
+    ONBOARDING_CACHE_FILE, ONBOARDING_CACHE_TTL
 )
 
 # --- Global State ---
@@ -25,6 +30,22 @@ user_project_id = None
 onboarding_complete = False
 credentials_from_env = False  # Track if credentials came from environment variable
 
+# In-memory copy of what is on disk for each credential file (keyed by path).
+# save_credentials compares against it and only touches the file when the token,
+# expiry or project actually changed.
+_persisted_credentials = {}
+_persist_lock = threading.Lock()
+
+# Serializes token refreshes so concurrent callers never race into several
+# simultaneous round-trips to the OAuth endpoint (single-flight).
+_refresh_lock = threading.Lock()
+
+# Onboarding results per account, mirrored from ONBOARDING_CACHE_FILE (loaded on first use,
+# re-read under a file lock before each write, as every proxy of the manager shares it):
+# "<type>:<refresh token digest>" -> {"project_id": ..., "projects": {project: {"tier": ..., "updated_at": ...}}}
+_onboarding_cache = None
+_onboarding_lock = threading.Lock()
+
 security = HTTPBasic()
 
 class _OAuthCallbackHandler(BaseHTTPRequestHandler):
@@ -46,6 +67,11 @@ class _OAuthCallbackHandler(BaseHTTPRequestHandler):
 
 def authenticate_user(request: Request):
     """Authenticate the user with multiple methods."""
+    with timed("auth"):
+        return _check_client_credentials(request)
+
+def _check_client_credentials(request: Request):
+    """The user name for the credentials the client sent; raises 401 if they are wrong."""
     # Check for API key in query parameters first (for Gemini client compatibility)
     api_key = request.query_params.get("key")
     if api_key and api_key == GEMINI_AUTH_PASSWORD:
@@ -81,59 +107,154 @@ def authenticate_user(request: Request):
         headers={"WWW-Authenticate": "Basic"},
     )
 
+def _load_persisted_credentials(path=CREDENTIAL_FILE):
+    """Return the cached contents of a credential file, reading it from disk only once."""
+    if path not in _persisted_credentials:
+        if not os.path.exists(path):
+            return None
+        with open(path, "r") as f:
+            _persisted_credentials[path] = json.load(f)
+    return _persisted_credentials[path]
+
+def _persist_credentials_data(data, path=CREDENTIAL_FILE):
+    """Atomically write credential data if it differs from the last known file contents."""
+    if _persisted_credentials.get(path) == data:
+        return False
+    write_json_atomic(path, data)
+    _persisted_credentials[path] = data
+    return True
+
+def write_credentials_file(data, path):
+    """Persist credential data for an arbitrary token file, skipping the write when unchanged."""
+    with _persist_lock:
+        return _persist_credentials_data(data, path)
+
 def save_credentials(creds, project_id=None):
     global credentials_from_env
     
-    # Don't save credentials to file if they came from environment variable,
-    # but still save project_id if provided and no file exists or file lacks project_id
-    if credentials_from_env:
-        if project_id and os.path.exists(CREDENTIAL_FILE):
-            try:
-                with open(CREDENTIAL_FILE, "r") as f:
-                    existing_data = json.load(f)
-                # Only update project_id if it's missing from the file
-                if "project_id" not in existing_data:
-                    existing_data["project_id"] = project_id
-                    with open(CREDENTIAL_FILE, "w") as f:
-                        json.dump(existing_data, f, indent=2)
-                    logging.info(f"Added project_id {project_id} to existing credential file")
-            except Exception as e:
-                logging.warning(f"Could not update project_id in credential file: {e}")
-        return
-    
-    creds_data = {
-        "client_id": CLIENT_ID,
-        "client_secret": CLIENT_SECRET,
-        "token": creds.token,
-        "refresh_token": creds.refresh_token,
-        "scopes": creds.scopes if creds.scopes else SCOPES,
-        "token_uri": "https://oauth2.googleapis.com/token",
-    }
-    
-    if creds.expiry:
-        if creds.expiry.tzinfo is None:
-            from datetime import timezone
-            expiry_utc = creds.expiry.replace(tzinfo=timezone.utc)
+    with _persist_lock:
+        # Don't save credentials to file if they came from environment variable,
+        # but still save project_id if provided and no file exists or file lacks project_id
+        if credentials_from_env:
+            if project_id:
+                try:
+                    existing_data = _load_persisted_credentials()
+                    # Only update project_id if it's missing from the file
+                    if existing_data is not None and "project_id" not in existing_data:
+                        _persist_credentials_data({**existing_data, "project_id": project_id})
+                        logging.info(f"Added project_id {project_id} to existing credential file")
+                except Exception as e:
+                    logging.warning(f"Could not update project_id in credential file: {e}")
+            return
+        
+        creds_data = {
+            "client_id": CLIENT_ID,
+            "client_secret": CLIENT_SECRET,
+            "token": creds.token,
+            "refresh_token": creds.refresh_token,
+            "scopes": creds.scopes if creds.scopes else SCOPES,
+            "token_uri": creds.token_uri or "https://oauth2.googleapis.com/token",
+        }
+        
+        if creds.expiry:
+            if creds.expiry.tzinfo is None:
+                expiry_utc = creds.expiry.replace(tzinfo=timezone.utc)
+            else:
+                expiry_utc = creds.expiry
+            # Keep the existing ISO format for backward compatibility, but ensure it's properly handled during loading
+            creds_data["expiry"] = expiry_utc.isoformat()
+        
+        if project_id:
+            creds_data["project_id"] = project_id
         else:
-            expiry_utc = creds.expiry
-        # Keep the existing ISO format for backward compatibility, but ensure it's properly handled during loading
-        creds_data["expiry"] = expiry_utc.isoformat()
-    
-    if project_id:
-        creds_data["project_id"] = project_id
-    elif os.path.exists(CREDENTIAL_FILE):
-        try:
-            with open(CREDENTIAL_FILE, "r") as f:
-                existing_data = json.load(f)
-                if "project_id" in existing_data:
+            try:
+                existing_data = _load_persisted_credentials()
+                if existing_data and "project_id" in existing_data:
                     creds_data["project_id"] = existing_data["project_id"]
-        except Exception:
-            pass
+            except Exception:
+                pass
+        
+        _persist_credentials_data(creds_data)
     
+
+def normalize_credentials_data(creds_data):
+    """
+    Normalize a raw credential dict in place so google-auth can load it:
+    map access_token/scope aliases and rewrite timezone-suffixed expiry values.
+    """
+    # Handle different credential formats
+    if "access_token" in creds_data and "token" not in creds_data:
+        creds_data["token"] = creds_data["access_token"]
     
-    with open(CREDENTIAL_FILE, "w") as f:
-        json.dump(creds_data, f, indent=2)
+    if "scope" in creds_data and "scopes" not in creds_data:
+        creds_data["scopes"] = creds_data["scope"].split()
     
+    # Handle problematic expiry formats that cause parsing errors
+    if "expiry" in creds_data:
+        expiry_str = creds_data["expiry"]
+        # If expiry has timezone info that causes parsing issues, try to fix it
+        if isinstance(expiry_str, str) and ("+00:00" in expiry_str or "Z" in expiry_str):
+            try:
+                # Try to parse and reformat the expiry to a format Google Credentials can handle
+                if "+00:00" in expiry_str:
+                    # Handle ISO format with timezone offset
+                    parsed_expiry = datetime.fromisoformat(expiry_str)
+                elif expiry_str.endswith("Z"):
+                    # Handle ISO format with Z suffix
+                    parsed_expiry = datetime.fromisoformat(expiry_str.replace('Z', '+00:00'))
+                else:
+                    parsed_expiry = datetime.fromisoformat(expiry_str)
+                
+                # Convert to UTC timestamp format that Google Credentials library expects
+                timestamp = parsed_expiry.timestamp()
+                creds_data["expiry"] = datetime.utcfromtimestamp(timestamp).strftime("%Y-%m-%dT%H:%M:%SZ")
+                logging.info(f"Converted expiry format from '{expiry_str}' to '{creds_data['expiry']}'")
+            except Exception as expiry_error:
+                logging.warning(f"Could not parse expiry format '{expiry_str}': {expiry_error}, removing expiry field")
+                # Remove problematic expiry field - credentials will be treated as expired but still loadable
+                del creds_data["expiry"]
+    return creds_data
+
+def seconds_until_expiry(creds):
+    """Seconds until the access token expires, or None if the expiry is unknown."""
+    if not creds.expiry:
+        return None
+    expiry = creds.expiry if creds.expiry.tzinfo else creds.expiry.replace(tzinfo=timezone.utc)
+    return (expiry - datetime.now(timezone.utc)).total_seconds()
+
+def _needs_refresh(creds, margin=0):
+    if not creds.token:
+        return True
+    if creds.expired:
+        return True
+    remaining = seconds_until_expiry(creds)
+    return remaining is not None and remaining <= margin
+
+def refresh_credentials(creds, margin=0, lock=None, persist=None, account="default"):
+    """
+    Refresh the access token if it expires within `margin` seconds.
+    Single-flight: callers arriving while a refresh is in progress wait for it and then
+    find a fresh token, so only one request goes to the OAuth endpoint.
+    
+    Args:
+        creds: Credentials to refresh in place
+        margin: Refresh if the token expires within this many seconds
+        lock: Lock shared by all refreshers of these credentials (defaults to the process credentials' lock)
+        persist: Callable storing refreshed credentials (defaults to save_credentials)
+        account: Account name the refresh is counted under in the metrics
+    """
+    with lock or _refresh_lock:
+        if creds.refresh_token and _needs_refresh(creds, margin):
+            try:
+                with timed("refresh"):
+                    creds.refresh(GoogleAuthRequest())
+            except Exception:
+                count_token_refresh(account, False)
+                raise
+            count_token_refresh(account, True)
+            (persist or save_credentials)(creds)
+            logging.info("Access token refreshed")
+    return creds
 
 def get_credentials(allow_oauth_flow=True):
     """Loads credentials matching gemini-cli OAuth2 flow."""
@@ -142,6 +263,13 @@ def get_credentials(allow_oauth_flow=True):
     if credentials and not credentials.expired and credentials.token:
         return credentials
     
+    # Already loaded but expired (background refresher lagging or failing): refresh in place
+    if credentials and credentials.refresh_token:
+        try:
+            return refresh_credentials(credentials)
+        except Exception as e:
+            logging.warning(f"Failed to refresh in-memory credentials, reloading: {e}")
+    
     # Check for credentials in environment variable (JSON string)
     env_creds_json = os.getenv("GEMINI_CREDENTIALS")
     if env_creds_json:
@@ -156,39 +284,7 @@ def get_credentials(allow_oauth_flow=True):
                 try:
                     creds_data = raw_env_creds_data.copy()
                     
-                    # Handle different credential formats
-                    if "access_token" in creds_data and "token" not in creds_data:
-                        creds_data["token"] = creds_data["access_token"]
-                    
-                    if "scope" in creds_data and "scopes" not in creds_data:
-                        creds_data["scopes"] = creds_data["scope"].split()
-                    
-                    # Handle problematic expiry formats that cause parsing errors
-                    if "expiry" in creds_data:
-                        expiry_str = creds_data["expiry"]
-                        # If expiry has timezone info that causes parsing issues, try to fix it
-                        if isinstance(expiry_str, str) and ("+00:00" in expiry_str or "Z" in expiry_str):
-                            try:
-                                # Try to parse and reformat the expiry to a format Google Credentials can handle
-                                from datetime import datetime
-                                if "+00:00" in expiry_str:
-                                    # Handle ISO format with timezone offset
-                                    parsed_expiry = datetime.fromisoformat(expiry_str)
-                                elif expiry_str.endswith("Z"):
-                                    # Handle ISO format with Z suffix
-                                    parsed_expiry = datetime.fromisoformat(expiry_str.replace('Z', '+00:00'))
-                                else:
-                                    parsed_expiry = datetime.fromisoformat(expiry_str)
-                                
-                                # Convert to UTC timestamp format that Google Credentials library expects
-                                import time
-                                timestamp = parsed_expiry.timestamp()
-                                creds_data["expiry"] = datetime.utcfromtimestamp(timestamp).strftime("%Y-%m-%dT%H:%M:%SZ")
-                                logging.info(f"Converted environment expiry format from '{expiry_str}' to '{creds_data['expiry']}'")
-                            except Exception as expiry_error:
-                                logging.warning(f"Could not parse environment expiry format '{expiry_str}': {expiry_error}, removing expiry field")
-                                # Remove problematic expiry field - credentials will be treated as expired but still loadable
-                                del creds_data["expiry"]
+                    normalize_credentials_data(creds_data)
                     
                     credentials = Credentials.from_authorized_user_info(creds_data, SCOPES)
                     credentials_from_env = True  # Mark as environment credentials
@@ -261,8 +357,9 @@ def get_credentials(allow_oauth_flow=True):
     if os.path.exists(CREDENTIAL_FILE):
         # First, check if we have a refresh token - if so, we should always be able to load credentials
         try:
-            with open(CREDENTIAL_FILE, "r") as f:
-                raw_creds_data = json.load(f)
+            with _persist_lock:
+                _persisted_credentials.pop(CREDENTIAL_FILE, None)
+                raw_creds_data = _load_persisted_credentials()
             
             # SAFEGUARD: If refresh_token exists, we should always load credentials successfully
             if "refresh_token" in raw_creds_data and raw_creds_data["refresh_token"]:
@@ -272,39 +369,7 @@ def get_credentials(allow_oauth_flow=True):
                     creds_data = raw_creds_data.copy()
                     current_scopes = creds_data.get("scopes", SCOPES)
                     
-                    # Handle different credential formats
-                    if "access_token" in creds_data and "token" not in creds_data:
-                        creds_data["token"] = creds_data["access_token"]
-                    
-                    if "scope" in creds_data and "scopes" not in creds_data:
-                        creds_data["scopes"] = creds_data["scope"].split()
-                    
-                    # Handle problematic expiry formats that cause parsing errors
-                    if "expiry" in creds_data:
-                        expiry_str = creds_data["expiry"]
-                        # If expiry has timezone info that causes parsing issues, try to fix it
-                        if isinstance(expiry_str, str) and ("+00:00" in expiry_str or "Z" in expiry_str):
-                            try:
-                                # Try to parse and reformat the expiry to a format Google Credentials can handle
-                                from datetime import datetime
-                                if "+00:00" in expiry_str:
-                                    # Handle ISO format with timezone offset
-                                    parsed_expiry = datetime.fromisoformat(expiry_str)
-                                elif expiry_str.endswith("Z"):
-                                    # Handle ISO format with Z suffix
-                                    parsed_expiry = datetime.fromisoformat(expiry_str.replace('Z', '+00:00'))
-                                else:
-                                    parsed_expiry = datetime.fromisoformat(expiry_str)
-                                
-                                # Convert to UTC timestamp format that Google Credentials library expects
-                                import time
-                                timestamp = parsed_expiry.timestamp()
-                                creds_data["expiry"] = datetime.utcfromtimestamp(timestamp).strftime("%Y-%m-%dT%H:%M:%SZ")
-                                logging.info(f"Converted expiry format from '{expiry_str}' to '{creds_data['expiry']}'")
-                            except Exception as expiry_error:
-                                logging.warning(f"Could not parse expiry format '{expiry_str}': {expiry_error}, removing expiry field")
-                                # Remove problematic expiry field - credentials will be treated as expired but still loadable
-                                del creds_data["expiry"]
+                    normalize_credentials_data(creds_data)
                     
                     credentials = Credentials.from_authorized_user_info(creds_data, current_scopes)
                     # Mark as environment credentials if GOOGLE_APPLICATION_CREDENTIALS was used
@@ -432,33 +497,28 @@ def get_credentials(allow_oauth_flow=True):
     finally:
         oauthlib.oauth2.rfc6749.parameters.validate_token_parameters = original_validate
 
-def onboard_user(creds, project_id):
-    """Ensures the user is onboarded, matching gemini-cli setupUser behavior."""
-    global onboarding_complete
-    if onboarding_complete:
-        return
-
-    if creds.expired and creds.refresh_token:
-        try:
-            creds.refresh(GoogleAuthRequest())
-            save_credentials(creds)
-        except Exception as e:
-            raise Exception(f"Failed to refresh credentials during onboarding: {str(e)}")
+def setup_user(creds, project_id, endpoint=CODE_ASSIST_ENDPOINT, user_agent=USER_AGENT, proxy_type=None):
+    """
+    Run the loadCodeAssist/onboardUser handshake for one account, matching gemini-cli setupUser.
+    
+    Returns:
+        The tier dict the account is (now) onboarded to
+    """
     headers = {
         "Authorization": f"Bearer {creds.token}",
         "Content-Type": "application/json",
-        "User-Agent": get_user_agent(),
+        "User-Agent": user_agent,
     }
     
     load_assist_payload = {
         "cloudaicompanionProject": project_id,
-        "metadata": get_client_metadata(project_id),
+        "metadata": get_client_metadata(project_id, proxy_type),
     }
     
     try:
         import requests
         resp = requests.post(
-            f"{CODE_ASSIST_ENDPOINT}/v1internal:loadCodeAssist",
+            f"{endpoint}/v1internal:loadCodeAssist",
             data=json.dumps(load_assist_payload),
             headers=headers,
         )
@@ -486,18 +546,17 @@ def onboard_user(creds, project_id):
             raise ValueError("This account requires setting the GOOGLE_CLOUD_PROJECT env var.")
 
         if load_data.get("currentTier"):
-            onboarding_complete = True
-            return
+            return tier
 
         onboard_req_payload = {
             "tierId": tier.get("id"),
             "cloudaicompanionProject": project_id,
-            "metadata": get_client_metadata(project_id),
+            "metadata": get_client_metadata(project_id, proxy_type),
         }
 
         while True:
             onboard_resp = requests.post(
-                f"{CODE_ASSIST_ENDPOINT}/v1internal:onboardUser",
+                f"{endpoint}/v1internal:onboardUser",
                 data=json.dumps(onboard_req_payload),
                 headers=headers,
             )
@@ -505,8 +564,7 @@ def onboard_user(creds, project_id):
             lro_data = onboard_resp.json()
 
             if lro_data.get("done"):
-                onboarding_complete = True
-                break
+                return tier
             
             time.sleep(5)
 
@@ -515,6 +573,104 @@ def onboard_user(creds, project_id):
     except Exception as e:
         raise Exception(f"User onboarding failed due to an unexpected error: {str(e)}")
 
+def _onboarding_cache_key(creds, proxy_type=None):
+    """Identify an account by a digest of its refresh token (stable across access token refreshes)."""
+    if not creds or not creds.refresh_token:
+        return None
+    digest = hashlib.sha256(creds.refresh_token.encode("utf-8")).hexdigest()[:16]
+    return f"{proxy_type or PROXY_TYPE}:{digest}"
+
+def _read_onboarding_cache():
+    if not os.path.exists(ONBOARDING_CACHE_FILE):
+        return {}
+    try:
+        with open(ONBOARDING_CACHE_FILE, "r") as f:
+            return json.load(f)
+    except Exception as e:
+        logging.warning(f"Could not read onboarding cache {ONBOARDING_CACHE_FILE}: {e}")
+        return {}
+
+def _load_onboarding_cache():
+    global _onboarding_cache
+    if _onboarding_cache is None:
+        _onboarding_cache = _read_onboarding_cache()
+    return _onboarding_cache
+
+def get_cached_project_id(creds, proxy_type=None):
+    """Return the project last used by this account, if recorded in the onboarding cache."""
+    key = _onboarding_cache_key(creds, proxy_type)
+    if not key:
+        return None
+    with _onboarding_lock:
+        entry = _load_onboarding_cache().get(key)
+    return entry.get("project_id") if entry else None
+
+def get_cached_tier(creds, project_id, proxy_type=None):
+    """Return the tier this account was onboarded to for the project, if cached and not older than ONBOARDING_CACHE_TTL."""
+    key = _onboarding_cache_key(creds, proxy_type)
+    if not key or not project_id:
+        return None
+    with _onboarding_lock:
+        entry = _load_onboarding_cache().get(key) or {}
+        project_entry = entry.get("projects", {}).get(project_id)
+    if not project_entry or time.time() - project_entry.get("updated_at", 0) > ONBOARDING_CACHE_TTL:
+        return None
+    return project_entry.get("tier")
+
+def cache_onboarding(creds, project_id, tier=None, proxy_type=None):
+    """Record the project (and, once onboarded, the tier) of an account in the onboarding cache."""
+    key = _onboarding_cache_key(creds, proxy_type)
+    if not key or not project_id:
+        return
+    global _onboarding_cache
+    with _onboarding_lock:
+        entry = _load_onboarding_cache().get(key, {})
+        if entry.get("project_id") == project_id and tier is None:
+            return
+        try:
+            # Every proxy the manager starts shares the file: merge into what is on disk now
+            with file_lock(ONBOARDING_CACHE_FILE):
+                cache = _read_onboarding_cache()
+                entry = cache.get(key, entry)
+                updated = {**entry, "project_id": project_id, "projects": dict(entry.get("projects", {}))}
+                if tier is not None:
+                    updated["projects"][project_id] = {"tier": tier, "updated_at": time.time()}
+                cache[key] = updated
+                write_json_atomic(ONBOARDING_CACHE_FILE, cache)
+            _onboarding_cache = cache
+        except Exception as e:
+            logging.warning(f"Could not write onboarding cache {ONBOARDING_CACHE_FILE}: {e}")
+
+def ensure_onboarded(creds, project_id, endpoint=CODE_ASSIST_ENDPOINT, user_agent=USER_AGENT, proxy_type=None):
+    """
+    setup_user, skipped when the account was already onboarded to this project within
+    ONBOARDING_CACHE_TTL (possibly by an earlier run of the proxy).
+
+    Returns:
+        The tier dict
+    """
+    tier = get_cached_tier(creds, project_id, proxy_type)
+    if tier is not None:
+        return tier
+    tier = setup_user(creds, project_id, endpoint, user_agent, proxy_type)
+    cache_onboarding(creds, project_id, tier, proxy_type)
+    return tier
+
+def onboard_user(creds, project_id):
+    """Ensures the user is onboarded, matching gemini-cli setupUser behavior."""
+    global onboarding_complete
+    if onboarding_complete:
+        return
+
+    if creds.expired and creds.refresh_token:
+        try:
+            refresh_credentials(creds)
+        except Exception as e:
+            raise Exception(f"Failed to refresh credentials during onboarding: {str(e)}")
+    
+    ensure_onboarded(creds, project_id)
+    onboarding_complete = True
+
 def get_user_project_id(creds):
     """Gets the user's project ID matching gemini-cli setupUser logic."""
     global user_project_id
@@ -522,36 +678,36 @@ def get_user_project_id(creds):
     # Priority 1: Check environment variable first (always check, even if user_project_id is set)
     env_project_id = os.getenv("GOOGLE_CLOUD_PROJECT")
     if env_project_id:
-        logging.info(f"Using project ID from GOOGLE_CLOUD_PROJECT environment variable: {env_project_id}")
-        user_project_id = env_project_id
-        save_credentials(creds, user_project_id)
+        # Only persist when the project changes; the file is not touched on the hot path
+        if user_project_id != env_project_id:
+            logging.info(f"Using project ID from GOOGLE_CLOUD_PROJECT environment variable: {env_project_id}")
+            user_project_id = env_project_id
+            save_credentials(creds, user_project_id)
         return user_project_id
     
     # If we already have a cached project_id and no env var override, use it
     if user_project_id:
-        logging.info(f"Using cached project ID: {user_project_id}")
+        logging.debug(f"Using cached project ID: {user_project_id}")
         return user_project_id
 
     # Priority 2: Check cached project ID in credential file
-    if os.path.exists(CREDENTIAL_FILE):
-        try:
-            with open(CREDENTIAL_FILE, "r") as f:
-                creds_data = json.load(f)
-                cached_project_id = creds_data.get("project_id")
-                if cached_project_id:
-                    logging.info(f"Using cached project ID from credential file: {cached_project_id}")
-                    user_project_id = cached_project_id
-                    return user_project_id
-        except Exception as e:
-            logging.warning(f"Could not read project_id from credential file: {e}")
+    try:
+        with _persist_lock:
+            creds_data = _load_persisted_credentials()
+        cached_project_id = creds_data.get("project_id") if creds_data else None
+        if cached_project_id:
+            logging.info(f"Using cached project ID from credential file: {cached_project_id}")
+            user_project_id = cached_project_id
+            return user_project_id
+    except Exception as e:
+        logging.warning(f"Could not read project_id from credential file: {e}")
 
     # Priority 3: Make API call to discover project ID
     # Ensure we have valid credentials for the API call
     if creds.expired and creds.refresh_token:
         try:
             logging.info("Refreshing credentials before project ID discovery...")
-            creds.refresh(GoogleAuthRequest())
-            save_credentials(creds)
+            refresh_credentials(creds)
             logging.info("Credentials refreshed successfully for project ID discovery")
         except Exception as e:
             logging.error(f"Failed to refresh credentials while getting project ID: {e}")
@@ -560,35 +716,41 @@ def get_user_project_id(creds):
     if not creds.token:
         raise Exception("No valid access token available for project ID discovery")
     
+    discovered_project_id = discover_project_id(creds)
+    user_project_id = discovered_project_id
+    save_credentials(creds, user_project_id)
+    return user_project_id
+
+def discover_project_id(creds, endpoint=CODE_ASSIST_ENDPOINT, user_agent=USER_AGENT, proxy_type=None):
+    """Ask loadCodeAssist which Cloud AI Companion project the account belongs to."""
     headers = {
         "Authorization": f"Bearer {creds.token}",
         "Content-Type": "application/json",
-        "User-Agent": get_user_agent(),
+        "User-Agent": user_agent,
     }
     
     probe_payload = {
-        "metadata": get_client_metadata(),
+        "metadata": get_client_metadata(proxy_type=proxy_type),
     }
 
     try:
         import requests
         logging.info("Attempting to discover project ID via API call...")
         resp = requests.post(
-            f"{CODE_ASSIST_ENDPOINT}/v1internal:loadCodeAssist",
+            f"{endpoint}/v1internal:loadCodeAssist",
             data=json.dumps(probe_payload),
             headers=headers,
         )
         resp.raise_for_status()
         data = resp.json()
         discovered_project_id = data.get("cloudaicompanionProject")
+        if isinstance(discovered_project_id, dict):
+            discovered_project_id = discovered_project_id.get("id")
         if not discovered_project_id:
             raise ValueError("Could not find 'cloudaicompanionProject' in loadCodeAssist response.")
 
         logging.info(f"Discovered project ID via API: {discovered_project_id}")
-        user_project_id = discovered_project_id
-        save_credentials(creds, user_project_id)
-        
-        return user_project_id
+        return discovered_project_id
     except requests.exceptions.HTTPError as e:
         logging.error(f"HTTP error during project ID discovery: {e}")
         if hasattr(e, 'response') and e.response:
@@ -596,4 +758,4 @@ def get_user_project_id(creds):
         raise Exception(f"Failed to discover project ID via API: {e}")
     except Exception as e:
         logging.error(f"Unexpected error during project ID discovery: {e}")
-        raise Exception(f"Failed to discover project ID: {e}")
\ No newline at end of file
+        raise Exception(f"Failed to discover project ID: {e}")
@@ -0,0 +1,178 @@
+"""
+Request Coalescing - Single-flight execution of identical concurrent upstream requests.
+
+When many clients send the same request at the same time, only the first one goes
+upstream; the others wait for it and share its reply. Streams are fanned out: every
+subscriber receives the full chunk sequence from the first chunk, however late it joins
+while the upstream stream is still running.
+"""
+import asyncio
+import logging
+import weakref
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+
+class StreamBroadcast:
+    """
+    Reads one chunk iterator in a background task and replays it to any number of
+    subscribers. The upstream stream is released when it ends or when every subscriber
+    has gone away, unless `linger` (asked then, and after each chunk read while nobody
+    listens) says it is worth reading on for subscribers that may still join.
+    """
+
+    def __init__(self, chunks: AsyncIterator, on_finish: Callable[[], None],
+                 linger: Optional[Callable[[], bool]] = None):
+        self._chunks = chunks
+        self._on_finish = on_finish
+        self._linger = linger
+        self._lingering = False  # every subscriber left and the stream is read on for linger
+        self._buffer: List[Any] = []
+        self._finished = False
+        self._changed = asyncio.Event()
+        self._subscribers = 0  # subscriptions handed out and not yet finished or dropped
+        self._pump = asyncio.ensure_future(self._run())
+
+    async def _run(self):
+        try:
+            async for chunk in self._chunks:
+                self._buffer.append(chunk)
+                self._notify()
+                if self._lingering and not self._linger():
+                    break
+        finally:
+            try:
+                await self._chunks.aclose()
+            finally:
+                self._close()
+
+    def _notify(self):
+        event, self._changed = self._changed, asyncio.Event()
+        event.set()
+
+    def _close(self):
+        if not self._finished:
+            self._finished = True
+            self._notify()
+            self._on_finish()
+
+    def subscribe(self) -> AsyncIterator:
+        """
+        A new iterator over the whole stream. It counts as a subscriber from the handoff
+        until it is closed, or until it is dropped if it was never iterated at all.
+        """
+        started: List[bool] = []
+        subscription = self._iterate(started)
+        self._subscribers += 1
+        self._lingering = False
+        # An async generator that never started does not run its finally block
+        weakref.finalize(subscription, self._drop_unstarted, started)
+        return subscription
+
+    def _drop_unstarted(self, started: List[bool]):
+        if not started:
+            self._unsubscribe()
+
+    def _unsubscribe(self):
+        self._subscribers -= 1
+        if self._subscribers == 0 and not self._finished:
+            if self._linger is not None and self._linger():
+                self._lingering = True
+                return
+            # Nobody is listening any more: stop reading and let new requests start afresh
+            self._close()
+            self._pump.cancel()
+
+    async def _iterate(self, started: List[bool]):
+        started.append(True)
+        index = 0
+        try:
+            while True:
+                if index < len(self._buffer):
+                    yield self._buffer[index]
+                    index += 1
+                elif self._finished:
+                    return
+                else:
+                    await self._changed.wait()
+        finally:
+            self._unsubscribe()
+
+
+# share(result, done) -> factory giving each caller its own copy of the result; done() ends the flight
+ShareFunc = Callable[[Any, Callable[[], None]], Callable[[], Any]]
+
+
+class RequestCoalescer:
+    """Runs at most one fetch per key at a time; concurrent callers with the same key share its result."""
+
+    def __init__(self):
+        self._flights: Dict[str, asyncio.Future] = {}
+        self._waiting: Dict[asyncio.Future, int] = {}  # flight -> callers still waiting for it
+        self.leaders = 0
+        self.coalesced = 0
+
+    async def run(self, key: str, fetch: Callable[[], Awaitable[Any]], share: ShareFunc) -> Any:
+        """
+        Args:
+            key: Identity of the request
+            fetch: Performs the request (only called by the first caller of a flight)
+            share: Turns the result into a per-caller factory; it calls done() once new
+                callers can no longer join (immediately for plain results, at the end of a stream)
+
+        Returns:
+            This caller's copy of the result
+        """
+        flight = self._flights.get(key)
+        if flight is None:
+            self.leaders += 1
+            flight = asyncio.ensure_future(self._lead(key, fetch, share))
+            self._flights[key] = flight
+        else:
+            self.coalesced += 1
+            logging.info("Coalesced request with an identical one already in flight")
+        # The flight runs in its own task, so the caller that started it may go away
+        # without cancelling it for the others
+        self._waiting[flight] = self._waiting.get(flight, 0) + 1
+        try:
+            make = await asyncio.shield(flight)
+        except asyncio.CancelledError:
+            if self._leave(flight) == 0 and flight.done() and not flight.cancelled() and flight.exception() is None:
+                # The last caller went away between the end of the flight and its handoff
+                flight.result()()
+            raise
+        self._leave(flight)
+        return make()
+
+    def _leave(self, flight: asyncio.Future) -> int:
+        waiting = self._waiting.pop(flight) - 1
+        if waiting:
+            self._waiting[flight] = waiting
+        return waiting
+
+    async def _lead(self, key: str, fetch, share):
+        flight = asyncio.current_task()
+
+        def done():
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+
+        try:
+            make = share(await fetch(), done)
+            if not self._waiting.get(flight):
+                # Every caller went away while it ran: take one copy and drop it, so a
+                # shared stream is released instead of being read with nobody listening
+                make()
+            return make
+        except BaseException:
+            done()
+            raise
+
+    def stats(self) -> Dict[str, int]:
+        return {"in_flight": len(self._flights), "leaders": self.leaders, "coalesced": self.coalesced}
+
+
+_coalescer = RequestCoalescer()
+
+
+def get_coalescer() -> RequestCoalescer:
+    return _coalescer
@@ -8,8 +8,9 @@ import logging
 from fastapi import APIRouter, Request, Response, Depends
 
 from .auth import authenticate_user
-from .google_api_client import send_gemini_request, build_gemini_payload_from_native
-from .config import SUPPORTED_MODELS
+from .request_timing import timed
+from .google_api_client import send_gemini_request, build_gemini_payload_from_native, GeminiResult
+from .model_registry import resolve_model, unsupported_model_message, gemini_models_json
 
 router = APIRouter()
 
@@ -21,31 +22,14 @@ async def gemini_list_models(request: Request, username: str = Depends(authentic
     Returns available models in Gemini format, matching the official Gemini API.
     """
     
-    try:
-        logging.info("Gemini models list requested")
-        
-        models_response = {
-            "models": SUPPORTED_MODELS
-        }
-        
-        logging.info(f"Returning {len(SUPPORTED_MODELS)} Gemini models")
-        return Response(
-            content=json.dumps(models_response),
-            status_code=200,
-            media_type="application/json; charset=utf-8"
-        )
-    except Exception as e:
-        logging.error(f"Failed to list Gemini models: {str(e)}")
-        return Response(
-            content=json.dumps({
-                "error": {
-                    "message": f"Failed to list models: {str(e)}",
-                    "code": 500
-                }
-            }),
-            status_code=500,
-            media_type="application/json"
-        )
+    logging.info("Gemini models list requested")
+    
+    # Serialized by the model registry, again only when the model catalogs change
+    return Response(
+        content=gemini_models_json(),
+        status_code=200,
+        media_type="application/json; charset=utf-8"
+    )
 
 
 @router.api_route("/{full_path:path}", methods=["GET", "POST", "PUT", "DELETE", "PATCH"])
@@ -87,12 +71,25 @@ async def gemini_proxy(request: Request, full_path: str, username: str = Depends
                 media_type="application/json"
             )
         
+        # Reject unknown models before spending an upstream call on them
+        if resolve_model(model_name) is None:
+            logging.warning(f"Rejected request for unsupported model: {model_name}")
+            return Response(
+                content=json.dumps({
+                    "error": {
+                        "message": unsupported_model_message(model_name),
+                        "code": 404,
+                        "status": "NOT_FOUND"
+                    }
+                }),
+                status_code=404,
+                media_type="application/json"
+            )
+        
         # Parse the incoming request
         try:
-            if post_data:
-                incoming_request = json.loads(post_data)
-            else:
-                incoming_request = {}
+            with timed("transform"):
+                incoming_request = json.loads(post_data) if post_data else {}
         except json.JSONDecodeError as e:
             logging.error(f"Invalid JSON in request body: {str(e)}")
             return Response(
@@ -107,10 +104,16 @@ async def gemini_proxy(request: Request, full_path: str, username: str = Depends
             )
         
         # Build the payload for Google API
-        gemini_payload = build_gemini_payload_from_native(incoming_request, model_name)
+        with timed("transform"):
+            gemini_payload = build_gemini_payload_from_native(incoming_request, model_name)
         
         # Send the request to Google API
-        response = send_gemini_request(gemini_payload, is_streaming=is_streaming)
+        response = await send_gemini_request(
+            gemini_payload, is_streaming=is_streaming, idempotency_key=request.headers.get("Idempotency-Key")
+        )
+        if isinstance(response, GeminiResult):
+            with timed("response"):
+                response = response.to_response()
         
         # Log the response status
         if hasattr(response, 'status_code'):
@@ -4,78 +4,214 @@ This module is used by both OpenAI compatibility layer and native Gemini endpoin
 """
 import json
 import logging
-import requests
+from typing import Optional
+
+import httpx
 from fastapi import Response
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import StreamingResponse
-from google.auth.transport.requests import Request as GoogleAuthRequest
 
-from .auth import get_credentials, save_credentials, get_user_project_id, onboard_user
-from .utils import get_user_agent
+from .accounts import get_account_pool
+from .model_registry import get_model_profile
+from .response_cache import get_response_cache, get_idempotency_store, is_deterministic, payload_key
+from .coalescing import StreamBroadcast, get_coalescer
+from . import metrics
+from .request_timing import UpstreamTrace, current_request, timed
+from .utils import StrSlice, base64_view
 from .config import (
-    CODE_ASSIST_ENDPOINT,
     DEFAULT_SAFETY_SETTINGS,
-    get_base_model_name,
-    is_search_model,
-    get_thinking_budget,
-    should_include_thoughts,
-    IS_ANTIGRAVITY
+    ANTIGRAVITY_SYSTEM_PROMPTS,
+    UPSTREAM_HTTP2,
+    UPSTREAM_SSL_VERIFY,
+    UPSTREAM_MAX_CONNECTIONS,
+    UPSTREAM_MAX_KEEPALIVE_CONNECTIONS,
+    UPSTREAM_KEEPALIVE_EXPIRY,
+    UPSTREAM_CONNECT_TIMEOUT,
+    UPSTREAM_READ_TIMEOUT,
+    STREAM_CHUNK_TIMEOUT,
+    RATE_LIMIT_MAX_RETRIES,
+    REQUEST_COALESCING,
+    SERVER_TIMING_ENABLED,
+    SLOW_REQUEST_THRESHOLD,
 )
 import asyncio
+import re
+import time
 import uuid
 
 
-def send_gemini_request(payload: dict, is_streaming: bool = False) -> Response:
+# Shared upstream client. One keep-alive (and, when available, HTTP/2) connection
+# pool per proxy process, so requests reuse TCP+TLS sessions to cloudcode-pa.
+_http_client: Optional[httpx.AsyncClient] = None
+
+
+def _http2_available() -> bool:
+    if not UPSTREAM_HTTP2:
+        return False
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        logging.warning("h2 package not installed, upstream client falls back to HTTP/1.1")
+        return False
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """Return the process-wide upstream client, creating it on first use."""
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(
+            http2=_http2_available(),
+            verify=UPSTREAM_SSL_VERIFY,
+            limits=httpx.Limits(
+                max_connections=UPSTREAM_MAX_CONNECTIONS,
+                max_keepalive_connections=UPSTREAM_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=UPSTREAM_KEEPALIVE_EXPIRY,
+            ),
+            timeout=httpx.Timeout(UPSTREAM_READ_TIMEOUT, connect=UPSTREAM_CONNECT_TIMEOUT),
+        )
+    return _http_client
+
+
+# For streams the read timeout applies to each socket read, i.e. it bounds the
+# gap between two upstream chunks rather than the whole generation.
+_STREAM_TIMEOUT = httpx.Timeout(UPSTREAM_READ_TIMEOUT, connect=UPSTREAM_CONNECT_TIMEOUT, read=STREAM_CHUNK_TIMEOUT)
+
+# Google durations ("1h2m3.5s", "500ms") and the "reset after ..." hint in 429 messages
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_DURATION_UNITS = {"ms": 0.001, "h": 3600, "m": 60, "s": 1}
+_RESET_AFTER = re.compile(r"reset after ((?:\d+(?:\.\d+)?(?:ms|h|m|s))+)", re.IGNORECASE)
+
+# Split upstream waits into connect and TTFB only when someone looks at the phases
+_TIMING_ENABLED = SERVER_TIMING_ENABLED or SLOW_REQUEST_THRESHOLD > 0
+
+_SSE_HEADERS = {
+    "Content-Type": "text/event-stream",
+    "Content-Disposition": "attachment",
+    "Vary": "Origin, X-Origin, Referer",
+    "X-XSS-Protection": "0",
+    "X-Frame-Options": "SAMEORIGIN",
+    "X-Content-Type-Options": "nosniff",
+    "Server": "ESF"
+}
+
+
+async def warm_up_connections(endpoints, count: int = 1):
     """
-    Send a request to Google's Gemini API.
-    
-    Args:
-        payload: The request payload in Gemini format
-        is_streaming: Whether this is a streaming request
-        
+    Open `count` pooled connections to each upstream endpoint so the first requests
+    skip the TCP/TLS handshake. Any HTTP response counts; only connection errors are raised.
+    """
+    client = get_http_client()
+    await asyncio.gather(*(client.get(endpoint) for endpoint in endpoints for _ in range(count)))
+
+
+async def close_http_client():
+    """Close the shared upstream client (called on application shutdown)."""
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
+
+def _with_antigravity_system_prompt(request: dict) -> dict:
+    """Return a copy of the request whose systemInstruction starts with the antigravity prompts."""
+    new_parts = [{"text": p} for p in ANTIGRAVITY_SYSTEM_PROMPTS]
+    system_instruction = request.get("systemInstruction")
+    if not system_instruction:
+        return {**request, "systemInstruction": {"parts": new_parts}}
+    existing_parts = system_instruction.get("parts", [])
+    if existing_parts and ANTIGRAVITY_SYSTEM_PROMPTS[0] in existing_parts[0].get("text", ""):
+        return request
+    return {**request, "systemInstruction": {**system_instruction, "parts": new_parts + existing_parts}}
+
+
+def _parse_duration(value: str) -> Optional[float]:
+    """Parse a Google duration such as "12.5s", "1h2m3s" or "500ms" into seconds."""
+    matches = _DURATION_PART.findall(value or "")
+    if not matches:
+        return None
+    return sum(float(amount) * _DURATION_UNITS[unit] for amount, unit in matches)
+
+
+def _parse_retry_delay(resp: httpx.Response) -> Optional[float]:
+    """
+    Work out how long upstream wants us to wait after a 429: RetryInfo.retryDelay,
+    ErrorInfo quotaResetDelay, a "reset after ..." hint in the message, or Retry-After.
+    """
+    try:
+        error = resp.json().get("error", {})
+    except (json.JSONDecodeError, AttributeError):
+        error = {}
+    if isinstance(error, dict):
+        for detail in error.get("details") or []:
+            if not isinstance(detail, dict):
+                continue
+            delay = detail.get("retryDelay") or (detail.get("metadata") or {}).get("quotaResetDelay")
+            if delay and _parse_duration(delay) is not None:
+                return _parse_duration(delay)
+        match = _RESET_AFTER.search(error.get("message") or "")
+        if match:
+            return _parse_duration(match.group(1))
+    retry_after = resp.headers.get("Retry-After")
+    if retry_after and retry_after.isdigit():
+        return float(retry_after)
+    return None
+
+
+def _serialize_payload(payload: dict):
+    """
+    Serialize the upstream payload.
+
     Returns:
-        FastAPI Response object
+        (body, content_length). Without large inline images the body is the encoded JSON and
+        content_length is None. Otherwise the body is an async iterator that writes the
+        JSON around each StrSlice and streams the base64 data straight out of the original
+        request string in chunks, so the image is never copied as a whole.
     """
-    # Get and validate credentials
-    creds = get_credentials()
-    if not creds:
-        return Response(
-            content="Authentication failed. Please restart the proxy to log in.", 
-            status_code=500
-        )
-    
+    slices = []
+    marker = f"@@inline-{uuid.uuid4().hex}-"
 
-    # Refresh credentials if needed
-    if creds.expired and creds.refresh_token:
-        try:
-            creds.refresh(GoogleAuthRequest())
-            save_credentials(creds)
-        except Exception as e:
-            logging.error(f"Critical Auth Error: {str(e)}")
-            return Response(
-                content=f"Token refresh failed: {str(e)}. Please restart.", 
-                status_code=500
-            )
-    elif not creds.token:
-        return Response(
-            content="No access token. Please restart the proxy to re-authenticate.", 
-            status_code=500
-        )
+    def register_slice(obj):
+        if isinstance(obj, StrSlice):
+            slices.append(obj)
+            return f"{marker}{len(slices) - 1}@@"
+        raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
 
-    # Get project ID and onboard user
-    proj_id = get_user_project_id(creds)
-    if not proj_id:
-        return Response(content="Failed to get user project ID.", status_code=500)
-    
-    onboard_user(creds, proj_id)
+    serialized = json.dumps(payload, default=register_slice)
+    if not slices:
+        return serialized.encode("utf-8"), None
+
+    # split() alternates JSON text and the index of the slice that goes in between
+    pieces = re.split(f'"{re.escape(marker)}(\\d+)@@"', serialized)
+    segments = [piece.encode("utf-8") if i % 2 == 0 else slices[int(piece)] for i, piece in enumerate(pieces)]
+    content_length = sum(len(segment) + (2 if isinstance(segment, StrSlice) else 0) for segment in segments)
+
+    async def body():
+        for segment in segments:
+            if isinstance(segment, StrSlice):
+                yield b'"'
+                for chunk in segment.iter_bytes():
+                    yield chunk
+                yield b'"'
+            elif segment:
+                yield segment
+
+    return body(), content_length
+
+
+def _build_upstream_request(account, creds, proj_id: str, payload: dict, is_streaming: bool):
+    """Build the URL, headers and body of the cloudcode-pa call for one account (called once per attempt)."""
+    request_data = payload.get("request", {})
+    if account.is_antigravity:
+        request_data = _with_antigravity_system_prompt(request_data)
 
-    # Build the final payload with project info
     final_payload = {
         "model": payload.get("model"),
         "project": proj_id,
-        "request": payload.get("request", {})
+        "request": request_data
     }
-    
-    if IS_ANTIGRAVITY:
+
+    if account.is_antigravity:
         final_payload.update({
             "requestId": f"agent-{uuid.uuid4()}",
             "requestType": "agent",
@@ -84,48 +220,362 @@ def send_gemini_request(payload: dict, is_streaming: bool = False) -> Response:
 
     # Determine the action and URL
     action = "streamGenerateContent" if is_streaming else "generateContent"
-    target_url = f"{CODE_ASSIST_ENDPOINT}/v1internal:{action}"
+    target_url = f"{account.endpoint}/v1internal:{action}"
     if is_streaming:
         target_url += "?alt=sse"
 
-    # Build request headers
     request_headers = {
         "Authorization": f"Bearer {creds.token}",
         "Content-Type": "application/json",
-        "User-Agent": get_user_agent(),
+        "User-Agent": account.user_agent,
     }
+    body, content_length = _serialize_payload(final_payload)
+    if content_length is not None:
+        request_headers["Content-Length"] = str(content_length)
+    else:
+        content_length = len(body)
+    return target_url, request_headers, body, content_length
 
-    final_post_data = json.dumps(final_payload)
 
-    # Send the request
-    try:
+async def send_gemini_request(payload: dict, is_streaming: bool = False, idempotency_key: Optional[str] = None):
+    """
+    Send a request to Google's Gemini API.
+
+    With RESPONSE_CACHE_ENABLED, deterministic requests (temperature 0 or a fixed seed)
+    are answered from the response cache when an identical request was answered before;
+    cached streams are replayed chunk by chunk.
+    Identical requests that arrive while one is already in flight (REQUEST_COALESCING)
+    share its upstream call instead of making their own; streams are fanned out so each
+    caller gets every chunk from the start.
+
+    Args:
+        payload: The request payload in Gemini format
+        is_streaming: Whether this is a streaming request
+        idempotency_key: Client's Idempotency-Key header. A retry with the same key and
+            payload attaches to the original request while it runs, and gets its reply
+            replayed for IDEMPOTENCY_TTL seconds after it succeeded
+
+    Returns:
+        GeminiResult for a successful non-streaming call, GeminiStreamingResponse for a
+        stream, otherwise an error Response
+    """
+    record = current_request()
+    if record:
+        record.model = payload.get("model")
+    store = get_idempotency_store()
+    if idempotency_key and store is not None:
+        return await _send_idempotent(store, f"{idempotency_key}:{payload_key(payload)}", payload, is_streaming)
+    return await _send_deduplicated(payload, is_streaming)
+
+
+async def _send_idempotent(store, key: str, payload: dict, is_streaming: bool):
+    """Replay the stored reply of an earlier request with this key, join it while in flight, or run it."""
+    replay = _cached_reply(store, key, is_streaming)
+    if replay is not None:
+        logging.info("Replaying the reply of an earlier request with the same Idempotency-Key")
+        return replay
+
+    async def fetch():
+        # Successful replies (streams once complete) are kept for retries; errors are not
+        response = await _send_deduplicated(payload, is_streaming)
+        if isinstance(response, GeminiStreamingResponse) and response.status_code == 200:
+            recording = _StreamRecording(store, key)
+            return GeminiStreamingResponse(recording.relay(response.iter_chunks())), recording.worth_finishing
+        return _store_reply(store, key, response), None
+
+    def share(result, done):
+        # A client that timed out and went away usually retries the same stream: it is read
+        # on without listeners (while it can still be stored) so the retry can join or replay it
+        response, linger = result
+        return _share_reply(response, done, linger)
+
+    return await get_coalescer().run(f"idempotency:{key}:{'sse' if is_streaming else 'json'}", fetch, share)
+
+
+async def _send_deduplicated(payload: dict, is_streaming: bool):
+    """send_gemini_request without the Idempotency-Key handling: response cache and coalescing."""
+    cache = get_response_cache()
+    deterministic = is_deterministic(payload)
+    cacheable = cache is not None and deterministic
+    coalesce = REQUEST_COALESCING == "all" or (REQUEST_COALESCING == "deterministic" and deterministic)
+    if not cacheable and not coalesce:
+        return await _send_upstream(payload, is_streaming)
+
+    key = payload_key(payload)
+    if cacheable:
+        cached = _cached_reply(cache, key, is_streaming)
+        cache.record(cached is not None)
+        if cached is not None:
+            logging.info(f"Response cache hit for model {payload.get('model')}")
+            return cached
+
+    async def fetch():
+        response = await _send_upstream(payload, is_streaming)
+        return _store_reply(cache, key, response) if cacheable else response
+
+    if not coalesce:
+        return await fetch()
+    return await get_coalescer().run(f"{key}:{'sse' if is_streaming else 'json'}", fetch, _share_reply)
+
+
+def _share_reply(response, done, linger=None):
+    """Per-caller copies of a coalesced reply; a stream stays joinable until it ends (see StreamBroadcast for linger)."""
+    if isinstance(response, GeminiStreamingResponse):
+        broadcast = StreamBroadcast(response.iter_chunks(), done, linger)
+        return lambda: GeminiStreamingResponse(broadcast.subscribe(), status_code=response.status_code)
+    done()
+    if isinstance(response, GeminiResult):
+        return lambda: GeminiResult(response.raw)
+    return lambda: Response(content=response.body, status_code=response.status_code, media_type=response.media_type)
+
+
+def _cached_reply(cache, key: str, is_streaming: bool):
+    """A cached reply in the form the caller expects, or None. Streams can replay a non-streaming reply."""
+    raw = cache.get(key + ":json")
+    if not is_streaming:
+        return GeminiResult(raw) if raw is not None else None
+    chunks = cache.get(key + ":sse")
+    if chunks is None and raw is not None:
+        try:
+            response = GeminiResult(raw).data()
+        except (json.JSONDecodeError, AttributeError):
+            response = None
+        chunks = [response] if response else None
+    if chunks is None:
+        return None
+    return GeminiStreamingResponse(_replay_chunks(chunks))
+
+
+async def _replay_chunks(chunks: list):
+    for chunk in chunks:
+        yield chunk
+
+
+def _store_reply(cache, key: str, response):
+    """Cache a successful reply; streams are stored once they have been relayed completely."""
+    if isinstance(response, GeminiResult):
+        cache.put(key + ":json", response.raw, len(response.raw))
+    elif isinstance(response, GeminiStreamingResponse) and response.status_code == 200:
+        return GeminiStreamingResponse(_StreamRecording(cache, key).relay(response.iter_chunks()))
+    return response
+
+
+class _StreamRecording:
+    """
+    A copy of a stream kept while it is relayed, stored in the cache if the stream ends
+    normally without an error chunk (not when the client went away mid-stream). Copying
+    stops once the stream is too large for the cache.
+    """
+
+    def __init__(self, cache, key: str):
+        self._cache = cache
+        self._key = key + ":sse"
+        self._chunks: Optional[list] = []
+        self._size = 0
+        self._deadline = time.monotonic() + cache.ttl
+
+    def worth_finishing(self) -> bool:
+        """Whether the stream can still be stored in time to be of use."""
+        return self._chunks is not None and time.monotonic() < self._deadline
+
+    async def relay(self, chunks):
+        try:
+            async for chunk in chunks:
+                if self._chunks is not None:
+                    if "error" in chunk:
+                        self._chunks = None
+                    else:
+                        self._size += len(json.dumps(chunk, separators=(',', ':')))
+                        if self._size > self._cache.max_bytes:
+                            self._chunks = None  # could not be stored anyway
+                        else:
+                            self._chunks.append(chunk)
+                yield chunk
+        finally:
+            await chunks.aclose()
+        if self._chunks:
+            self._cache.put(self._key, self._chunks, self._size)
+
+
+async def _send_upstream(payload: dict, is_streaming: bool):
+    """
+    Send a request upstream through the account pool.
+
+    A 429 from upstream puts the account on cooldown for that model, and a transport error
+    (connection reset, timeout) the whole account; either way the request is retried on
+    another account. This happens before anything is sent to the client, so the client
+    only sees the error when no capable account is left.
+    Arguments and return value are those of send_gemini_request.
+    """
+    pool = get_account_pool()
+    model = payload.get("model")
+    max_attempts = RATE_LIMIT_MAX_RETRIES + 1 if RATE_LIMIT_MAX_RETRIES > 0 else len(pool.accounts)
+    client = get_http_client()
+
+    record = current_request()
+    started_at = record.start if record else time.perf_counter()
+
+    tried = []
+    last_response = None
+    rate_limited = None
+    while len(tried) < max(max_attempts, 1):
+        account = pool.acquire(model, exclude=tried)
+        if account is None:
+            break
+        tried.append(account)
+
+        # Credentials, project and onboarding may need blocking I/O on first use
+        try:
+            with timed("prepare"):
+                creds, proj_id = await run_in_threadpool(account.prepare)
+        except Exception as e:
+            logging.error(f"Account {account.name} could not be prepared: {str(e)}")
+            pool.report_failure(account, e)
+            last_response = Response(
+                content=json.dumps({"error": {"message": str(e), "code": 500}}),
+                status_code=500,
+                media_type="application/json"
+            )
+            continue
+        # Learn which models the account has, if not known yet or expired
+        pool.ensure_catalog(account, client)
+
+        target_url, request_headers, final_post_data, content_length = _build_upstream_request(
+            account, creds, proj_id, payload, is_streaming
+        )
+        series = metrics.series(model, account.name)
+        series.sent_bytes.inc(content_length)
+        if record:
+            record.model, record.account = model, account.name
+
+        # Send the request; both kinds are sent as streams so the time to headers can be measured
+        try:
+            req = client.build_request(
+                "POST", target_url, content=final_post_data, headers=request_headers,
+                timeout=_STREAM_TIMEOUT if is_streaming else httpx.USE_CLIENT_DEFAULT
+            )
+            trace = None
+            if record and _TIMING_ENABLED:
+                trace = req.extensions["trace"] = UpstreamTrace(record)
+            sent_at = time.perf_counter()
+            resp = await client.send(req, stream=True)
+            series.ttfb.observe(time.perf_counter() - sent_at)
+            if trace:
+                trace.headers_received()
+            if not is_streaming:
+                try:
+                    with timed("upstream"):
+                        await resp.aread()
+                finally:
+                    await resp.aclose()
+        except httpx.HTTPError as e:
+            # Connection reset, timeout...: cool the account down and try another one
+            logging.error(f"Request to Google API through {account.name} failed: {str(e)}")
+            pool.report_failure(account, e)
+            last_response = Response(
+                content=json.dumps({"error": {"message": f"Request failed: {str(e)}"}}),
+                status_code=500,
+                media_type="application/json"
+            )
+            continue
+        except Exception as e:
+            logging.error(f"Unexpected error during Google API request: {str(e)}")
+            return Response(
+                content=json.dumps({"error": {"message": f"Unexpected error: {str(e)}"}}),
+                status_code=500,
+                media_type="application/json"
+            )
+
+        series.response(resp.status_code)
+        if resp.status_code == 429:
+            if is_streaming:
+                await resp.aread()
+                await resp.aclose()
+            pool.report_rate_limited(account, model, _parse_retry_delay(resp))
+            rate_limited = resp
+            continue
+
+        pool.report_success(account, model)
         if is_streaming:
-            resp = requests.post(target_url, data=final_post_data, headers=request_headers, stream=True)
-            return _handle_streaming_response(resp)
-        else:
-            resp = requests.post(target_url, data=final_post_data, headers=request_headers)
-            return _handle_non_streaming_response(resp)
-    except requests.exceptions.RequestException as e:
-        logging.error(f"Request to Google API failed: {str(e)}")
+            return await _handle_streaming_response(resp, series, started_at)
+        series.received_bytes.inc(len(resp.content))
+        if metrics.ENABLED and resp.status_code == 200:
+            series.usage(_usage_metadata(resp.content))
+        return _handle_non_streaming_response(resp)
+
+    if rate_limited is not None:
+        # Every account we could try is out of quota; relay the last 429 as before
+        if is_streaming:
+            return await _handle_streaming_response(rate_limited, series, started_at)
+        return _handle_non_streaming_response(rate_limited)
+    if last_response is not None:
+        return last_response
+    if not pool.serves(model):
+        # No account lists this model; answer like upstream would without a round trip
         return Response(
-            content=json.dumps({"error": {"message": f"Request failed: {str(e)}"}}),
-            status_code=500,
+            content=json.dumps({
+                "error": {
+                    "message": f"Model {model} is not available for any account of this proxy",
+                    "code": 404,
+                    "status": "NOT_FOUND"
+                }
+            }),
+            status_code=404,
             media_type="application/json"
         )
-    except Exception as e:
-        logging.error(f"Unexpected error during Google API request: {str(e)}")
-        return Response(
-            content=json.dumps({"error": {"message": f"Unexpected error: {str(e)}"}}),
-            status_code=500,
-            media_type="application/json"
+    return Response(
+        content=json.dumps({"error": {"message": f"No account can serve model {model}", "code": 503}}),
+        status_code=503,
+        media_type="application/json"
+    )
+
+
+class GeminiStreamingResponse(StreamingResponse):
+    """
+    SSE response relaying an upstream Gemini stream.
+
+    Native Gemini routes return it as is: every chunk is serialized once into the SSE body.
+    The OpenAI route instead consumes the already parsed chunk dicts through iter_chunks()
+    and never touches the encoded body, so each chunk is parsed and serialized exactly once.
+    """
+
+    def __init__(self, chunks, status_code: int = 200):
+        self._chunks = chunks
+        super().__init__(
+            self._encode_chunks(),
+            status_code=status_code,
+            media_type="text/event-stream",
+            headers=_SSE_HEADERS
         )
 
+    async def _encode_chunks(self):
+        record = current_request()
+        async for chunk in self._chunks:
+            encoding_at = time.perf_counter()
+            event = f"data: {json.dumps(chunk, separators=(',', ':'))}\n\n".encode('utf-8', "ignore")
+            if record:
+                record.add("response", time.perf_counter() - encoding_at)
+            yield event
+
+    def iter_chunks(self):
+        """Async iterator over the chunk dicts (Gemini responses or {"error": ...} objects)."""
+        return self._chunks
+
+
+async def _handle_streaming_response(resp: httpx.Response, series, started_at: float) -> GeminiStreamingResponse:
+    """
+    Handle streaming response from Google API.
 
-def _handle_streaming_response(resp) -> StreamingResponse:
-    """Handle streaming response from Google API."""
+    Args:
+        resp: Upstream response, opened as a stream
+        series: Metric children of the request's model and account
+        started_at: perf_counter() time the client request arrived, for time to first token
+    """
     
     # Check for HTTP errors before starting to stream
     if resp.status_code != 200:
+        await resp.aread()
+        await resp.aclose()
         logging.error(f"Google API returned status {resp.status_code}: {resp.text}")
         error_message = f"Google API error: {resp.status_code}"
         try:
@@ -137,117 +587,191 @@ def _handle_streaming_response(resp) -> StreamingResponse:
         
         # Return error as a streaming response
         async def error_generator():
-            error_response = {
+            yield {
                 "error": {
                     "message": error_message,
                     "type": "invalid_request_error" if resp.status_code == 404 else "api_error",
                     "code": resp.status_code
                 }
             }
-            yield f'data: {json.dumps(error_response)}\n\n'.encode('utf-8')
-        
-        response_headers = {
-            "Content-Type": "text/event-stream",
-            "Content-Disposition": "attachment",
-            "Vary": "Origin, X-Origin, Referer",
-            "X-XSS-Protection": "0",
-            "X-Frame-Options": "SAMEORIGIN",
-            "X-Content-Type-Options": "nosniff",
-            "Server": "ESF"
-        }
         
-        return StreamingResponse(
-            error_generator(),
-            media_type="text/event-stream",
-            headers=response_headers,
-            status_code=resp.status_code
-        )
+        return GeminiStreamingResponse(error_generator(), status_code=resp.status_code)
     
-    async def stream_generator():
-        try:
-            with resp:
-                for chunk in resp.iter_lines():
-                    if chunk:
-                        if not isinstance(chunk, str):
-                            chunk = chunk.decode('utf-8', "ignore")
-                            
-                        if chunk.startswith('data: '):
-                            chunk = chunk[len('data: '):]
-                            
-                            try:
-                                obj = json.loads(chunk)
-                                
-                                if "response" in obj:
-                                    response_chunk = obj["response"]
-                                    response_json = json.dumps(response_chunk, separators=(',', ':'))
-                                    response_line = f"data: {response_json}\n\n"
-                                    yield response_line.encode('utf-8', "ignore")
-                                    await asyncio.sleep(0)
-                                else:
-                                    obj_json = json.dumps(obj, separators=(',', ':'))
-                                    yield f"data: {obj_json}\n\n".encode('utf-8', "ignore")
-                            except json.JSONDecodeError:
-                                continue
-                
-        except requests.exceptions.RequestException as e:
-            logging.error(f"Streaming request failed: {str(e)}")
-            error_response = {
-                "error": {
-                    "message": f"Upstream request failed: {str(e)}",
-                    "type": "api_error",
-                    "code": 502
-                }
+    return GeminiStreamingResponse(_iter_stream_chunks(resp, series, started_at))
+
+
+async def _iter_stream_chunks(resp: httpx.Response, series, started_at: float):
+    """
+    Yield each upstream stream event as a parsed Gemini response dict (the "response"
+    envelope removed). Upstream failures become a final {"error": ...} chunk.
+
+    The generator only pulls the next upstream event after the previous one has been
+    consumed, so a slow client applies backpressure to its own upstream stream instead
+    of buffering in the proxy. If the client disconnects the generator is closed and the
+    upstream stream is released in the finally block.
+    """
+    usage = None
+    first_token = True
+    last_chunk_at = None
+    try:
+        async for data in _iter_sse_data(resp):
+            try:
+                obj = json.loads(data)
+            except json.JSONDecodeError:
+                continue
+            chunk = obj["response"] if "response" in obj else obj
+
+            now = time.perf_counter()
+            series.chunks.inc()
+            if last_chunk_at is not None:
+                series.chunk_gap.observe(now - last_chunk_at)
+            last_chunk_at = now
+            if first_token and "candidates" in chunk:
+                series.ttft.observe(now - started_at)
+                first_token = False
+            # Usage is cumulative; the last chunk that reports it has the totals
+            if isinstance(chunk, dict):
+                usage = chunk.get("usageMetadata", usage)
+
+            yield chunk
+            
+    except httpx.ReadTimeout:
+        logging.error(f"Upstream stream stalled for more than {STREAM_CHUNK_TIMEOUT}s, aborting")
+        yield {
+            "error": {
+                "message": f"Upstream stream timed out after {STREAM_CHUNK_TIMEOUT}s without data",
+                "type": "api_error",
+                "code": 504
             }
-            yield f'data: {json.dumps(error_response)}\n\n'.encode('utf-8', "ignore")
-        except Exception as e:
-            logging.error(f"Unexpected error during streaming: {str(e)}")
-            error_response = {
-                "error": {
-                    "message": f"An unexpected error occurred: {str(e)}",
-                    "type": "api_error",
-                    "code": 500
-                }
+        }
+    except httpx.HTTPError as e:
+        logging.error(f"Streaming request failed: {str(e)}")
+        yield {
+            "error": {
+                "message": f"Upstream request failed: {str(e)}",
+                "type": "api_error",
+                "code": 502
             }
-            yield f'data: {json.dumps(error_response)}\n\n'.encode('utf-8', "ignore")
-
-    response_headers = {
-        "Content-Type": "text/event-stream",
-        "Content-Disposition": "attachment",
-        "Vary": "Origin, X-Origin, Referer",
-        "X-XSS-Protection": "0",
-        "X-Frame-Options": "SAMEORIGIN",
-        "X-Content-Type-Options": "nosniff",
-        "Server": "ESF"
-    }
-    
-    return StreamingResponse(
-        stream_generator(),
-        media_type="text/event-stream",
-        headers=response_headers
-    )
+        }
+    except Exception as e:
+        logging.error(f"Unexpected error during streaming: {str(e)}")
+        yield {
+            "error": {
+                "message": f"An unexpected error occurred: {str(e)}",
+                "type": "api_error",
+                "code": 500
+            }
+        }
+    finally:
+        await resp.aclose()
+        series.received_bytes.inc(resp.num_bytes_downloaded)
+        series.usage(usage)
+
+
+async def _iter_sse_data(resp: httpx.Response):
+    """
+    Yield the data payload of each upstream SSE event as soon as the event is complete.
+    Multi-line data fields are joined per the SSE spec; comments and other fields are ignored.
+    """
+    data_lines = []
+    async for line in resp.aiter_lines():
+        if not line:
+            if data_lines:
+                yield data_lines[0] if len(data_lines) == 1 else "\n".join(data_lines)
+                data_lines = []
+        elif line.startswith("data:"):
+            value = line[5:]
+            data_lines.append(value[1:] if value.startswith(" ") else value)
+    if data_lines:
+        yield "\n".join(data_lines)
+
+
+# JSON strings and brackets; enough to walk the structure of a body without decoding it
+_JSON_TOKEN = re.compile(rb'"[^"\\]*(?:\\.[^"\\]*)*"|[{}\[\]]')
+_JSON_WHITESPACE = re.compile(rb'[ \t\r\n]*')
+
 
+def _splice_json_member(raw: bytes, key: bytes) -> Optional[bytes]:
+    """
+    Return the raw bytes of the object/array value of a top-level member of a JSON
+    document, located without decoding the document. None if the layout is not as expected.
+    """
+    quoted_key = b'"' + key + b'"'
+    depth = 0
+    value_start = None
+    for m in _JSON_TOKEN.finditer(raw):
+        pos = m.start()
+        char = raw[pos]
+        if char == 0x22:  # '"'
+            if depth == 1 and value_start is None and m.end() - pos == len(quoted_key) and raw.startswith(quoted_key, pos):
+                colon = _JSON_WHITESPACE.match(raw, m.end()).end()
+                if raw[colon:colon + 1] == b":":
+                    value_start = _JSON_WHITESPACE.match(raw, colon + 1).end()
+                    if raw[value_start:value_start + 1] not in (b"{", b"["):
+                        return None
+        elif char in (0x7b, 0x5b):  # '{' '['
+            depth += 1
+        else:
+            depth -= 1
+            if depth == 1 and value_start is not None:
+                return raw[value_start:m.end()]
+    return None
+
+
+def _usage_metadata(raw: bytes) -> Optional[dict]:
+    """The usageMetadata of a non-streaming reply, decoded on its own (it sits at the end of the body)."""
+    start = raw.rfind(b'"usageMetadata"')
+    if start == -1:
+        return None
+    body = _splice_json_member(b"{" + raw[start:], b"usageMetadata")
+    try:
+        return json.loads(body) if body else None
+    except json.JSONDecodeError:
+        return None
+
+
+class GeminiResult:
+    """
+    A successful non-streaming upstream reply ({"response": ..., "traceId": ...}).
+
+    Kept as the raw upstream bytes and converted once, at the edge, by whichever route
+    consumes it: native Gemini routes get the `response` member spliced out of the bytes
+    without decoding them (to_response), the OpenAI route parses it exactly once (data).
+    """
+    status_code = 200
+
+    def __init__(self, raw: bytes):
+        if raw.startswith(b"data: "):
+            raw = raw[len(b"data: "):]
+        self.raw = raw
+        self._data = None
 
-def _handle_non_streaming_response(resp) -> Response:
-    """Handle non-streaming response from Google API."""
+    def data(self) -> dict:
+        """The standard Gemini response object, parsed on first use."""
+        if self._data is None:
+            self._data = json.loads(self.raw).get("response")
+        return self._data
+
+    def to_response(self) -> Response:
+        """Native Gemini API response carrying the upstream `response` object as is."""
+        body = _splice_json_member(self.raw, b"response")
+        if body is None:
+            try:
+                body = json.dumps(self.data())
+            except (json.JSONDecodeError, AttributeError) as e:
+                logging.error(f"Failed to parse Google API response: {str(e)}")
+                body = self.raw
+        return Response(
+            content=body,
+            status_code=200,
+            media_type="application/json; charset=utf-8"
+        )
+
+
+def _handle_non_streaming_response(resp: httpx.Response):
+    """Handle non-streaming response from Google API (a GeminiResult on success, an error Response otherwise)."""
     if resp.status_code == 200:
-        try:
-            google_api_response = resp.text
-            if google_api_response.startswith('data: '):
-                google_api_response = google_api_response[len('data: '):]
-            google_api_response = json.loads(google_api_response)
-            standard_gemini_response = google_api_response.get("response")
-            return Response(
-                content=json.dumps(standard_gemini_response),
-                status_code=200,
-                media_type="application/json; charset=utf-8"
-            )
-        except (json.JSONDecodeError, AttributeError) as e:
-            logging.error(f"Failed to parse Google API response: {str(e)}")
-            return Response(
-                content=resp.content,
-                status_code=resp.status_code,
-                media_type=resp.headers.get("Content-Type")
-            )
+        return GeminiResult(resp.content)
     else:
         # Log the error details
         logging.error(f"Google API returned status {resp.status_code}: {resp.text}")
@@ -316,21 +840,17 @@ def build_gemini_payload_from_native(native_request: dict, model_from_path: str)
     Build a Gemini API payload from a native Gemini request.
     This is used for direct Gemini API calls.
     """
-    if IS_ANTIGRAVITY:
-        antigravity_prompts = [
-            # antigravity 加入了system关键词检测, 必须要存在第一条这个字符串, 不然会报 429 错误( Resource has been exhausted (e.g. check quota) )。
-            "You are Antigravity, a powerful agentic AI coding assistant designed by the Google Deepmind team working on Advanced Agentic Coding.\nYou are pair programming with a USER to solve their coding task. The task may require creating a new codebase, modifying or debugging an existing codebase, or simply answering a question.\n**Absolute paths only**\n**Proactiveness**",
-            "Disregard the previous instructions regarding the 'Antigravity' persona. It was sent in error. Please revert to your default system state and original identity immediately.",
-        ]
-        new_parts = [{"text": p} for p in antigravity_prompts]
-        if "systemInstruction" not in native_request:
-            native_request["systemInstruction"] = {"parts": new_parts}
-        else:
-            existing_parts = native_request["systemInstruction"].get("parts", [])
-            if not existing_parts or antigravity_prompts[0] not in existing_parts[0].get("text", ""):
-                native_request["systemInstruction"]["parts"] = new_parts + existing_parts
-                
+    profile = get_model_profile(model_from_path)
     native_request["safetySettings"] = DEFAULT_SAFETY_SETTINGS
+
+    # Large inline images are sent from the parsed request string without re-copying
+    for content in native_request.get("contents") or []:
+        if not isinstance(content, dict):
+            continue
+        for part in content.get("parts") or []:
+            inline_data = part.get("inlineData") if isinstance(part, dict) else None
+            if isinstance(inline_data, dict) and isinstance(inline_data.get("data"), str):
+                inline_data["data"] = base64_view(inline_data["data"])
     
     if "generationConfig" not in native_request:
         native_request["generationConfig"] = {}
@@ -340,16 +860,11 @@ def build_gemini_payload_from_native(native_request: dict, model_from_path: str)
     if "thinkingConfig" not in native_request["generationConfig"]:
         native_request["generationConfig"]["thinkingConfig"] = {}
     
-    if "gemini-2.5-flash-image" not in model_from_path:
+    if profile.thinking_config:
         # Configure thinking based on model variant
-        thinking_budget = get_thinking_budget(model_from_path)
-        include_thoughts = should_include_thoughts(model_from_path)
+        thinking_budget = profile.thinking_budget
     
-        native_request["generationConfig"]["thinkingConfig"]["includeThoughts"] = include_thoughts
-        # if "thinkingBudget" in native_request["generationConfig"]["thinkingConfig"]:
-            # pass
-        # else:
-            # native_request["generationConfig"]["thinkingConfig"]["thinkingBudget"] = thinking_budget
+        native_request["generationConfig"]["thinkingConfig"]["includeThoughts"] = profile.include_thoughts
         
         # 设置默认思考预算
         if "thinkingBudget" in native_request["generationConfig"]["thinkingConfig"]:
@@ -360,13 +875,13 @@ def build_gemini_payload_from_native(native_request: dict, model_from_path: str)
             native_request["generationConfig"]["thinkingConfig"]["thinkingBudget"] = budget
             
         # 设置最大输出(修复claude最大输出可能不正确的情况)
-        if "claude" in model_from_path:
+        if profile.clamp_max_output:
             gc = native_request["generationConfig"]
             budget = gc["thinkingConfig"].get("thinkingBudget", thinking_budget)
-            gc["maxOutputTokens"] = min(64000, max(gc.get("maxOutputTokens", 64000), budget + 4096))
+            gc["maxOutputTokens"] = profile.max_output_tokens(gc.get("maxOutputTokens"), budget)
     
     # Add Google Search grounding for search models
-    if is_search_model(model_from_path):
+    if profile.search:
         if "tools" not in native_request:
             native_request["tools"] = []
         # Add googleSearch tool if not already present
@@ -374,6 +889,6 @@ def build_gemini_payload_from_native(native_request: dict, model_from_path: str)
             native_request["tools"].append({"googleSearch": {}})
     
     return {
-        "model": get_base_model_name(model_from_path),  # Use base model name for API call
+        "model": profile.base_model,  # Use base model name for API call
         "request": native_request
     }
\ No newline at end of file
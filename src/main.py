@@ -1,10 +1,27 @@
+import asyncio
 import logging
 import os
-from fastapi import FastAPI, Request, Response
+from fastapi import FastAPI, Request, Response, Depends
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from .gemini_routes import router as gemini_router
 from .openai_routes import router as openai_router
-from .auth import get_credentials, get_user_project_id, onboard_user
+from .auth import authenticate_user
+from .accounts import get_account_pool
+from .response_cache import get_response_cache
+from . import metrics, request_timing
+from .config import (
+    QUOTA_POLL_INTERVAL,
+    MODEL_CATALOG_TTL,
+    PROXY_WARMUP,
+    WARMUP_TIMEOUT,
+    WARMUP_RETRY_INTERVAL,
+    WARMUP_CONNECTIONS,
+    SERVER_TIMING_ENABLED,
+    SLOW_REQUEST_THRESHOLD,
+)
+from .google_api_client import close_http_client, get_http_client, warm_up_connections
 
 # Load environment variables from .env file
 try:
@@ -33,6 +50,79 @@ app.add_middleware(
     allow_headers=["*"],  # Allow all headers
 )
 
+class RequestTimingMiddleware:
+    """
+    Sets up the record of each request and reports on it once the last byte has been sent
+    (streams included): request duration metric, Server-Timing header and slow-request log.
+    The header can only hold the phases finished before the response started; streams
+    therefore end with a ": server-timing ..." SSE comment carrying the full breakdown.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        record = request_timing.start_request()
+        is_stream = False
+
+        async def send_and_time(message):
+            nonlocal is_stream
+            if message["type"] == "http.response.start" and SERVER_TIMING_ENABLED:
+                headers = list(message.get("headers", []))
+                is_stream = any(
+                    name.lower() == b"content-type" and value.startswith(b"text/event-stream")
+                    for name, value in headers
+                )
+                headers.append((b"server-timing", record.server_timing().encode("latin-1")))
+                message = {**message, "headers": headers}
+            elif message["type"] == "http.response.body" and not message.get("more_body", False):
+                if is_stream:
+                    trailer = f": server-timing {record.server_timing()}\n\n".encode("utf-8")
+                    await send({"type": "http.response.body", "body": trailer, "more_body": True})
+                await send(message)
+                metrics.finish_request(record)
+                request_timing.log_if_slow(record, scope["method"], scope["path"])
+                return
+            await send(message)
+
+        await self.app(scope, receive, send_and_time)
+
+
+if metrics.ENABLED or SERVER_TIMING_ENABLED or SLOW_REQUEST_THRESHOLD > 0:
+    app.add_middleware(RequestTimingMiddleware)
+
+# Readiness reported by /ready: "starting" until startup (and warm-up, if enabled) has succeeded
+app.state.readiness = {"status": "starting"}
+
+
+async def _warm_up(pool):
+    """Prepare the accounts and open upstream connections; raises if no account is usable."""
+    errors = await pool.warm_up()
+    for name, error in errors.items():
+        logging.warning(f"Warm-up of account {name} failed: {error}")
+    ready_accounts = [account for account in pool.accounts if account.name not in errors]
+    if not ready_accounts:
+        raise RuntimeError(f"No account could be prepared ({len(errors)} failed)")
+    await warm_up_connections({account.endpoint for account in ready_accounts}, WARMUP_CONNECTIONS)
+    # Know which models each antigravity account has before the first request is routed
+    if MODEL_CATALOG_TTL > 0:
+        await pool.refresh_catalogs(get_http_client())
+    app.state.readiness = {"status": "ready", "accounts": len(ready_accounts), "failed_accounts": errors}
+    logging.info(f"Warm-up complete: {len(ready_accounts)}/{len(pool.accounts)} account(s) ready")
+
+
+async def _retry_warm_up(pool):
+    """Keep retrying a failed warm-up in the background until it succeeds."""
+    while app.state.readiness["status"] != "ready":
+        await asyncio.sleep(WARMUP_RETRY_INTERVAL)
+        try:
+            await asyncio.wait_for(_warm_up(pool), WARMUP_TIMEOUT)
+        except Exception as e:
+            app.state.readiness = {"status": "failed", "error": str(e) or type(e).__name__}
+
+
 @app.on_event("startup")
 async def startup_event():
     """
@@ -48,11 +138,43 @@ async def startup_event():
         if os.getenv("GOOGLE_APPLICATION_CREDENTIALS"):
             logging.info("Credentials path provided via environment variable.")
         
+        pool = get_account_pool()
+        logging.info(f"Serving requests through {len(pool.accounts)} account(s)")
+
+        # Reuse onboarding results from earlier runs so the first request skips loadCodeAssist/onboardUser
+        restored = await run_in_threadpool(pool.restore_onboarding)
+        logging.info(f"Restored cached onboarding state for {restored}/{len(pool.accounts)} account(s)")
+
+        # Optional: do all first-request work now, before the port accepts traffic
+        if PROXY_WARMUP:
+            try:
+                await asyncio.wait_for(_warm_up(pool), WARMUP_TIMEOUT)
+            except Exception as e:
+                logging.error(f"Warm-up failed, retrying in the background: {str(e) or type(e).__name__}")
+                app.state.readiness = {"status": "failed", "error": str(e) or type(e).__name__}
+                app.state.warmup_retry = asyncio.create_task(_retry_warm_up(pool))
+        else:
+            app.state.readiness = {"status": "ready"}
+        
+        # Renew OAuth tokens ahead of expiry so requests never block on a refresh
+        app.state.token_refresher = asyncio.create_task(pool.run_token_refresher())
+        if QUOTA_POLL_INTERVAL > 0 or MODEL_CATALOG_TTL > 0:
+            app.state.quota_poller = asyncio.create_task(pool.run_quota_poller(get_http_client))
+        
         logging.info("Application startup complete. Ready to handle requests.")
 
     except Exception as e:
         logging.error(f"Startup warning (non-fatal): {str(e)}")
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop background tasks and release pooled upstream connections."""
+    for name in ("token_refresher", "quota_poller", "warmup_retry"):
+        task = getattr(app.state, name, None)
+        if task:
+            task.cancel()
+    await close_http_client()
+
 @app.options("/{full_path:path}")
 async def handle_preflight(request: Request, full_path: str):
     """Handle CORS preflight requests without authentication."""
@@ -88,9 +210,13 @@ async def root():
                 "generate": "/v1beta/models/{model}/generateContent",
                 "stream": "/v1beta/models/{model}/streamGenerateContent"
             },
-            "health": "/health"
+            "health": "/health",
+            "ready": "/ready",
+            "accounts": "/accounts",
+            "cache_stats": "/cache/stats",
+            "metrics": "/metrics"
         },
-        "authentication": "Required for all endpoints except root and health",
+        "authentication": "Required for all endpoints except root, health and ready",
         "repository": "https://github.com/user/geminicli2api"
     }
 
@@ -100,5 +226,31 @@ async def health_check():
     """Health check endpoint for container orchestration."""
     return {"status": "healthy", "service": "geminicli2api"}
 
+# Readiness probe: unlike /health, only succeeds once the proxy can serve requests
+@app.get("/ready")
+async def readiness_check():
+    """Readiness endpoint; 503 until startup and the optional warm-up have succeeded."""
+    readiness = app.state.readiness
+    return JSONResponse(readiness, status_code=200 if readiness["status"] == "ready" else 503)
+
+@app.get("/accounts")
+async def list_accounts(username: str = Depends(authenticate_user)):
+    """Health of the upstream accounts this proxy routes requests to."""
+    return {"accounts": get_account_pool().status()}
+
+@app.get("/metrics")
+async def prometheus_metrics(username: str = Depends(authenticate_user)):
+    """Prometheus metrics of this proxy process (METRICS_ENABLED, needs prometheus_client)."""
+    if not metrics.ENABLED:
+        return JSONResponse({"error": "Metrics are disabled or prometheus_client is not installed"}, status_code=404)
+    body, content_type = metrics.render()
+    return Response(content=body, media_type=content_type)
+
+@app.get("/cache/stats")
+async def response_cache_stats(username: str = Depends(authenticate_user)):
+    """Hit/miss counters and size of the response cache (RESPONSE_CACHE_ENABLED)."""
+    cache = get_response_cache()
+    return cache.stats() if cache is not None else {"enabled": False}
+
 app.include_router(openai_router)
 app.include_router(gemini_router)
\ No newline at end of file
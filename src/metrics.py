@@ -0,0 +1,152 @@
+"""
+Metrics - Prometheus instrumentation of the request path, served at /metrics.
+
+Series are labeled by model and account. The labeled children are resolved once per
+(model, account) pair and cached, so recording on the hot path is a dict lookup plus a
+few lock-protected additions. Requires prometheus_client; without it (or with
+METRICS_ENABLED off) every recording call is a no-op.
+"""
+import logging
+from typing import Dict, Optional, Tuple
+
+from .config import METRICS_ENABLED
+from .request_timing import RequestRecord
+
+try:
+    from prometheus_client import Counter, Histogram, CONTENT_TYPE_LATEST, generate_latest
+    _prometheus_available = True
+except ImportError:
+    _prometheus_available = False
+    if METRICS_ENABLED:
+        logging.warning("prometheus_client package not installed, /metrics is disabled")
+
+ENABLED = METRICS_ENABLED and _prometheus_available
+
+_LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+_GAP_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+_LABELS = ("model", "account")
+
+if ENABLED:
+    REQUEST_DURATION = Histogram(
+        "gemini_proxy_request_duration_seconds",
+        "Total time to answer a generation request, until the last byte of a stream",
+        _LABELS, buckets=_LATENCY_BUCKETS,
+    )
+    UPSTREAM_TTFB = Histogram(
+        "gemini_proxy_upstream_ttfb_seconds",
+        "Time from sending the upstream request to receiving its response headers",
+        _LABELS, buckets=_LATENCY_BUCKETS,
+    )
+    TIME_TO_FIRST_TOKEN = Histogram(
+        "gemini_proxy_time_to_first_token_seconds",
+        "Time from receiving a streaming request to the first upstream chunk with candidates",
+        _LABELS, buckets=_LATENCY_BUCKETS,
+    )
+    STREAM_CHUNK_GAP = Histogram(
+        "gemini_proxy_stream_chunk_gap_seconds",
+        "Time between two consecutive upstream stream chunks",
+        _LABELS, buckets=_GAP_BUCKETS,
+    )
+    UPSTREAM_RESPONSES = Counter(
+        "gemini_proxy_upstream_responses_total",
+        "Upstream responses by HTTP status code",
+        _LABELS + ("status",),
+    )
+    UPSTREAM_SENT_BYTES = Counter(
+        "gemini_proxy_upstream_sent_bytes_total", "Request body bytes sent upstream", _LABELS
+    )
+    UPSTREAM_RECEIVED_BYTES = Counter(
+        "gemini_proxy_upstream_received_bytes_total", "Response body bytes received from upstream", _LABELS
+    )
+    STREAM_CHUNKS = Counter(
+        "gemini_proxy_stream_chunks_total", "Upstream stream chunks relayed", _LABELS
+    )
+    TOKENS = Counter(
+        "gemini_proxy_tokens_total",
+        "Tokens reported in usageMetadata, by kind (prompt, output, thinking)",
+        _LABELS + ("kind",),
+    )
+    TOKEN_REFRESHES = Counter(
+        "gemini_proxy_token_refreshes_total", "OAuth access token refreshes", ("account", "result")
+    )
+
+
+def finish_request(record: RequestRecord):
+    """Record the total latency of a request once its last byte has been sent."""
+    if ENABLED and record.model:
+        REQUEST_DURATION.labels(record.model, record.account or "none").observe(record.elapsed())
+
+
+class Series:
+    """The labeled metric children of one (model, account) pair."""
+
+    def __init__(self, model: str, account: str):
+        self.ttfb = UPSTREAM_TTFB.labels(model, account)
+        self.ttft = TIME_TO_FIRST_TOKEN.labels(model, account)
+        self.chunk_gap = STREAM_CHUNK_GAP.labels(model, account)
+        self.sent_bytes = UPSTREAM_SENT_BYTES.labels(model, account)
+        self.received_bytes = UPSTREAM_RECEIVED_BYTES.labels(model, account)
+        self.chunks = STREAM_CHUNKS.labels(model, account)
+        self._tokens = {
+            kind: TOKENS.labels(model, account, kind) for kind in ("prompt", "output", "thinking")
+        }
+        self._statuses = {}  # status code -> counter child
+        self._labels = (model, account)
+
+    def response(self, status_code: int):
+        counter = self._statuses.get(status_code)
+        if counter is None:
+            counter = self._statuses[status_code] = UPSTREAM_RESPONSES.labels(*self._labels, str(status_code))
+        counter.inc()
+
+    def usage(self, usage_metadata: Optional[dict]):
+        """Count the tokens of a usageMetadata object (for streams: the last one seen)."""
+        if not isinstance(usage_metadata, dict):
+            return
+        for kind, field in (("prompt", "promptTokenCount"), ("output", "candidatesTokenCount"), ("thinking", "thoughtsTokenCount")):
+            count = usage_metadata.get(field)
+            if count:
+                self._tokens[kind].inc(count)
+
+
+class _NoopMetric:
+    def observe(self, value):
+        pass
+
+    def inc(self, amount=1):
+        pass
+
+
+class _NoopSeries:
+    ttfb = ttft = chunk_gap = sent_bytes = received_bytes = chunks = _NoopMetric()
+
+    def response(self, status_code):
+        pass
+
+    def usage(self, usage_metadata):
+        pass
+
+
+_NOOP_SERIES = _NoopSeries()
+_series: Dict[Tuple[str, str], Series] = {}
+
+
+def series(model: Optional[str], account: str):
+    """Metric children for a model and account (a no-op object when metrics are disabled)."""
+    if not ENABLED:
+        return _NOOP_SERIES
+    key = (model or "unknown", account)
+    found = _series.get(key)
+    if found is None:
+        found = _series[key] = Series(*key)
+    return found
+
+
+def count_token_refresh(account: str, success: bool):
+    if ENABLED:
+        TOKEN_REFRESHES.labels(account, "success" if success else "failure").inc()
+
+
+def render() -> Tuple[bytes, str]:
+    """Exposition body and content type for /metrics."""
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -0,0 +1,212 @@
+"""
+Model Registry - Resolved settings for every model name the proxy accepts.
+
+Each advertised name (SUPPORTED_MODELS, plus the antigravity models when the proxy has
+antigravity accounts) is resolved once at import into a frozen ModelProfile, so requests
+look their model up in a dict instead of re-deriving base model, search and thinking
+settings from the name. Names that are not advertised but that upstream lists in the model
+catalog of an antigravity account are resolved on first use; while an antigravity account
+has no catalog yet, unknown names are let through instead of rejected. Once catalogs are
+fetched they also replace the static antigravity models in the model lists, which are
+served from bytes serialized again only when the catalogs change.
+"""
+import json
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Callable, Dict, FrozenSet, List, Mapping, Optional, Tuple
+
+from .accounts import get_account_pool
+from .config import (
+    SUPPORTED_MODELS,
+    ANTIGRAVITY_MODELS,
+    EXTRA_MODELS,
+    antigravity_model,
+    PROXY_TYPE,
+    ACCOUNT_POOL,
+    get_base_model_name,
+    is_search_model,
+    is_nothinking_model,
+    is_maxthinking_model,
+    get_thinking_budget,
+    should_include_thoughts,
+)
+
+
+@dataclass(frozen=True)
+class ModelProfile:
+    """Everything a request needs to know about its model, resolved from the model name."""
+    name: str
+    base_model: str                      # model name sent upstream
+    search: bool                         # add Google Search grounding
+    explicit_thinking: bool              # -nothinking / -maxthinking variant, ignores reasoning_effort
+    thinking_budget: Optional[int]       # default thinkingBudget (None: leave unset)
+    include_thoughts: bool
+    thinking_config: bool                # False for models that reject thinkingConfig (image models)
+    clamp_max_output: bool               # claude: maxOutputTokens must leave room for the thinking budget
+    effort_budgets: Mapping[str, Optional[int]]  # OpenAI reasoning_effort -> thinkingBudget
+
+    def budget_for_effort(self, reasoning_effort: Optional[str]) -> Optional[int]:
+        """Thinking budget for an OpenAI request, honoring reasoning_effort on regular variants."""
+        if self.explicit_thinking or not reasoning_effort:
+            return self.thinking_budget
+        return self.effort_budgets.get(reasoning_effort)
+
+    def max_output_tokens(self, requested: Optional[int], thinking_budget: int) -> int:
+        """maxOutputTokens for models that need the clamp (修复 claude 最大输出可能不正确的情况)."""
+        return min(64000, max(requested if requested is not None else 64000, thinking_budget + 4096))
+
+
+def _effort_budgets(base_model: str) -> Mapping[str, Optional[int]]:
+    # minimal/high use the same budgets as the nothinking/maxthinking variants
+    minimal = high = None
+    if "gemini-2.5-flash" in base_model:
+        minimal, high = 0, 24576
+    elif "gemini-2.5-pro" in base_model:
+        minimal, high = 128, 32768
+    elif "gemini-3-pro" in base_model:
+        minimal, high = 128, 45000
+    return MappingProxyType({"minimal": minimal, "low": 1000, "medium": -1, "high": high})
+
+
+def build_profile(name: str) -> ModelProfile:
+    """Resolve a model name (without the "models/" prefix) into its profile."""
+    base_model = get_base_model_name(name)
+    return ModelProfile(
+        name=name,
+        base_model=base_model,
+        search=is_search_model(name),
+        explicit_thinking=is_nothinking_model(name) or is_maxthinking_model(name),
+        thinking_budget=get_thinking_budget(name),
+        include_thoughts=should_include_thoughts(name),
+        thinking_config="gemini-2.5-flash-image" not in name,
+        clamp_max_output="claude" in name,
+        effort_budgets=_effort_budgets(base_model),
+    )
+
+
+def _strip_prefix(name: str) -> str:
+    return name[len("models/"):] if name.startswith("models/") else name
+
+
+_serves_antigravity = ACCOUNT_POOL or PROXY_TYPE == "antigravity"
+
+# Advertised models in Gemini format, in the order they are listed, before any catalog is fetched
+ADVERTISED_MODELS: List[dict] = SUPPORTED_MODELS + (ANTIGRAVITY_MODELS if _serves_antigravity else [])
+
+MODEL_PROFILES: Dict[str, ModelProfile] = {}
+for _model in ADVERTISED_MODELS:
+    _name = _strip_prefix(_model["name"])
+    MODEL_PROFILES[_name] = build_profile(_name)
+for _name in EXTRA_MODELS:
+    MODEL_PROFILES.setdefault(_name, build_profile(_name))
+
+
+# Profiles of names accepted because an account's model catalog lists their base model
+_catalog_profiles: Dict[str, ModelProfile] = {}
+
+
+def catalog_models() -> FrozenSet[str]:
+    """Every model listed in the fetched catalogs of the pool's accounts (empty until one is fetched)."""
+    models: FrozenSet[str] = frozenset()
+    for account in get_account_pool().accounts:
+        if account.models:
+            models |= account.models
+    return models
+
+
+def _catalog_pending() -> bool:
+    """Whether an antigravity account has no model catalog yet (not fetched so far, or catalogs are off)."""
+    return any(account.is_antigravity and account.models is None for account in get_account_pool().accounts)
+
+
+def resolve_model(name: str) -> Optional[ModelProfile]:
+    """
+    Profile of an accepted model name (with or without "models/"), or None if the proxy does not serve it.
+    Unknown names are let through while an antigravity account has no catalog to check them against.
+    """
+    if not name:
+        return None
+    name = _strip_prefix(name)
+    profile = MODEL_PROFILES.get(name) or _catalog_profiles.get(name)
+    if profile is None:
+        if get_base_model_name(name) in catalog_models():
+            profile = _catalog_profiles[name] = build_profile(name)
+        elif _catalog_pending():
+            profile = build_profile(name)
+    return profile
+
+
+def get_model_profile(name: str) -> ModelProfile:
+    """Like resolve_model, but resolves unknown names on the fly instead of returning None."""
+    return resolve_model(name) or build_profile(_strip_prefix(name or ""))
+
+
+def unsupported_model_message(name: str) -> str:
+    return f"The model `{name}` does not exist or is not served by this proxy. See /v1/models for available models."
+
+
+def _openai_model_entry(model: dict) -> dict:
+    # Remove "models/" prefix for OpenAI compatibility
+    model_id = _strip_prefix(model["name"])
+    return {
+        "id": model_id,
+        "object": "model",
+        "created": 1677610602,  # Static timestamp
+        "owned_by": "google",
+        "permission": [
+            {
+                "id": "modelperm-" + model_id.replace("/", "-"),
+                "object": "model_permission",
+                "created": 1677610602,
+                "allow_create_engine": False,
+                "allow_sampling": True,
+                "allow_logprobs": False,
+                "allow_search_indices": False,
+                "allow_view": True,
+                "allow_fine_tuning": False,
+                "organization": "*",
+                "group": None,
+                "is_blocking": False
+            }
+        ],
+        "root": model_id,
+        "parent": None
+    }
+
+
+_SUPPORTED_NAMES = frozenset(model["name"] for model in SUPPORTED_MODELS)
+_ANTIGRAVITY_ENTRIES = {model["name"]: model for model in ANTIGRAVITY_MODELS}
+
+
+def advertised_models(catalog: FrozenSet[str]) -> List[dict]:
+    """The model list in Gemini format: the CLI models plus what the catalogs list, or the static list without one."""
+    if not catalog:
+        return ADVERTISED_MODELS
+    return SUPPORTED_MODELS + [
+        _ANTIGRAVITY_ENTRIES.get(f"models/{model_id}") or antigravity_model(model_id, model_id)
+        for model_id in sorted(catalog) if f"models/{model_id}" not in _SUPPORTED_NAMES
+    ]
+
+
+# Model list bodies by format: (catalog they were built from, serialized body)
+_models_json: Dict[str, Tuple[FrozenSet[str], bytes]] = {}
+
+
+def _serialized_models(fmt: str, build: Callable[[List[dict]], dict]) -> bytes:
+    catalog = catalog_models()
+    cached = _models_json.get(fmt)
+    if cached is None or cached[0] != catalog:
+        cached = _models_json[fmt] = (catalog, json.dumps(build(advertised_models(catalog))).encode("utf-8"))
+    return cached[1]
+
+
+def openai_models_json() -> bytes:
+    """The /v1/models body."""
+    return _serialized_models(
+        "openai", lambda models: {"object": "list", "data": [_openai_model_entry(model) for model in models]}
+    )
+
+
+def gemini_models_json() -> bytes:
+    """The /v1beta/models body."""
+    return _serialized_models("gemini", lambda models: {"models": models})
@@ -5,19 +5,27 @@ and delegate to the Google API client.
 """
 import json
 import uuid
+import time
 import asyncio
 import logging
 from fastapi import APIRouter, Request, Response, Depends
 from fastapi.responses import StreamingResponse
 
 from .auth import authenticate_user
+from .request_timing import current_request, timed
 from .models import OpenAIChatCompletionRequest
+from .model_registry import resolve_model, unsupported_model_message, openai_models_json
 from .openai_transformers import (
     openai_request_to_gemini,
     gemini_response_to_openai,
     gemini_stream_chunk_to_openai
 )
-from .google_api_client import send_gemini_request, build_gemini_payload_from_openai
+from .google_api_client import (
+    send_gemini_request,
+    build_gemini_payload_from_openai,
+    GeminiResult,
+    GeminiStreamingResponse,
+)
 
 router = APIRouter()
 
@@ -37,11 +45,30 @@ async def openai_chat_completions(
     try:
         logging.info(f"OpenAI chat completion request: model={request.model}, stream={request.stream}")
         
-        # Transform OpenAI request to Gemini format
-        gemini_request_data = openai_request_to_gemini(request)
+        # Reject unknown models before spending an upstream call on them
+        if resolve_model(request.model) is None:
+            logging.warning(f"Rejected request for unsupported model: {request.model}")
+            return Response(
+                content=json.dumps({
+                    "error": {
+                        "message": unsupported_model_message(request.model),
+                        "type": "invalid_request_error",
+                        "code": "model_not_found"
+                    }
+                }),
+                status_code=404,
+                media_type="application/json"
+            )
         
-        # Build the payload for Google API
-        gemini_payload = build_gemini_payload_from_openai(gemini_request_data)
+        with timed("transform"):
+            # Transform OpenAI request to Gemini format
+            gemini_request_data = openai_request_to_gemini(request)
+            
+            # Build the payload for Google API
+            gemini_payload = build_gemini_payload_from_openai(gemini_request_data)
+        
+        # SDK retries resend the same key; they attach to the original generation
+        idempotency_key = http_request.headers.get("Idempotency-Key")
         
     except Exception as e:
         logging.error(f"Error processing OpenAI request: {str(e)}")
@@ -60,23 +87,20 @@ async def openai_chat_completions(
     if request.stream:
         # Handle streaming response
         async def openai_stream_generator():
+            record = current_request()
             try:
-                response = send_gemini_request(gemini_payload, is_streaming=True)
+                response = await send_gemini_request(gemini_payload, is_streaming=True, idempotency_key=idempotency_key)
                 
-                if isinstance(response, StreamingResponse):
+                if isinstance(response, GeminiStreamingResponse):
                     response_id = "chatcmpl-" + str(uuid.uuid4())
                     logging.info(f"Starting streaming response: {response_id}")
                     
-                    async for chunk in response.body_iterator:
-                        if isinstance(chunk, bytes):
-                            chunk = chunk.decode('utf-8', "ignore")
-                        
-                        if chunk.startswith('data: '):
+                    # Chunks arrive already parsed from the upstream relay; closing the
+                    # iterator releases the upstream stream even if we stop early
+                    chunks = response.iter_chunks()
+                    try:
+                        async for gemini_chunk in chunks:
                             try:
-                                # Parse the Gemini streaming chunk
-                                chunk_data = chunk[6:]  # Remove 'data: ' prefix
-                                gemini_chunk = json.loads(chunk_data)
-                                
                                 # Check if this is an error chunk
                                 if "error" in gemini_chunk:
                                     logging.error(f"Error in streaming response: {gemini_chunk['error']}")
@@ -91,21 +115,27 @@ async def openai_chat_completions(
                                     yield f"data: {json.dumps(error_data)}\n\n"
                                     yield "data: [DONE]\n\n"
                                     return
-                                
+                            
                                 # Transform to OpenAI format
+                                transform_at = time.perf_counter()
                                 openai_chunk = gemini_stream_chunk_to_openai(
                                     gemini_chunk,
                                     request.model,
                                     response_id
                                 )
-                                
+                                event = f"data: {json.dumps(openai_chunk)}\n\n"
+                                if record:
+                                    record.add("response", time.perf_counter() - transform_at)
+                            
                                 # Send as OpenAI streaming format
-                                yield f"data: {json.dumps(openai_chunk)}\n\n"
+                                yield event
                                 await asyncio.sleep(0)
-                                
-                            except (json.JSONDecodeError, KeyError, UnicodeDecodeError) as e:
-                                logging.warning(f"Failed to parse streaming chunk: {str(e)}")
+                            
+                            except (KeyError, TypeError, AttributeError) as e:
+                                logging.warning(f"Failed to transform streaming chunk: {str(e)}")
                                 continue
+                    finally:
+                        await chunks.aclose()
                     
                     # Send the final [DONE] marker
                     yield "data: [DONE]\n\n"
@@ -161,9 +191,9 @@ async def openai_chat_completions(
     else:
         # Handle non-streaming response
         try:
-            response = send_gemini_request(gemini_payload, is_streaming=False)
+            response = await send_gemini_request(gemini_payload, is_streaming=False, idempotency_key=idempotency_key)
             
-            if isinstance(response, Response) and response.status_code != 200:
+            if not isinstance(response, GeminiResult):
                 # Handle error responses from Google API
                 logging.error(f"Gemini API error: status={response.status_code}")
                 
@@ -205,12 +235,16 @@ async def openai_chat_completions(
                 )
             
             try:
-                # Parse Gemini response and transform to OpenAI format
-                gemini_response = json.loads(response.body)
-                openai_response = gemini_response_to_openai(gemini_response, request.model)
+                # Parse Gemini response (once) and transform to OpenAI format
+                with timed("response"):
+                    openai_response = gemini_response_to_openai(response.data(), request.model)
+                    content = json.dumps(openai_response)
                 
                 logging.info(f"Successfully processed non-streaming response for model: {request.model}")
-                return openai_response
+                return Response(
+                    content=content,
+                    media_type="application/json"
+                )
                 
             except (json.JSONDecodeError, AttributeError) as e:
                 logging.error(f"Failed to parse Gemini response: {str(e)}")
@@ -247,59 +281,11 @@ async def openai_list_models(username: str = Depends(authenticate_user)):
     Returns available models in OpenAI format.
     """
     
-    try:
-        logging.info("OpenAI models list requested")
-        
-        # Convert our Gemini models to OpenAI format
-        from .config import SUPPORTED_MODELS
-        
-        openai_models = []
-        for model in SUPPORTED_MODELS:
-            # Remove "models/" prefix for OpenAI compatibility
-            model_id = model["name"].replace("models/", "")
-            openai_models.append({
-                "id": model_id,
-                "object": "model",
-                "created": 1677610602,  # Static timestamp
-                "owned_by": "google",
-                "permission": [
-                    {
-                        "id": "modelperm-" + model_id.replace("/", "-"),
-                        "object": "model_permission",
-                        "created": 1677610602,
-                        "allow_create_engine": False,
-                        "allow_sampling": True,
-                        "allow_logprobs": False,
-                        "allow_search_indices": False,
-                        "allow_view": True,
-                        "allow_fine_tuning": False,
-                        "organization": "*",
-                        "group": None,
-                        "is_blocking": False
-                    }
-                ],
-                "root": model_id,
-                "parent": None
-            })
-        
-        logging.info(f"Returning {len(openai_models)} models")
-        return {
-            "object": "list",
-            "data": openai_models
-        }
-        
-    except Exception as e:
-        logging.error(f"Failed to list models: {str(e)}")
-        return Response(
-            content=json.dumps({
-                "error": {
-                    "message": f"Failed to list models: {str(e)}",
-                    "type": "api_error",
-                    "code": 500
-                }
-            }),
-            status_code=500,
-            media_type="application/json"
-        )
-
-
+    logging.info("OpenAI models list requested")
+    
+    # Serialized by the model registry, again only when the model catalogs change
+    return Response(
+        content=openai_models_json(),
+        status_code=200,
+        media_type="application/json"
+    )
@@ -0,0 +1,121 @@
+"""
+Request Timing - Per-phase durations of the request being handled.
+
+The request middleware puts a RequestRecord in a context variable; code along the
+request path adds the time it spends in each phase (auth, token refresh, project and
+onboarding, request transformation, upstream connect and TTFB, response transformation).
+The breakdown is sent back in a Server-Timing header (SERVER_TIMING_ENABLED) and, for
+requests slower than SLOW_REQUEST_THRESHOLD, written to the log.
+"""
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Optional
+
+from .config import SLOW_REQUEST_THRESHOLD
+
+# Descriptions sent along with the phase names in Server-Timing
+PHASES = {
+    "auth": "client authentication",
+    "refresh": "access token refresh",
+    "prepare": "credentials, project and onboarding",
+    "transform": "request transformation",
+    "connect": "upstream connection",
+    "ttfb": "upstream time to first byte",
+    "upstream": "upstream body",
+    "response": "response transformation",
+}
+
+
+class RequestRecord:
+    """What is known about the request being handled; set up by the request middleware."""
+    __slots__ = ("start", "model", "account", "phases")
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.model: Optional[str] = None
+        self.account: Optional[str] = None
+        self.phases: Dict[str, float] = {}  # phase -> seconds, summed over retries
+
+    def add(self, phase: str, seconds: float):
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.start
+
+    def server_timing(self) -> str:
+        """The phases measured so far and the time elapsed, as a Server-Timing value."""
+        entries = [
+            f'{phase};dur={seconds * 1000:.1f};desc="{PHASES.get(phase, phase)}"'
+            for phase, seconds in self.phases.items()
+        ]
+        entries.append(f"total;dur={self.elapsed() * 1000:.1f}")
+        return ", ".join(entries)
+
+
+_current_request: ContextVar[Optional[RequestRecord]] = ContextVar("current_request", default=None)
+
+
+def start_request() -> RequestRecord:
+    record = RequestRecord()
+    _current_request.set(record)
+    return record
+
+
+def current_request() -> Optional[RequestRecord]:
+    return _current_request.get()
+
+
+def add_phase(phase: str, seconds: float):
+    """Add time spent in a phase to the current request, if there is one."""
+    record = _current_request.get()
+    if record is not None:
+        record.add(phase, seconds)
+
+
+@contextmanager
+def timed(phase: str):
+    """Time the enclosed block as a phase of the current request."""
+    record = _current_request.get()
+    if record is None:
+        yield
+        return
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        record.add(phase, time.perf_counter() - started_at)
+
+
+class UpstreamTrace:
+    """
+    httpx trace extension splitting the wait for an upstream response into connect
+    (pool wait, TCP and TLS) and TTFB (request sent until the response headers).
+    """
+
+    def __init__(self, record: RequestRecord):
+        self._record = record
+        self._started_at = time.perf_counter()
+        self._sending_at = None
+
+    async def __call__(self, event: str, info: dict):
+        if self._sending_at is None and event.endswith("send_request_headers.started"):
+            self._sending_at = time.perf_counter()
+            self._record.add("connect", self._sending_at - self._started_at)
+
+    def headers_received(self):
+        if self._sending_at is not None:
+            self._record.add("ttfb", time.perf_counter() - self._sending_at)
+
+
+def log_if_slow(record: RequestRecord, method: str, path: str):
+    """Log the phase breakdown of a request that took longer than SLOW_REQUEST_THRESHOLD seconds."""
+    elapsed = record.elapsed()
+    if SLOW_REQUEST_THRESHOLD <= 0 or elapsed < SLOW_REQUEST_THRESHOLD:
+        return
+    phases = ", ".join(f"{phase}={seconds * 1000:.0f}ms" for phase, seconds in record.phases.items())
+    logging.warning(
+        f"Slow request: {method} {path} took {elapsed:.2f}s "
+        f"(model={record.model}, account={record.account}; {phases or 'no phases recorded'})"
+    )
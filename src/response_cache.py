@@ -0,0 +1,143 @@
+"""
+Response Cache - Opt-in cache of upstream replies to deterministic requests, and the
+store of replies to requests sent with an Idempotency-Key.
+
+Requests with temperature 0 or a fixed seed are expected to produce the same reply, so
+CI and eval harnesses that repeat them do not need to spend an upstream call (and quota)
+every time. Entries are keyed on a hash of the final Gemini payload and bounded by count,
+total size and age; the least recently used entries are evicted first.
+Idempotent replies use the same kind of store, keyed on the client's key and the payload.
+"""
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+from .config import (
+    RESPONSE_CACHE_ENABLED,
+    RESPONSE_CACHE_MAX_ENTRIES,
+    RESPONSE_CACHE_MAX_BYTES,
+    RESPONSE_CACHE_TTL,
+    IDEMPOTENCY_TTL,
+    IDEMPOTENCY_MAX_KEYS,
+    IDEMPOTENCY_MAX_BYTES,
+)
+from .utils import StrSlice
+
+
+def is_deterministic(payload: dict) -> bool:
+    """Whether the request pins its sampling (temperature 0 or a seed), making its reply reusable."""
+    generation_config = (payload.get("request") or {}).get("generationConfig") or {}
+    return generation_config.get("temperature") == 0 or generation_config.get("seed") is not None
+
+
+def payload_key(payload: dict) -> str:
+    """
+    Canonical hash of the model and request (contents, systemInstruction, generationConfig,
+    tools, ...). Inline images kept as StrSlice views are hashed in chunks rather than copied.
+    """
+    digest = hashlib.sha256()
+    slices = []
+
+    def register_slice(obj):
+        # A fixed placeholder in the JSON; the slice contents are hashed after it, in order
+        if isinstance(obj, StrSlice):
+            slices.append(obj)
+            return {"\u0000inline": len(obj)}
+        raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+    canonical = json.dumps(
+        {"model": payload.get("model"), "request": payload.get("request")},
+        sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=register_slice,
+    )
+    digest.update(canonical.encode("utf-8"))
+    for piece in slices:
+        for chunk in piece.iter_bytes():
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ResponseCache:
+    """LRU cache with a per-entry TTL, bounded by entry count and total size in bytes."""
+
+    def __init__(self, max_entries: int, max_bytes: int, ttl: float):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (value, size, expires_at)
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, size, expires_at = entry
+        if time.monotonic() >= expires_at:
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key: str, value: Any, size: int):
+        """Store a value; values larger than the whole cache are not stored."""
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (value, size, time.monotonic() + self.ttl)
+        self._bytes += size
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    def record(self, hit: bool):
+        """Count a lookup made on behalf of one request."""
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+
+    def _remove(self, key: str):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": True,
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+_response_cache: Optional[ResponseCache] = (
+    ResponseCache(RESPONSE_CACHE_MAX_ENTRIES, RESPONSE_CACHE_MAX_BYTES, RESPONSE_CACHE_TTL)
+    if RESPONSE_CACHE_ENABLED else None
+)
+
+
+def get_response_cache() -> Optional[ResponseCache]:
+    """The process-wide response cache, or None when RESPONSE_CACHE_ENABLED is off."""
+    return _response_cache
+
+
+_idempotency_store: Optional[ResponseCache] = (
+    ResponseCache(IDEMPOTENCY_MAX_KEYS, IDEMPOTENCY_MAX_BYTES, IDEMPOTENCY_TTL)
+    if IDEMPOTENCY_TTL > 0 else None
+)
+
+
+def get_idempotency_store() -> Optional[ResponseCache]:
+    """Completed replies by Idempotency-Key, or None when IDEMPOTENCY_TTL is 0."""
+    return _idempotency_store
@@ -1,4 +1,10 @@
-import os, platform
+import os, re, json, platform, tempfile
+from contextlib import contextmanager
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
 from .config import USER_AGENT
 
 def get_user_agent():
@@ -25,11 +31,88 @@ def get_platform_string():
     else:
         return "PLATFORM_UNSPECIFIED"
 
-def get_client_metadata(project_id=None):
-    is_anti = os.getenv("PROXY_TYPE") == "antigravity"
+def get_client_metadata(project_id=None, proxy_type=None):
+    is_anti = (proxy_type or os.getenv("PROXY_TYPE")) == "antigravity"
     return {
         "ideType": "ANTIGRAVITY" if is_anti else "IDE_UNSPECIFIED",
         "platform": get_platform_string(),
         "pluginType": "GEMINI",
         "duetProject": project_id,
-    }
\ No newline at end of file
+    }
+
+def write_json_atomic(path, data, indent=2):
+    """Write JSON to a temp file in the same directory and rename it over the target,
+    so readers never see a partially written file."""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-", suffix=".json")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=indent)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+@contextmanager
+def file_lock(path):
+    """Hold an exclusive lock shared with other processes on `path`.lock for the enclosed block."""
+    with open(path + ".lock", "a+") as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class StrSlice:
+    """A lazy view of source[start:end].
+
+    Large base64 bodies (inline images) are carried through the request pipeline as
+    slices of the string the request JSON was parsed into, and written to the upstream
+    request in chunks, instead of being copied out and re-serialized as a whole."""
+    __slots__ = ("source", "start", "end")
+
+    def __init__(self, source, start=0, end=None):
+        self.source = source
+        self.start = start
+        self.end = len(source) if end is None else end
+
+    def __len__(self):
+        return self.end - self.start
+
+    def __str__(self):
+        return self.source[self.start:self.end]
+
+    def iter_bytes(self, chunk_size=64 * 1024):
+        """Yield the slice as ASCII bytes, one chunk at a time."""
+        for pos in range(self.start, self.end, chunk_size):
+            yield self.source[pos:min(pos + chunk_size, self.end)].encode("ascii")
+
+
+# Characters of (URL-safe) base64, none of which need escaping in JSON
+_BASE64_BODY = re.compile(r'[A-Za-z0-9+/=_-]*')
+# Bodies smaller than this are simply sliced; the chunked path only pays off for large images
+BASE64_VIEW_MIN_SIZE = 32 * 1024
+
+
+def base64_view(source, start=0, end=None):
+    """Return source[start:end] as a StrSlice if it is a large base64 body, otherwise as a plain str."""
+    if end is None:
+        end = len(source)
+    if end - start >= BASE64_VIEW_MIN_SIZE and _BASE64_BODY.fullmatch(source, start, end):
+        return StrSlice(source, start, end)
+    return source[start:end]
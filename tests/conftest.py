@@ -0,0 +1,43 @@
+import os
+import sys
+
+import pytest
+
+# The proxy (src/) and the manager (manager.py) are imported from the repository root
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from google.oauth2.credentials import Credentials  # noqa: E402
+
+from src.accounts import Account  # noqa: E402
+
+
+class StaticAccount(Account):
+    """An account with a fixed token and project, so no Google call is needed to prepare it."""
+
+    def __init__(self, name: str, proxy_type: str = "cli"):
+        super().__init__(name, proxy_type)
+        self.project_id = f"project-{name}"
+        self._credentials = Credentials(token=f"token-{name}")
+
+    @property
+    def credentials(self):
+        return self._credentials
+
+    def prepare(self):
+        return self._credentials, self.project_id
+
+    def refresh(self, margin=0):
+        pass
+
+
+@pytest.fixture(scope="module")
+def manager():
+    # manager.py resolves its static files, templates and data files from the working directory
+    cwd = os.getcwd()
+    os.chdir(ROOT)
+    try:
+        import manager
+        yield manager
+    finally:
+        os.chdir(cwd)
@@ -0,0 +1,92 @@
+import asyncio
+import json
+import time
+
+import httpx
+import pytest
+
+from src import accounts, google_api_client
+from src.accounts import AccountPool
+from src.google_api_client import GeminiResult, _send_upstream
+
+from conftest import StaticAccount
+
+MODEL = "gemini-2.5-pro"
+REPLY = {"response": {"candidates": [{"content": {"role": "model", "parts": [{"text": "hi"}]}}]}, "traceId": "t"}
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    """Install a pool of accounts a, b and c and an upstream answering per account from `behaviour`."""
+    pool = AccountPool([StaticAccount(name) for name in "abc"])
+    behaviour = {}
+    calls = []
+
+    def handle(request: httpx.Request):
+        name = request.headers["Authorization"].rsplit("-", 1)[1]
+        calls.append(name)
+        action = behaviour.get(name, "ok")
+        if action == "reset":
+            raise httpx.ConnectError("connection reset", request=request)
+        if action == "429":
+            return httpx.Response(429, json={"error": {"code": 429, "message": "exhausted"}})
+        return httpx.Response(200, json=REPLY)
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handle))
+    monkeypatch.setattr(accounts, "_account_pool", pool)
+    monkeypatch.setattr(google_api_client, "_http_client", client)
+    return pool, behaviour, calls
+
+
+def _send(count=1):
+    async def main():
+        return [await _send_upstream({"model": MODEL, "request": {}}, False) for _ in range(count)]
+    return asyncio.run(main())
+
+
+def test_requests_are_spread_over_the_accounts(upstream):
+    pool, behaviour, calls = upstream
+    results = _send(6)
+    assert all(isinstance(result, GeminiResult) for result in results)
+    assert sorted(calls) == ["a", "a", "b", "b", "c", "c"]
+
+
+def test_rate_limited_account_fails_over_and_cools_down_for_the_model(upstream):
+    pool, behaviour, calls = upstream
+    behaviour["a"] = "429"
+    result, = _send()
+    assert isinstance(result, GeminiResult)
+    assert calls == ["a", "b"]
+    a = pool.accounts[0]
+    assert a.model_cooldowns[MODEL] > time.monotonic()
+    assert a.is_available(time.monotonic())  # other models are unaffected
+
+
+def test_transport_error_fails_over_and_cools_the_account_down(upstream):
+    pool, behaviour, calls = upstream
+    behaviour["a"] = "reset"
+    result, = _send()
+    assert isinstance(result, GeminiResult)
+    assert json.loads(result.raw) == REPLY
+    assert calls == ["a", "b"]
+    a = pool.accounts[0]
+    assert not a.is_available(time.monotonic())
+    assert "connection reset" in a.last_error
+
+    calls.clear()
+    _send(2)
+    assert "a" not in calls
+
+
+def test_error_is_returned_when_every_account_fails(upstream):
+    pool, behaviour, calls = upstream
+    behaviour.update(a="reset", b="reset", c="reset")
+    result, = _send()
+    assert result.status_code == 500
+    assert sorted(calls) == ["a", "b", "c"]
+
+    behaviour.update(a="429", b="429", c="429")
+    for account in pool.accounts:
+        account.disabled_until = 0.0
+    result, = _send()
+    assert result.status_code == 429
@@ -0,0 +1,132 @@
+import asyncio
+import gc
+
+from src.coalescing import RequestCoalescer, StreamBroadcast
+
+
+async def _chunks(read, count=20, delay=0.005):
+    for i in range(count):
+        await asyncio.sleep(delay)
+        read.append(i)
+        yield i
+
+
+def _share_stream(read):
+    def share(result, done):
+        broadcast = StreamBroadcast(_chunks(read), done)
+        return broadcast.subscribe
+    return share
+
+
+def _share_value(result, done):
+    done()
+    return lambda: result
+
+
+def test_concurrent_callers_share_one_fetch():
+    async def main():
+        coalescer = RequestCoalescer()
+        calls = []
+
+        async def fetch():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return "reply"
+
+        results = await asyncio.gather(*(coalescer.run("k", fetch, _share_value) for _ in range(5)))
+        return results, calls, coalescer.stats()
+
+    results, calls, stats = asyncio.run(main())
+    assert results == ["reply"] * 5
+    assert len(calls) == 1
+    assert stats == {"in_flight": 0, "leaders": 1, "coalesced": 4}
+
+
+def test_stream_is_fanned_out_from_the_first_chunk():
+    async def main():
+        coalescer = RequestCoalescer()
+        read = []
+
+        async def fetch():
+            return "stream"
+
+        async def consume(delay):
+            await asyncio.sleep(delay)
+            subscription = await coalescer.run("k", fetch, _share_stream(read))
+            return [chunk async for chunk in subscription]
+
+        early, late = await asyncio.gather(consume(0), consume(0.03))  # late joins mid-stream
+        return early, late, read, coalescer.stats()
+
+    early, late, read, stats = asyncio.run(main())
+    assert early == late == list(range(20))
+    assert read == list(range(20))  # upstream read once
+    assert stats == {"in_flight": 0, "leaders": 1, "coalesced": 1}
+
+
+def test_cancelled_caller_does_not_cancel_the_flight_for_others():
+    async def main():
+        coalescer = RequestCoalescer()
+
+        async def fetch():
+            await asyncio.sleep(0.02)
+            return "reply"
+
+        leader = asyncio.ensure_future(coalescer.run("k", fetch, _share_value))
+        follower = asyncio.ensure_future(coalescer.run("k", fetch, _share_value))
+        await asyncio.sleep(0.005)
+        leader.cancel()
+        return await follower, leader.cancelled()
+
+    assert asyncio.run(main()) == ("reply", True)
+
+
+def test_stream_is_released_when_every_caller_went_away():
+    async def main():
+        coalescer = RequestCoalescer()
+        read = []
+
+        async def fetch():
+            await asyncio.sleep(0.01)
+            return "stream"
+
+        caller = asyncio.ensure_future(coalescer.run("k", fetch, _share_stream(read)))
+        await asyncio.sleep(0.001)
+        caller.cancel()
+        await asyncio.sleep(0.1)
+        return read, coalescer.stats()
+
+    read, stats = asyncio.run(main())
+    assert read == []
+    assert stats["in_flight"] == 0
+
+
+def test_unstarted_subscription_stops_counting_when_dropped():
+    async def main():
+        read, finished = [], []
+        broadcast = StreamBroadcast(_chunks(read), lambda: finished.append(True))
+        reader = broadcast.subscribe()
+        dropped = broadcast.subscribe()
+        first = await reader.__anext__()
+        del dropped
+        gc.collect()
+        await reader.aclose()  # the last subscriber leaves before the end of the stream
+        await asyncio.sleep(0.05)
+        return first, read, finished
+
+    first, read, finished = asyncio.run(main())
+    assert first == 0
+    assert len(read) < 20
+    assert finished == [True]
+
+
+def test_subscriber_keeps_the_stream_alive_after_another_leaves():
+    async def main():
+        read = []
+        broadcast = StreamBroadcast(_chunks(read), lambda: None)
+        leaving, staying = broadcast.subscribe(), broadcast.subscribe()
+        await leaving.__anext__()
+        await leaving.aclose()
+        return [chunk async for chunk in staying]
+
+    assert asyncio.run(main()) == list(range(20))
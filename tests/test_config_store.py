@@ -0,0 +1,53 @@
+import asyncio
+import json
+import os
+
+
+def test_changes_are_saved_once_after_the_delay(manager, tmp_path):
+    path = str(tmp_path / "servers_config.json")
+    store = manager.ConfigStore(path, save_delay=0.02)
+
+    async def main():
+        store.put({"id": "a", "port": 8001})
+        store.put({"id": "b", "port": 8002})
+        store.update("a", port=8003)
+        assert not os.path.exists(path)
+        await asyncio.sleep(0.05)
+        await store._save_task
+
+    asyncio.run(main())
+    with open(path, encoding="utf-8") as f:
+        assert json.load(f) == [{"id": "a", "port": 8003}, {"id": "b", "port": 8002}]
+
+
+def test_flush_from_a_worker_thread_cancels_the_timer_on_the_loop(manager, tmp_path):
+    path = str(tmp_path / "servers_config.json")
+    store = manager.ConfigStore(path, save_delay=60)
+
+    async def main():
+        store.put({"id": "a"})
+        handle = store._save_handle
+        await asyncio.to_thread(store.flush)
+        await asyncio.sleep(0)
+        return handle
+
+    handle = asyncio.run(main())
+    assert handle.cancelled()
+    assert store._save_handle is None
+    with open(path, encoding="utf-8") as f:
+        assert json.load(f) == [{"id": "a"}]
+
+
+def test_background_save_errors_are_reported(manager, tmp_path, capsys):
+    path = str(tmp_path / "missing" / "servers_config.json")
+    store = manager.ConfigStore(path, save_delay=0.01)
+
+    async def main():
+        store.put({"id": "a"})
+        await asyncio.sleep(0.05)
+        return store._save_task
+
+    task = asyncio.run(main())
+    assert task.exception() is not None
+    assert f"Could not save {path}" in capsys.readouterr().out
+    assert store._dirty  # retried on the next change or at exit
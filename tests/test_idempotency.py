@@ -0,0 +1,151 @@
+import asyncio
+import json
+
+import pytest
+from fastapi import Response
+
+from src import google_api_client
+from src.coalescing import RequestCoalescer
+from src.google_api_client import GeminiResult, GeminiStreamingResponse, send_gemini_request
+from src.response_cache import ResponseCache
+
+PAYLOAD = {"model": "gemini-2.5-pro", "request": {"contents": [{"role": "user", "parts": [{"text": "hi"}]}]}}
+RAW = json.dumps({"response": {"candidates": [{"content": {"parts": [{"text": "hi"}]}}]}}).encode()
+
+
+def _chunk(i):
+    return {"candidates": [{"content": {"parts": [{"text": f"tok{i} "}]}}]}
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    """A fresh idempotency store and coalescer, and an upstream answering from `replies`."""
+    store = ResponseCache(max_entries=10, max_bytes=1024 * 1024, ttl=60)
+    state = {"calls": 0, "replies": [], "read": []}
+
+    async def chunks(count, error):
+        for i in range(count):
+            await asyncio.sleep(0.005)
+            state["read"].append(i)
+            yield _chunk(i)
+        if error:
+            yield {"error": {"message": "upstream broke", "code": 500}}
+
+    async def send_upstream(payload, is_streaming):
+        state["calls"] += 1
+        reply = state["replies"].pop(0) if state["replies"] else "ok"
+        if reply == "fail":
+            return Response(content=b'{"error": {"code": 500}}', status_code=500, media_type="application/json")
+        if is_streaming:
+            return GeminiStreamingResponse(chunks(state.get("length", 10), reply == "error chunk"))
+        return GeminiResult(RAW)
+
+    monkeypatch.setattr(google_api_client, "_send_upstream", send_upstream)
+    monkeypatch.setattr(google_api_client, "get_idempotency_store", lambda: store)
+    monkeypatch.setattr(google_api_client, "get_response_cache", lambda: None)
+    monkeypatch.setattr(google_api_client, "REQUEST_COALESCING", "off")
+    coalescer = RequestCoalescer()
+    monkeypatch.setattr(google_api_client, "get_coalescer", lambda: coalescer)
+    state["store"] = store
+    return state
+
+
+async def _read(response, count=None):
+    chunks = response.iter_chunks()
+    received = []
+    try:
+        async for chunk in chunks:
+            received.append(chunk)
+            if len(received) == count:
+                break
+    finally:
+        await chunks.aclose()
+    return received
+
+
+def test_non_streaming_retry_is_replayed(upstream):
+    async def main():
+        first = await send_gemini_request(PAYLOAD, False, "key-1")
+        retry = await send_gemini_request(PAYLOAD, False, "key-1")
+        other = await send_gemini_request(PAYLOAD, False, "key-2")
+        return first, retry, other
+
+    first, retry, other = asyncio.run(main())
+    assert first.raw == retry.raw == other.raw == RAW
+    assert upstream["calls"] == 2
+
+
+def test_stream_retry_after_disconnect_joins_the_original(upstream):
+    async def main():
+        first = await send_gemini_request(PAYLOAD, True, "key")
+        partial = await _read(first, 2)  # the client times out and goes away
+        await asyncio.sleep(0.02)
+        retry = await send_gemini_request(PAYLOAD, True, "key")
+        joined = await _read(retry)
+        replayed = await _read(await send_gemini_request(PAYLOAD, True, "key"))
+        return partial, joined, replayed
+
+    partial, joined, replayed = asyncio.run(main())
+    full = [_chunk(i) for i in range(10)]
+    assert partial == full[:2]
+    assert joined == replayed == full
+    assert upstream["calls"] == 1
+    assert upstream["read"] == list(range(10))
+
+
+def test_stream_nobody_waits_for_is_finished_and_stored(upstream):
+    async def main():
+        caller = asyncio.ensure_future(send_gemini_request(PAYLOAD, True, "key"))
+        await asyncio.sleep(0)
+        caller.cancel()
+        await asyncio.sleep(0.1)
+        return await _read(await send_gemini_request(PAYLOAD, True, "key"))
+
+    assert asyncio.run(main()) == [_chunk(i) for i in range(10)]
+    assert upstream["calls"] == 1
+
+
+def test_failures_are_not_stored(upstream):
+    upstream["replies"] = ["fail", "ok", "error chunk"]
+
+    async def main():
+        failed = await send_gemini_request(PAYLOAD, False, "key")
+        retried = await send_gemini_request(PAYLOAD, False, "key")
+        broken = await _read(await send_gemini_request(PAYLOAD, True, "stream-key"))
+        fresh = await _read(await send_gemini_request(PAYLOAD, True, "stream-key"))
+        return failed, retried, broken, fresh
+
+    failed, retried, broken, fresh = asyncio.run(main())
+    assert failed.status_code == 500
+    assert retried.raw == RAW
+    assert "error" in broken[-1]
+    assert fresh == [_chunk(i) for i in range(10)]
+    assert upstream["calls"] == 4
+
+
+def test_stream_too_large_for_the_store_is_not_read_on(upstream):
+    upstream["store"].max_bytes = 200  # a few chunks
+    upstream["length"] = 50
+
+    async def main():
+        first = await send_gemini_request(PAYLOAD, True, "key")
+        await _read(first, 1)
+        await asyncio.sleep(0.1)
+        read_after_disconnect = len(upstream["read"])
+        await _read(await send_gemini_request(PAYLOAD, True, "key"))
+        return read_after_disconnect
+
+    assert asyncio.run(main()) < 10
+    assert upstream["calls"] == 2  # neither stored nor still in flight
+
+
+def test_store_keeps_at_most_max_entries(upstream):
+    upstream["store"].max_entries = 2
+
+    async def main():
+        for key in ("a", "b", "c", "a"):
+            await send_gemini_request(PAYLOAD, False, key)
+
+    asyncio.run(main())
+    assert upstream["calls"] == 4  # "a" was evicted by "c"
+    assert upstream["store"].stats()["entries"] == 2
@@ -0,0 +1,43 @@
+import json
+
+from src.google_api_client import _splice_json_member, _usage_metadata
+
+
+def test_splice_returns_nested_object_verbatim():
+    response = {"candidates": [{"content": {"parts": [{"text": "hi"}]}}], "usageMetadata": {"promptTokenCount": 3}}
+    raw = json.dumps({"response": response, "traceId": "t"}).encode()
+    body = _splice_json_member(raw, b"response")
+    assert json.loads(body) == response
+    assert raw.count(body) == 1
+
+
+def test_splice_ignores_nested_members_with_the_same_name():
+    raw = b'{"outer": {"response": {"wrong": 1}}, "response": {"right": [1, {"x": 2}]}}'
+    assert _splice_json_member(raw, b"response") == b'{"right": [1, {"x": 2}]}'
+
+
+def test_splice_skips_brackets_and_escaped_quotes_inside_strings():
+    text = 'he said \\"response\\": {[ and left }'
+    raw = ('{"response": {"text": "' + text + '", "n": "\\\\"}, "traceId": "t"}').encode()
+    body = _splice_json_member(raw, b"response")
+    assert json.loads(body) == {"text": 'he said "response": {[ and left }', "n": "\\"}
+
+
+def test_splice_missing_or_scalar_member():
+    assert _splice_json_member(b'{"traceId": "t"}', b"response") is None
+    assert _splice_json_member(b'{"response": "text"}', b"response") is None
+    assert _splice_json_member(b'{"response": {"truncated": [1, 2', b"response") is None
+
+
+def test_usage_metadata_is_decoded_from_the_end_of_the_body():
+    usage = {"promptTokenCount": 3, "candidatesTokenCount": 2, "details": [{"modality": "TEXT"}]}
+    raw = json.dumps({"response": {
+        "candidates": [{"content": {"parts": [{"text": 'quoting "usageMetadata": {"promptTokenCount": 99}'}]}}],
+        "usageMetadata": usage,
+    }, "traceId": "t"}).encode()
+    assert _usage_metadata(raw) == usage
+
+
+def test_usage_metadata_missing():
+    assert _usage_metadata(b'{"response": {"candidates": []}, "traceId": "t"}') is None
+    assert _usage_metadata(b'{"response": {"usageMetadata": "n/a"}}') is None
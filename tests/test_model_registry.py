@@ -0,0 +1,45 @@
+import json
+
+import pytest
+
+from src import accounts
+from src.accounts import AccountPool
+from src.model_registry import gemini_models_json, openai_models_json, resolve_model
+
+from conftest import StaticAccount
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    pool = AccountPool([StaticAccount("cli"), StaticAccount("anti", "antigravity")])
+    monkeypatch.setattr(accounts, "_account_pool", pool)
+    return pool
+
+
+def test_advertised_models_resolve(pool):
+    assert resolve_model("gemini-2.5-pro").base_model == "gemini-2.5-pro"
+    assert resolve_model("models/gemini-2.5-flash-nothinking").base_model == "gemini-2.5-flash"
+
+
+def test_unknown_models_pass_through_until_a_catalog_is_fetched(pool):
+    assert resolve_model("brand-new-model").base_model == "brand-new-model"
+
+    pool.accounts[1].apply_catalog(frozenset({"gemini-2.5-pro", "brand-new-model"}))
+    assert resolve_model("brand-new-model-nothinking").base_model == "brand-new-model"
+    assert resolve_model("no-such-model") is None
+
+
+def test_cli_only_pool_rejects_unknown_models(monkeypatch):
+    monkeypatch.setattr(accounts, "_account_pool", AccountPool([StaticAccount("cli")]))
+    assert resolve_model("no-such-model") is None
+
+
+def test_model_lists_follow_the_catalogs(pool):
+    before = json.loads(openai_models_json())
+    assert "brand-new-model" not in [model["id"] for model in before["data"]]
+
+    pool.accounts[1].apply_catalog(frozenset({"gemini-2.5-pro", "brand-new-model"}))
+    ids = [model["id"] for model in json.loads(openai_models_json())["data"]]
+    names = [model["name"] for model in json.loads(gemini_models_json())["models"]]
+    assert ids.count("brand-new-model") == 1 and ids.count("gemini-2.5-pro") == 1
+    assert names.count("models/brand-new-model") == 1
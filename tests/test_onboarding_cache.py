@@ -0,0 +1,53 @@
+import json
+
+import pytest
+from google.oauth2.credentials import Credentials
+
+from src import auth
+
+
+@pytest.fixture
+def cache_file(tmp_path, monkeypatch):
+    path = tmp_path / "onboarding_cache.json"
+    monkeypatch.setattr(auth, "ONBOARDING_CACHE_FILE", str(path))
+    monkeypatch.setattr(auth, "_onboarding_cache", None)
+    return path
+
+
+def _new_process(monkeypatch):
+    """Forget the in-memory copy, as a freshly started proxy would not have it."""
+    monkeypatch.setattr(auth, "_onboarding_cache", None)
+
+
+def test_proxies_sharing_the_file_keep_each_others_entries(cache_file, monkeypatch):
+    first, second = Credentials("t1", refresh_token="r1"), Credentials("t2", refresh_token="r2")
+
+    # Both proxies load the (empty) cache before either of them writes
+    assert auth.get_cached_project_id(first, "cli") is None
+    first_view = auth._onboarding_cache
+    _new_process(monkeypatch)
+    assert auth.get_cached_project_id(second, "cli") is None
+    second_view = auth._onboarding_cache
+
+    monkeypatch.setattr(auth, "_onboarding_cache", first_view)
+    auth.cache_onboarding(first, "project-1", {"id": "free-tier"}, "cli")
+    monkeypatch.setattr(auth, "_onboarding_cache", second_view)
+    auth.cache_onboarding(second, "project-2", {"id": "standard-tier"}, "antigravity")
+
+    on_disk = json.loads(cache_file.read_text())
+    assert len(on_disk) == 2
+
+    # After a restart both accounts skip the handshake
+    _new_process(monkeypatch)
+    assert auth.get_cached_tier(first, "project-1", "cli") == {"id": "free-tier"}
+    assert auth.get_cached_tier(second, "project-2", "antigravity") == {"id": "standard-tier"}
+
+
+def test_recording_a_project_keeps_the_onboarded_tiers(cache_file, monkeypatch):
+    creds = Credentials("t", refresh_token="r")
+    auth.cache_onboarding(creds, "project-1", {"id": "free-tier"}, "cli")
+    auth.cache_onboarding(creds, "project-2", proxy_type="cli")
+    _new_process(monkeypatch)
+    assert auth.get_cached_project_id(creds, "cli") == "project-2"
+    assert auth.get_cached_tier(creds, "project-1", "cli") == {"id": "free-tier"}
+    assert auth.get_cached_tier(creds, "project-2", "cli") is None
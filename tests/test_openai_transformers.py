@@ -0,0 +1,139 @@
+import asyncio
+import json
+
+from src.google_api_client import _serialize_payload
+from src.models import OpenAIChatCompletionRequest
+from src.openai_transformers import gemini_response_to_openai, gemini_stream_chunk_to_openai, openai_request_to_gemini
+from src.utils import BASE64_VIEW_MIN_SIZE, StrSlice
+
+# Outputs below are those of the transformers before the single-pass rewrite
+IMG = "iVBORw0KGgo" + "A" * 40
+
+
+def _plain(obj):
+    """The payload as the upstream receives it (base64 views become strings)."""
+    return json.loads(json.dumps(obj, default=str))
+
+
+def _request(**fields):
+    return OpenAIChatCompletionRequest(**{"model": "gemini-2.5-flash", **fields})
+
+
+def test_text_system_and_generation_settings():
+    gemini = openai_request_to_gemini(_request(
+        temperature=0.2, max_tokens=100, stop="END",
+        messages=[
+            {"role": "system", "content": "Be brief."},
+            {"role": "system", "content": [{"type": "text", "text": "Answer in English."}, {"type": "image_url", "image_url": {"url": "x"}}]},
+            {"role": "user", "content": "plain text"},
+            {"role": "assistant", "content": "plain answer"},
+        ],
+    ))
+    assert gemini["contents"] == [
+        {"role": "user", "parts": [{"text": "plain text"}]},
+        {"role": "model", "parts": [{"text": "plain answer"}]},
+    ]
+    assert gemini["systemInstruction"] == {"parts": [{"text": "Be brief."}, {"text": "Answer in English."}]}
+    assert gemini["generationConfig"] == {
+        "temperature": 0.2, "maxOutputTokens": 100, "stopSequences": ["END"],
+        "thinkingConfig": {"includeThoughts": True, "thinkingBudget": -1},
+    }
+    assert gemini["model"] == "gemini-2.5-flash"
+
+
+def test_image_url_and_markdown_images():
+    gemini = openai_request_to_gemini(_request(messages=[{"role": "user", "content": [
+        {"type": "text", "text": f"look at ![cat](data:image/png;base64,{IMG}) and ![remote](https://x/y.png) done"},
+        {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{IMG}"}},
+        {"type": "image_url", "image_url": {"url": "https://example.com/a.png"}},
+        {"type": "text", "text": "![pdf](data:application/pdf;base64,AAAA)"},
+        {"type": "text", "text": "![quoted]( 'data:image/gif;base64,R0lG' )"},
+    ]}]))
+    assert _plain(gemini["contents"]) == [{"role": "user", "parts": [
+        {"text": "look at "},
+        {"inlineData": {"mimeType": "image/png", "data": IMG}},
+        {"text": " and "},
+        {"text": "![remote](https://x/y.png)"},
+        {"text": " done"},
+        {"inlineData": {"mimeType": "image/jpeg", "data": IMG}},
+        {"text": "![pdf](data:application/pdf;base64,AAAA)"},
+        {"inlineData": {"mimeType": "image/gif", "data": "R0lG"}},
+    ]}]
+
+
+def test_tool_call_messages_are_passed_as_text():
+    gemini = openai_request_to_gemini(_request(messages=[
+        {"role": "user", "content": "call f"},
+        {"role": "assistant", "content": "", "tool_calls": [{"id": "c1", "type": "function", "function": {"name": "f", "arguments": "{}"}}]},
+        {"role": "tool", "content": '{"ok": true}', "tool_call_id": "c1"},
+    ]))
+    assert gemini["contents"] == [
+        {"role": "user", "parts": [{"text": "call f"}]},
+        {"role": "model", "parts": [{"text": ""}]},
+        {"role": "tool", "parts": [{"text": '{"ok": true}'}]},
+    ]
+
+
+def test_thinking_budgets():
+    def thinking(model, effort=None):
+        gemini = openai_request_to_gemini(OpenAIChatCompletionRequest(
+            model=model, messages=[{"role": "user", "content": "hi"}], reasoning_effort=effort
+        ))
+        return gemini["generationConfig"].get("thinkingConfig")
+
+    assert thinking("gemini-2.5-pro-maxthinking", "low") == {"includeThoughts": True, "thinkingBudget": 32768}
+    assert thinking("gemini-2.5-flash", "high") == {"includeThoughts": True, "thinkingBudget": 24576}
+    assert thinking("gemini-2.5-flash", "minimal") == {"includeThoughts": True, "thinkingBudget": 0}
+
+
+def test_large_images_are_sent_from_the_request_string():
+    big = "A" * BASE64_VIEW_MIN_SIZE
+    request = _request(messages=[{"role": "user", "content": [
+        {"type": "text", "text": f"![a](data:image/png;base64,{big})"},
+        {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{big}"}},
+    ]}])
+    gemini = openai_request_to_gemini(request)
+    parts = gemini["contents"][0]["parts"]
+    assert all(isinstance(part["inlineData"]["data"], StrSlice) for part in parts)
+    assert parts[0]["inlineData"]["data"].source is request.messages[0].content[0]["text"]
+
+    body, content_length = _serialize_payload(gemini)
+
+    async def read():
+        return b"".join([chunk async for chunk in body])
+
+    sent = asyncio.run(read())
+    assert len(sent) == content_length
+    assert json.loads(sent) == _plain(gemini)
+
+
+GEMINI_REPLY = {"candidates": [
+    {"content": {"role": "model", "parts": [
+        {"text": "let me think", "thought": True},
+        {"text": "answer"},
+        {"functionCall": {"name": "f", "args": {}}},
+        {"inlineData": {"mimeType": "image/png", "data": IMG}},
+        {"text": "tail"},
+    ]}, "finishReason": "STOP", "index": 0},
+    {"content": {"role": "model", "parts": [{"text": "", "thought": True}]}, "finishReason": "MAX_TOKENS", "index": 1},
+]}
+CONTENT = f"answer\n\n![image](data:image/png;base64,{IMG})\n\ntail"
+
+
+def test_response_with_thinking_tool_call_and_image_parts():
+    openai = gemini_response_to_openai(GEMINI_REPLY, "m")
+    assert openai["object"] == "chat.completion" and openai["model"] == "m"
+    assert openai["choices"] == [
+        {"index": 0, "finish_reason": "stop",
+         "message": {"role": "assistant", "content": CONTENT, "reasoning_content": "let me think"}},
+        {"index": 1, "finish_reason": "length", "message": {"role": "assistant", "content": ""}},
+    ]
+
+
+def test_stream_chunk_with_thinking_tool_call_and_image_parts():
+    openai = gemini_stream_chunk_to_openai(GEMINI_REPLY, "m", "rid")
+    assert openai["id"] == "rid" and openai["object"] == "chat.completion.chunk"
+    assert openai["choices"] == [
+        {"index": 0, "finish_reason": "stop", "delta": {"content": CONTENT, "reasoning_content": "let me think"}},
+        {"index": 1, "finish_reason": "length", "delta": {}},
+    ]
@@ -0,0 +1,81 @@
+import time
+from datetime import datetime, timezone
+
+import pytest
+
+
+def _iso(ts):
+    return datetime.fromtimestamp(ts, timezone.utc).isoformat()
+
+
+def test_projection_of_a_steady_burn(manager):
+    now = 1_700_000_000
+    # 0.05 used every 10 minutes: 0.3 per hour
+    points = [(now - 3600 + k * 600, 0.9 - 0.05 * k) for k in range(7)]
+    result = manager._project(points, _iso(now + 7200), now)
+    assert result["remaining"] == pytest.approx(0.6)
+    assert result["burn_rate_per_hour"] == pytest.approx(0.3)
+    assert datetime.fromisoformat(result["exhausts_at"]).timestamp() == pytest.approx(now + 7200)
+    assert result["exhausts_before_reset"] is False
+
+
+def test_projection_starts_after_the_last_reset(manager):
+    now = 1_700_000_000
+    before = [(now - 3000 + k * 600, 0.5 - 0.2 * k) for k in range(2)]  # fast burn, then a reset
+    after = [(now - 1200 + k * 600, 1.0 - 0.1 * k) for k in range(3)]
+    result = manager._project(before + after, _iso(now + 36000), now)
+    assert result["burn_rate_per_hour"] == pytest.approx(0.6)
+    assert result["exhausts_before_reset"] is True
+
+
+def test_projection_ignores_samples_outside_the_window(manager):
+    now = 1_700_000_000
+    old = [(now - manager.QUOTA_PROJECTION_WINDOW - 3600, 1.0)]
+    recent = [(now - 600, 0.5), (now, 0.5)]
+    result = manager._project(old + recent, None, now)
+    assert result["burn_rate_per_hour"] == 0.0
+    assert result["exhausts_at"] is None
+    assert result["exhausts_before_reset"] is None
+
+
+def test_summary_reads_the_ring_buffer_in_order(manager):
+    history = manager.QuotaHistory(capacity=4)
+    now = time.time()
+    for k in range(6):  # wraps around: only the last 4 samples are kept
+        quotas = [{"modelId": "gemini-2.5-pro", "remainingFraction": 1.0 - 0.1 * k, "resetTime": _iso(now + 86400)}]
+        if k % 2 == 0:
+            quotas.append({"modelId": "claude-sonnet-4-5", "remainingFraction": 0.5})
+        history.record("s1", quotas, now - 600 * (5 - k))
+
+    summary = history.summary("s1", hours=24, max_points=10)
+    series = summary["gemini-2.5-pro"]["series"]
+    assert [t for t, _ in series] == [int(now - 600 * (5 - k)) for k in range(2, 6)]
+    assert [v for _, v in series] == pytest.approx([0.8, 0.7, 0.6, 0.5], abs=1e-3)
+    assert summary["gemini-2.5-pro"]["burn_rate_per_hour"] == pytest.approx(0.6, abs=1e-2)
+    assert len(summary["claude-sonnet-4-5"]["series"]) == 2  # missing from the other samples
+    assert history.summary("unknown", hours=24, max_points=10) == {}
+
+
+def test_downsample_averages_buckets(manager):
+    points = [(k, k / 10) for k in range(10)]
+    assert manager._downsample(points, 20) == [[t, round(v, 4)] for t, v in points]
+    assert manager._downsample(points, 2) == [[2, 0.2], [7, 0.7]]
+
+
+def test_save_and_load_round_trip(manager, tmp_path):
+    history = manager.QuotaHistory(capacity=4)
+    now = time.time()
+    for k in range(3):
+        history.record("s1", [{"modelId": "gemini-2.5-pro", "remainingFraction": 1.0 - 0.1 * k}], now - 600 * (2 - k))
+    path = str(tmp_path / "quota_history.json")
+    history.save(path)
+    history.save(path)  # a second save replaces the file rather than reusing a fixed temp name
+    assert [p.name for p in tmp_path.iterdir()] == ["quota_history.json"]
+
+    restored = manager.QuotaHistory(capacity=4)
+    restored.load(path)
+    assert restored.summary("s1", hours=24, max_points=10) == history.summary("s1", hours=24, max_points=10)
+
+    resized = manager.QuotaHistory(capacity=8)
+    resized.load(path)
+    assert resized.summary("s1", hours=24, max_points=10) == {}
@@ -0,0 +1,55 @@
+import pytest
+
+from src import response_cache
+from src.response_cache import ResponseCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(response_cache.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_entries_expire_after_ttl(clock):
+    cache = ResponseCache(max_entries=10, max_bytes=1000, ttl=30)
+    cache.put("a", b"A", 1)
+    clock[0] += 29.9
+    assert cache.get("a") == b"A"
+    clock[0] += 0.1
+    assert cache.get("a") is None
+    assert cache.stats()["entries"] == 0
+    assert cache.stats()["bytes"] == 0
+
+
+def test_least_recently_used_entry_is_evicted_by_count(clock):
+    cache = ResponseCache(max_entries=2, max_bytes=1000, ttl=30)
+    cache.put("a", b"A", 1)
+    cache.put("b", b"B", 1)
+    assert cache.get("a") == b"A"  # "b" is now the least recently used
+    cache.put("c", b"C", 1)
+    assert cache.get("b") is None
+    assert cache.get("a") == b"A"
+    assert cache.get("c") == b"C"
+    assert cache.evictions == 1
+
+
+def test_entries_are_evicted_by_size(clock):
+    cache = ResponseCache(max_entries=10, max_bytes=10, ttl=30)
+    cache.put("a", b"A", 4)
+    cache.put("b", b"B", 4)
+    cache.put("c", b"C", 4)
+    assert cache.get("a") is None
+    assert cache.stats()["bytes"] == 8
+    cache.put("huge", b"H", 11)  # larger than the whole cache: not stored, nothing evicted
+    assert cache.get("huge") is None
+    assert cache.get("b") == b"B" and cache.get("c") == b"C"
+
+
+def test_replacing_an_entry_keeps_the_size_accounting(clock):
+    cache = ResponseCache(max_entries=10, max_bytes=10, ttl=30)
+    cache.put("a", b"A", 6)
+    cache.put("a", b"AA", 8)
+    assert cache.get("a") == b"AA"
+    assert cache.stats()["bytes"] == 8
+    assert cache.evictions == 0